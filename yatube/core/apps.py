@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.conf import settings
+from PIL import Image
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # ни один декодер Pillow в процессе не возьмется за картинку
+        # больше лимита загрузки (при двойном превышении - ошибка)
+        Image.MAX_IMAGE_PIXELS = settings.UPLOAD_MAX_PIXELS
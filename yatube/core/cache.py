@@ -0,0 +1,355 @@
+"""Двухуровневый кеш.
+
+TieredCache держит ограниченный LRU в памяти процесса поверх общего
+для всех воркеров кеша (LOCATION - его псевдоним в settings.CACHES).
+Чтение сначала идет в LRU, потом в общий кеш; запись - в оба уровня.
+Локальная копия живет не дольше LOCAL_TIMEOUT секунд. С COHERENCE_FILE
+процессы узла сообщают друг другу об измененных ключах через журнал
+в общей памяти (core.coherence), и чужие изменения выбрасывают
+локальную копию сразу, а не через LOCAL_TIMEOUT.
+
+Для ключей с префиксами REVALIDATE_PREFIXES (по умолчанию - фрагменты
+шаблонов) и для get_or_set кеш защищает от одновременного пересчета:
+значение со сроком хранится еще STALE_TIME секунд после истечения,
+пересчитывает его тот, кто первым взял блокировку в общем кеше
+(get вернет ему default), а остальные, пока он не положит новое,
+получают старое значение. Блокировка снимается записью значения или
+истекает за LOCK_TIMEOUT.
+
+При промахе старого значения нет, и никто никого не ждет: иначе
+упавший воркер или значение, которое общий кеш не принял (больше
+слота core.shmcache), задерживали бы все запросы к ключу. Фрагменты
+со сменившейся версией (core.invalidation) - тоже промах; прежнюю
+страницу, пока ее пересобирает один воркер, отдает core.pagecache.
+
+Ключи с префиксами SHARED_ONLY_PREFIXES (по умолчанию - счетчики
+core.metrics) меняются часто и читаются редко: они не копируются
+в LRU и не попадают в журнал.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from . import coherence, metrics
+
+LOCK_PREFIX = 'lock:'
+MISSING = object()
+
+_lrus = {}
+_lrus_lock = threading.Lock()
+
+
+class Entry(namedtuple('Entry', 'value fresh_until')):
+    """Значение в общем кеше и время, до которого оно свежее."""
+
+    @property
+    def fresh(self):
+        return self.fresh_until > time.time()
+
+
+class LRU:
+    """Потокобезопасный LRU с ограниченным сроком жизни записей.
+
+    Значения хранятся сериализованными, как в LocMemCache: изменение
+    полученного объекта не меняет закешированный.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        # хеш ключа -> ключ, для сообщений журнала core.coherence
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return MISSING
+            expires, _, pickled = item
+            if expires <= time.monotonic():
+                self._pop(key)
+                return MISSING
+            self._data.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def set(self, key, value, timeout):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        key_hash = coherence.key_hash(key)
+        with self._lock:
+            self._data[key] = (time.monotonic() + timeout, key_hash, pickled)
+            self._keys[key_hash] = key
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._pop(next(iter(self._data)))
+
+    def _pop(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._keys.pop(item[1], None)
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def discard(self, hashes):
+        """Удаляет ключи с хешами hashes."""
+        with self._lock:
+            for key_hash in hashes:
+                key = self._keys.get(key_hash)
+                if key is not None:
+                    self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._keys.clear()
+
+
+class TieredCache(BaseCache):
+    """Кеш-бэкенд: LRU процесса поверх общего кеша LOCATION.
+
+    OPTIONS: LOCAL_MAX_ENTRIES, LOCAL_TIMEOUT, STALE_TIME, LOCK_TIMEOUT,
+    REVALIDATE_PREFIXES, SHARED_ONLY_PREFIXES, COHERENCE_FILE,
+    COHERENCE_SLOTS.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = location
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self.stale_time = options.get('STALE_TIME', 60)
+        self.lock_timeout = options.get('LOCK_TIMEOUT', 30)
+        self.revalidate_prefixes = tuple(
+            options.get('REVALIDATE_PREFIXES', ('template.cache.',))
+        )
+        self.shared_only_prefixes = tuple(
+            options.get('SHARED_ONLY_PREFIXES', (metrics.PREFIX,))
+        )
+        with _lrus_lock:
+            self._lru = _lrus.setdefault(
+                location, LRU(options.get('LOCAL_MAX_ENTRIES', 1000))
+            )
+        self.coherence_file = options.get('COHERENCE_FILE')
+        self.coherence_slots = options.get('COHERENCE_SLOTS', 4096)
+        # экземпляр бэкенда у каждого потока свой (django.core.cache
+        # .caches), поэтому и взятые им блокировки - тоже
+        self._held = set()
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def _timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def _revalidated(self, key):
+        return key.startswith(self.revalidate_prefixes)
+
+    def _local(self, key):
+        return not key.startswith(self.shared_only_prefixes)
+
+    @property
+    def journal(self):
+        if self.coherence_file is None:
+            return None
+        return coherence.journal(self.coherence_file, self.coherence_slots)
+
+    def _sync(self):
+        """Выбрасывает из LRU ключи, измененные другими процессами."""
+        journal = self.journal
+        if journal is None:
+            return
+        changed = journal.changes()
+        if changed is None:
+            self._lru.clear()
+        elif changed:
+            self._lru.discard(changed)
+
+    def _changed(self, keys, version):
+        """Отмечает изменение ключей в общем кеше."""
+        local_keys = [
+            self.make_key(key, version) for key in keys if self._local(key)
+        ]
+        if not local_keys:
+            return
+        for local_key in local_keys:
+            self._lru.delete(local_key)
+        if self.journal is not None:
+            self.journal.publish(local_keys)
+
+    def _remember(self, key, version, stored):
+        if not self._local(key):
+            return
+        self._lru.set(self.make_key(key, version), stored, self.local_timeout)
+        # значение могли сменить, пока его читали из общего кеша
+        self._sync()
+
+    def _fetch(self, key, version):
+        self._sync()
+        stored = self._lru.get(self.make_key(key, version))
+        if isinstance(stored, Entry) and not stored.fresh:
+            # его могли уже пересчитать в другом процессе
+            stored = MISSING
+        if stored is MISSING:
+            stored = self.shared.get(key, MISSING, version)
+            if stored is not MISSING:
+                self._remember(key, version, stored)
+        return stored
+
+    def _acquire(self, key, version):
+        if self.shared.add(LOCK_PREFIX + key, True, self.lock_timeout,
+                           version):
+            self._held.add((key, version))
+            return True
+        return False
+
+    def _release(self, key, version):
+        if (key, version) in self._held:
+            self._held.discard((key, version))
+            self.shared.delete(LOCK_PREFIX + key, version)
+
+    def _get(self, key, default, version, revalidate):
+        stored = self._fetch(key, version)
+        if stored is MISSING:
+            return default
+        if not isinstance(stored, Entry):
+            return stored
+        if stored.fresh:
+            return stored.value
+        if revalidate and not self._acquire(key, version):
+            # пересчитывает другой воркер
+            return stored.value
+        return default
+
+    def get(self, key, default=None, version=None):
+        return self._get(key, default, version, self._revalidated(key))
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        value = self._get(key, None, version, True)
+        if value is None:
+            value = default() if callable(default) else default
+            if value is not None:
+                self._set(key, value, timeout, version, True)
+        return value
+
+    def _stored(self, value, timeout, revalidate):
+        """Значение и срок хранения для общего кеша."""
+        if revalidate and timeout is not None and self.stale_time:
+            return Entry(value, time.time() + timeout), \
+                timeout + self.stale_time
+        return value, timeout
+
+    def _store(self, items, timeout, version):
+        """Кладет {ключ: (значение, revalidate)} в оба уровня."""
+        groups = {}
+        for key, (value, revalidate) in items.items():
+            stored, shared_timeout = self._stored(value, timeout, revalidate)
+            groups.setdefault(shared_timeout, {})[key] = stored
+        failed = []
+        for shared_timeout, group in groups.items():
+            failed += self.shared.set_many(group, shared_timeout, version)
+            local = {
+                self.make_key(key, version): stored
+                for key, stored in group.items() if self._local(key)
+            }
+            if self.journal is not None and local:
+                self.journal.publish(local)
+            local_timeout = min(
+                self.local_timeout, shared_timeout or self.local_timeout
+            )
+            for local_key, stored in local.items():
+                self._lru.set(local_key, stored, local_timeout)
+            for key in group:
+                self._release(key, version)
+        return failed
+
+    def _set(self, key, value, timeout, version, revalidate):
+        timeout = self._timeout(timeout)
+        if timeout is not None and timeout <= 0:
+            self.delete(key, version)
+            return
+        self._store({key: (value, revalidate)}, timeout, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._set(key, value, timeout, version, self._revalidated(key))
+
+    def get_many(self, keys, version=None):
+        # get_many не пересчитывает: устаревшее значение - промах
+        self._sync()
+        result = {}
+        missing = []
+        for key in keys:
+            stored = self._lru.get(self.make_key(key, version))
+            if stored is MISSING:
+                missing.append(key)
+            else:
+                result[key] = stored
+        if missing:
+            fetched = self.shared.get_many(missing, version)
+            for key, stored in fetched.items():
+                self._remember(key, version, stored)
+            result.update(fetched)
+        return {
+            key: stored.value if isinstance(stored, Entry) else stored
+            for key, stored in result.items()
+            if not isinstance(stored, Entry) or stored.fresh
+        }
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self._timeout(timeout)
+        if timeout is not None and timeout <= 0:
+            self.delete_many(data, version)
+            return []
+        return self._store({
+            key: (value, self._revalidated(key))
+            for key, value in data.items()
+        }, timeout, version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, self._timeout(timeout), version)
+        if added:
+            self._changed([key], version)
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        try:
+            return self.shared.incr(key, delta, version)
+        finally:
+            self._changed([key], version)
+
+    def decr(self, key, delta=1, version=None):
+        try:
+            return self.shared.decr(key, delta, version)
+        finally:
+            self._changed([key], version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._lru.delete(self.make_key(key, version))
+        return self.shared.touch(key, self._timeout(timeout), version)
+
+    def has_key(self, key, version=None):
+        stored = self._fetch(key, version)
+        return stored is not MISSING and (
+            not isinstance(stored, Entry) or stored.fresh
+        )
+
+    def delete(self, key, version=None):
+        self.shared.delete(key, version)
+        self._changed([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.shared.delete_many(keys, version)
+        self._changed(keys, version)
+
+    def clear(self):
+        self.shared.clear()
+        self._lru.clear()
+        if self.journal is not None:
+            self.journal.publish_clear()
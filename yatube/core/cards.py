@@ -0,0 +1,61 @@
+"""Кеш отрисованных карточек записей.
+
+Лента - это список одинаковых карточек, и при промахе кеша страницы
+заново отрисовывать каждую (linebreaksbr, даты, {% url %}, поиск
+миниатюр) незачем: изменилась обычно одна-две записи. Каждая карточка
+кешируется отдельно по шаблону, варианту (дополнительному контексту)
+и версии записи - полю updated (core.models.UpdatedModel). Страница
+собирается одним get_many, отрисовываются только промахи, и они
+сохраняются одним set_many.
+
+Карточка отрисовывается без запроса и контекстных процессоров, поэтому
+не может зависеть от пользователя: личное выносится в core.holes.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+
+PREFIX = 'card:'
+
+
+def _variant_key(template_name, variant):
+    variant = '&'.join(
+        f'{name}={value!r}' for name, value in sorted(variant.items())
+    )
+    return hashlib.md5(f'{template_name}?{variant}'.encode()).hexdigest()
+
+
+def _cache_key(variant_key, obj):
+    version = int(obj.updated.timestamp() * 10**6)
+    return f'{PREFIX}{variant_key}:{obj.pk}:{version}'
+
+
+def render_cards(objects, template_name, name='object', prepare=None,
+                 **variant):
+    """Карточки objects по шаблону template_name, по порядку.
+
+    Запись попадает в шаблон под именем name, variant - дополнительный
+    контекст шаблона. prepare(objects) вызывается для записей,
+    карточки которых придется отрисовать, - например, чтобы заранее
+    найти миниатюры.
+    """
+    objects = list(objects)
+    variant_key = _variant_key(template_name, variant)
+    keys = [_cache_key(variant_key, obj) for obj in objects]
+    cards = cache.get_many(keys)
+    missing = [
+        (key, obj) for key, obj in zip(keys, objects) if key not in cards
+    ]
+    if missing:
+        if prepare is not None:
+            prepare([obj for key, obj in missing])
+        template = get_template(template_name)
+        rendered = {
+            key: template.render({name: obj, **variant})
+            for key, obj in missing
+        }
+        cache.set_many(rendered, settings.CACHE_TIME)
+        cards.update(rendered)
+    return [cards[key] for key in keys]
@@ -0,0 +1,113 @@
+"""Согласование локальных кешей процессов одного узла.
+
+Журнал - файл, который все воркеры узла отображают в память (mmap).
+В нем счетчик поколений и кольцо из slots хешей ключей. Запись ключа
+в TieredCache добавляет его хеш в кольцо и увеличивает счетчик.
+Перед чтением процесс сравнивает счетчик с последним увиденным - это
+чтение восьми байт из памяти, без блокировок и системных вызовов -
+и при изменении выбрасывает из своего LRU ключи из новых слотов.
+Если процесс отстал больше чем на slots изменений или кеш очищен,
+LRU очищается целиком.
+
+Писатели сериализуются блокировкой файла (fcntl.flock). После fork
+журнал открывается заново: блокировка общая у унаследованного файла.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+COUNTER = struct.Struct('<Q')
+SLOT = struct.Struct('<Q')
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def key_hash(key):
+    """64-битный хеш ключа кеша."""
+    digest = hashlib.blake2b(key.encode(), digest_size=SLOT.size).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class Journal:
+    """Журнал изменений ключей в файле path."""
+
+    def __init__(self, path, slots):
+        self.pid = os.getpid()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = COUNTER.size + SLOT.size * slots
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        size = os.fstat(self._fd).st_size
+        # журнал мог создать процесс с большим числом слотов
+        self.slots = (size - COUNTER.size) // SLOT.size
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+        self.seen = self.generation()
+
+    def generation(self):
+        return COUNTER.unpack_from(self._map, 0)[0]
+
+    def _slot(self, generation):
+        return COUNTER.size + SLOT.size * (generation % self.slots)
+
+    def _write(self, hashes=(), skip=0):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                generation = self.generation()
+                own = generation == self.seen
+                for value in hashes:
+                    SLOT.pack_into(self._map, self._slot(generation), value)
+                    generation += 1
+                generation += skip
+                # слот пишется раньше счетчика: читатель, увидевший
+                # новый счетчик, увидит и слоты
+                COUNTER.pack_into(self._map, 0, generation)
+                if own:
+                    # других изменений не было - свои можно не читать
+                    self.seen = generation
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def publish(self, keys):
+        """Отмечает изменение ключей."""
+        self._write([key_hash(key) for key in keys])
+
+    def publish_clear(self):
+        """Отмечает очистку кеша: все процессы очистят свои LRU."""
+        self._write(skip=self.slots + 1)
+
+    def changes(self):
+        """Хеши ключей, измененных с прошлого вызова; None - все."""
+        if self.generation() == self.seen:
+            return ()
+        with self._lock:
+            seen = self.seen
+            generation = self.generation()
+            self.seen = generation
+            if generation - seen > self.slots:
+                return None
+            hashes = {
+                SLOT.unpack_from(self._map, self._slot(number))[0]
+                for number in range(seen, generation)
+            }
+            # пока читали, писатели могли пройти кольцо по кругу
+            if self.generation() - seen > self.slots:
+                return None
+            return hashes
+
+
+def journal(path, slots=4096):
+    """Журнал файла path для текущего процесса."""
+    found = _journals.get(path)
+    if found is not None and found.pid == os.getpid():
+        return found
+    with _journals_lock:
+        found = _journals.get(path)
+        if found is None or found.pid != os.getpid():
+            found = _journals[path] = Journal(path, slots)
+        return found
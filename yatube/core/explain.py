@@ -0,0 +1,99 @@
+"""Проверка планов запросов через EXPLAIN QUERY PLAN (SQLite).
+
+Собирает SELECT-запросы, выполненные внутри блока, и ищет в их планах
+полный проход по таблице и сортировку во временном B-дереве - признаки
+того, что запросу не хватает индекса.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+FULL_SCAN = 'SCAN'
+TEMP_SORT = 'USE TEMP B-TREE'
+INDEX_RE = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+ORDER_BY_RE = re.compile(r' ORDER BY (.+) LIMIT \d+(?: OFFSET \d+)?$')
+COLUMN_RE = re.compile(r'"(\w+)"(?: (?:ASC|DESC))?$')
+
+
+def query_plan(sql, using=DEFAULT_DB_ALIAS):
+    """Строки плана запроса: список колонок detail."""
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def _index_columns(index, using):
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'PRAGMA index_info("{index}")')
+        return [row[2] for row in cursor.fetchall()]
+
+
+def _order_columns(sql):
+    match = ORDER_BY_RE.search(sql)
+    if match is None:
+        return None
+    columns = [
+        COLUMN_RE.search(term.strip()) for term in match[1].split(',')
+    ]
+    if not all(columns):
+        return None
+    return [column[1] for column in columns]
+
+
+def _ordered_scan(sql, line, using):
+    # проход по индексу в порядке ORDER BY без фильтра останавливается
+    # на LIMIT; с фильтром он может прочитать всю таблицу
+    index = INDEX_RE.search(line)
+    order = _order_columns(sql)
+    if index is None or order is None or ' WHERE ' in sql:
+        return False
+    return _index_columns(index[1], using)[:len(order)] == order
+
+
+def plan_problems(sql, plan, using=DEFAULT_DB_ALIAS):
+    """Строки плана с полным проходом по таблице или временной сортировкой.
+
+    Проход по индексу (SCAN ... USING INDEX) проблемой не считается,
+    только если индекс дает порядок ORDER BY запроса без фильтра
+    и с LIMIT: так читаются ленты без фильтра.
+    """
+    return [
+        line for line in plan
+        if line.startswith(TEMP_SORT)
+        or (line.startswith(FULL_SCAN) and not _ordered_scan(
+            sql, line, using
+        ))
+    ]
+
+
+class PlanChecker(CaptureQueriesContext):
+    """Контекст, собирающий планы SELECT-запросов.
+
+    После выхода из блока problems - список пар (sql, строки плана
+    с проблемами). allowed - тексты запросов, которым полный проход
+    разрешен явно.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, allowed=()):
+        self.using = using
+        self.allowed = frozenset(allowed)
+        super().__init__(connections[using])
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        self.plans = [
+            (query['sql'], query_plan(query['sql'], self.using))
+            for query in self.captured_queries
+            if query['sql'].lstrip().upper().startswith('SELECT')
+        ]
+        self.problems = [
+            (sql, problems)
+            for sql, problems in (
+                (sql, plan_problems(sql, plan, self.using))
+                for sql, plan in self.plans
+            )
+            if problems and sql not in self.allowed
+        ]
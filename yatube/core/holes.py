@@ -0,0 +1,81 @@
+"""Дырки в кешируемых страницах, в духе Edge Side Includes.
+
+Общая часть страницы не зависит от пользователя и кешируется один раз
+(core.pagecache), а небольшие личные куски - блок входа, кнопка
+подписки, форма с CSRF-токеном - вместо себя оставляют метку
+{% hole 'имя' параметр=значение %}. HoleMiddleware перед отдачей
+любой HTML-страницы заменяет метки куском, отрисованным для текущего
+запроса.
+
+Кусок регистрируется декоратором hole(имя, шаблон) на функции
+(request, **параметры) -> контекст шаблона. Параметры попадают в метку
+как JSON, поэтому должны быть простыми значениями.
+"""
+import json
+import re
+
+from django.template.loader import render_to_string
+
+MARKER_RE = re.compile(r'<!--hole (\w+) (\{[^<>]*\})-->')
+
+_registry = {}
+
+
+def hole(name, template):
+    """Регистрирует кусок name с шаблоном template."""
+
+    def decorator(get_context):
+        _registry[name] = (template, get_context)
+        return get_context
+
+    return decorator
+
+
+def marker(name, params):
+    """Метка куска name с параметрами params."""
+    if name not in _registry:
+        raise KeyError(f'Неизвестный кусок страницы {name}')
+    params = json.dumps(params, ensure_ascii=False, sort_keys=True)
+    # < и > в JSON экранируются: метку не закроет и не подделает значение
+    params = params.replace('<', '\\u003c').replace('>', '\\u003e')
+    return f'<!--hole {name} {params}-->'
+
+
+def render(request, name, params):
+    template, get_context = _registry[name]
+    return render_to_string(
+        template, get_context(request, **params), request=request
+    )
+
+
+def fill(request, content):
+    """Заменяет метки в content кусками для request."""
+    return MARKER_RE.sub(
+        lambda match: render(request, match[1], json.loads(match[2])),
+        content
+    )
+
+
+class HoleMiddleware:
+    """Заполняет метки кусков в HTML-ответах.
+
+    Стоит после CsrfViewMiddleware: кусок с формой выставляет
+    CSRF-куку уже при заполнении.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or not response.get(
+            'Content-Type', ''
+        ).startswith('text/html'):
+            return response
+        if b'<!--hole ' in response.content:
+            response.content = fill(
+                request, response.content.decode(response.charset)
+            )
+            if response.has_header('Content-Length'):
+                response['Content-Length'] = len(response.content)
+        return response
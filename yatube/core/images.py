@@ -0,0 +1,53 @@
+"""Сведения о картинке, которые хранятся рядом с ней в модели.
+
+Размеры оригинала и средний цвет позволяют шаблону заранее отвести
+место под картинку и залить его цветом, пока она загружается, -
+не открывая файл и не обращаясь к хранилищу миниатюр.
+"""
+from collections import namedtuple
+
+from django.core.exceptions import SuspiciousFileOperation
+from PIL import Image
+
+# до такого размера картинка уменьшается перед подсчетом цвета;
+# JPEG при этом сразу декодируется уменьшенным (draft)
+SAMPLE_SIZE = (64, 64)
+# значения EXIF Orientation с поворотом на 90 градусов
+ROTATED = (5, 6, 7, 8)
+EXIF_ORIENTATION = 0x0112
+
+ImageInfo = namedtuple('ImageInfo', 'width height color')
+EMPTY = ImageInfo(None, None, '')
+
+
+def _describe(source):
+    with Image.open(source) as image:
+        width, height = image.size
+        if image.getexif().get(EXIF_ORIENTATION) in ROTATED:
+            width, height = height, width
+        image.thumbnail(SAMPLE_SIZE)
+        red, green, blue = image.convert('RGB').resize(
+            (1, 1), Image.BOX
+        ).getpixel((0, 0))
+    return ImageInfo(width, height, f'#{red:02x}{green:02x}{blue:02x}')
+
+
+def describe(file_):
+    """ImageInfo файла картинки (FieldFile): размеры и цвет #rrggbb.
+
+    Еще не сохраненный загруженный файл читается из памяти и
+    возвращается на начало. Для нечитаемого файла - EMPTY.
+    """
+    try:
+        if file_._committed:
+            with file_.storage.open(file_.name) as source:
+                return _describe(source)
+        source = file_.file
+        source.seek(0)
+        try:
+            return _describe(source)
+        finally:
+            source.seek(0)
+    except (OSError, ValueError, SuspiciousFileOperation,
+            Image.DecompressionBombError):
+        return EMPTY
@@ -0,0 +1,69 @@
+"""Версии областей кеша.
+
+Фрагменты шаблонов кешируются бессрочно, а в их ключ входит версия
+области, к которой они относятся: вся лента, группа, автор, пост.
+Изменение модели меняет версии затронутых областей, старые фрагменты
+перестают читаться и со временем вытесняются из кеша.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+PREFIX = 'cache_version:'
+
+
+def scope(name, pk=None):
+    """Имя области кеша: scope('group', 5) -> 'group:5'."""
+    return name if pk is None else f'{name}:{pk}'
+
+
+def _new_version():
+    return time.time_ns()
+
+
+def cache_versions(scopes):
+    """Версии областей по порядку - для пачки ключей, каждый из
+    которых зависит от своей области."""
+    keys = [PREFIX + name for name in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = _new_version()
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+            versions[key] = version
+    return [versions[key] for key in keys]
+
+
+def cache_version(*scopes):
+    """Общая версия нескольких областей для ключа фрагмента."""
+    return '.'.join(str(version) for version in cache_versions(scopes))
+
+
+def bump(*scopes):
+    """Меняет версии областей, сбрасывая их фрагменты."""
+    version = _new_version()
+    cache.set_many({PREFIX + name: version for name in scopes}, None)
+
+
+def _bump_now_and_on_commit(scopes):
+    # сразу - чтобы следующий запрос этого потока не увидел старый
+    # фрагмент, после коммита - чтобы сбросить фрагменты, которые
+    # параллельные запросы успели собрать по еще старым данным
+    bump(*scopes)
+    transaction.on_commit(lambda: bump(*scopes))
+
+
+def register(model, get_scopes):
+    """Сбрасывает области get_scopes(instance) при изменении model."""
+
+    def handler(sender, instance, **kwargs):
+        scopes = list(get_scopes(instance))
+        if scopes:
+            _bump_now_and_on_commit(scopes)
+
+    uid = f'invalidation:{model._meta.label}'
+    post_save.connect(handler, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(handler, sender=model, weak=False, dispatch_uid=uid)
@@ -0,0 +1,102 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+
+from core.shmcache import SharedMemoryCache
+
+
+def _backends(directory):
+    """(имя, класс, LOCATION) сравниваемых кешей."""
+    return [
+        ('locmem', LocMemCache, 'benchmark'),
+        ('file', FileBasedCache, os.path.join(directory, 'file')),
+        ('shm', SharedMemoryCache, os.path.join(directory, 'shm')),
+    ]
+
+
+def _fill(args):
+    # воркер: собирает фрагменты, которых нет в кеше; возвращает
+    # сколько собрал сам
+    backend, location, keys, value = args
+    cache = backend(location, {'OPTIONS': {'MAX_ENTRIES': 100000}})
+    built = 0
+    for key in keys:
+        if cache.get(key) is None:
+            built += 1
+            cache.set(key, value, None)
+    return built
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает скорость кешей LocMemCache, FileBasedCache и '
+        'SharedMemoryCache и число сборок фрагментов на узел'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--operations', type=int, default=10000,
+            help='Сколько операций каждого вида выполнить'
+        )
+        parser.add_argument(
+            '--value-size', type=int, default=8192,
+            help='Размер значения в байтах, как у фрагмента страницы'
+        )
+        parser.add_argument(
+            '--keys', type=int, default=200,
+            help='Сколько разных ключей использовать'
+        )
+        parser.add_argument(
+            '--processes', type=int, default=4,
+            help='Число процессов-воркеров для проверки сборок'
+        )
+
+    def handle(self, *args, **options):
+        if min(options['operations'], options['keys'],
+               options['processes'], options['value_size']) < 1:
+            raise CommandError('Параметры должны быть положительными')
+        root = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        directory = tempfile.mkdtemp(dir=root)
+        try:
+            for name, backend, location in _backends(directory):
+                self.measure(name, backend, location, options)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def measure(self, name, backend, location, options):
+        cache = backend(location, {'OPTIONS': {'MAX_ENTRIES': 100000}})
+        cache.clear()
+        value = 'x' * options['value_size']
+        keys = [f'fragment:{number}' for number in range(options['keys'])]
+        operations = options['operations']
+        timings = {}
+        started = time.perf_counter()
+        for number in range(operations):
+            cache.set(keys[number % len(keys)], value, None)
+        timings['set'] = time.perf_counter() - started
+        started = time.perf_counter()
+        for number in range(operations):
+            cache.get(keys[number % len(keys)])
+        timings['get'] = time.perf_counter() - started
+        started = time.perf_counter()
+        for number in range(operations):
+            cache.get('missing')
+        timings['miss'] = time.perf_counter() - started
+        cache.clear()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(options['processes']) as pool:
+            built = sum(pool.map(_fill, [
+                (backend, location, keys, value)
+            ] * options['processes']))
+        self.stdout.write(
+            f'{name:>6}: ' + ', '.join(
+                f'{operation} {seconds / operations * 1e6:.1f} мкс'
+                for operation, seconds in timings.items()
+            ) + f'; собрано фрагментов {built} из {len(keys)}'
+        )
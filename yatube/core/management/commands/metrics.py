@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core import metrics
+
+
+class Command(BaseCommand):
+    help = 'Выводит значения счетчиков приложения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Имена счетчиков')
+
+    def handle(self, *args, **options):
+        for name, value in metrics.snapshot(options['names']).items():
+            self.stdout.write(f'{name}: {value}')
@@ -0,0 +1,36 @@
+"""Счетчики событий приложения.
+
+Счетчики хранятся в общем кеше, поэтому их видят все процессы,
+которые к нему подключены. Имена регистрируются при импорте
+модулей через counter(), чтобы команда metrics знала, что выводить.
+"""
+from django.core.cache import cache
+
+PREFIX = 'metrics:'
+
+_registry = []
+
+
+def counter(name):
+    """Регистрирует счетчик и возвращает его имя."""
+    if name not in _registry:
+        _registry.append(name)
+    return name
+
+
+def incr(name, delta=1):
+    key = PREFIX + name
+    if cache.add(key, delta, None):
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # ключ успели вытеснить между add и incr
+        cache.set(key, delta, None)
+
+
+def snapshot(names=None):
+    """Текущие значения счетчиков: {имя: значение}."""
+    names = names or _registry
+    values = cache.get_many([PREFIX + name for name in names])
+    return {name: values.get(PREFIX + name, 0) for name in names}
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 
 
 class CreatedModel(models.Model):
@@ -11,3 +11,34 @@ class CreatedModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class UpdatedModel(models.Model):
+    """Абстрактная модель. Добавляет дату изменения.
+
+    Дата служит версией записи: по ней кешируются отрисованные
+    карточки (core.cards). Массовые update() ее не трогают - их надо
+    дополнять updated=timezone.now().
+    """
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+
+    class Meta:
+        abstract = True
+
+
+class AtomicSaveModel(models.Model):
+    """Абстрактная модель. Сохраняет запись в транзакции.
+
+    Обработчики post_save выполняются в той же транзакции,
+    что и само сохранение, - например, обновление счетчиков.
+    """
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
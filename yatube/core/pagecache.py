@@ -0,0 +1,115 @@
+"""Кеш целых страниц.
+
+Страница GET-запроса кешируется по адресу и версии областей кеша
+(core.invalidation), от которых она зависит. Все, что зависит
+от пользователя, вынесено в куски core.holes: в кеше лежит общая для
+всех страница с метками, а HoleMiddleware заполняет их для каждого
+запроса. Поэтому одна запись кеша служит и анонимным посетителям,
+и авторизованным пользователям.
+
+Версия - время последнего изменения областей в наносекундах, и из нее
+же получаются заголовки ETag и Last-Modified для анонимных страниц:
+повторный запрос с If-None-Match или If-Modified-Since получает 304
+без обращения к представлению и к кешу страниц. Страницы
+авторизованных пользователей валидаторов не получают, а Vary: Cookie
+не дает общим кешам (CDN) отдать им анонимную страницу.
+
+Страница хранится под адресом вместе с версией, с которой ее собрали.
+Когда версия сменилась, пересобирает страницу один воркер - тот, кто
+взял блокировку, - а остальные до записи новой отдают прежнюю
+со старыми валидаторами, а не собирают ее все разом.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers
+)
+from django.utils.http import http_date
+
+from .invalidation import cache_version
+
+PREFIX = 'page:'
+LOCK_PREFIX = 'lock:' + PREFIX
+
+
+def _validators(version):
+    last_modified = max(int(part) for part in version.split('.')) // 10**9
+    return f'W/"{version}"', last_modified
+
+
+def _cache_key(request):
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return PREFIX + url
+
+
+def _finish(response, anonymous, etag, last_modified):
+    if anonymous:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(
+            response, public=True, max_age=settings.PAGE_CACHE_MAX_AGE
+        )
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def cache_shared_page(*scopes):
+    """Кеширует общую часть страницы представления.
+
+    scopes - области кеша, изменение которых меняет страницу.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.PAGE_CACHE_ENABLED or request.method not in (
+                'GET', 'HEAD'
+            ):
+                return view(request, *args, **kwargs)
+            anonymous = not request.user.is_authenticated
+            version = cache_version(*scopes)
+            etag, last_modified = _validators(version)
+            if anonymous:
+                response = get_conditional_response(
+                    request, etag=etag, last_modified=last_modified
+                )
+                if response is not None:
+                    return _finish(response, True, etag, last_modified)
+            key = _cache_key(request)
+            cached = cache.get(key)
+            locked = False
+            if cached is not None:
+                cached_version, content, content_type = cached
+                locked = cached_version != version and cache.add(
+                    LOCK_PREFIX + key, True,
+                    settings.PAGE_CACHE_LOCK_TIMEOUT
+                )
+                if not locked:
+                    # страница свежая или ее уже пересобирает другой
+                    response = HttpResponse(
+                        content, content_type=content_type
+                    )
+                    return _finish(
+                        response, anonymous, *_validators(cached_version)
+                    )
+            try:
+                response = view(request, *args, **kwargs)
+                # страницу с куками (сессия, CSRF) отдавать другим нельзя
+                if response.status_code == 200 and not response.streaming \
+                        and not response.cookies:
+                    cache.set(key, (
+                        version, response.content, response['Content-Type']
+                    ), settings.CACHE_TIME)
+                    _finish(response, anonymous, etag, last_modified)
+            finally:
+                if locked:
+                    cache.delete(LOCK_PREFIX + key)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,277 @@
+import base64
+import binascii
+
+from django.core.paginator import EmptyPage, Page, Paginator
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+CURSOR_SEPARATOR = '|'
+DEFAULT_ORDERING = ('created', 'pk')
+ELLIPSIS = '…'
+PAGES_ON_EACH_SIDE = 2
+PAGES_ON_ENDS = 1
+
+
+def encode_key(*parts):
+    """Кодирует части ключа записи в непрозрачный токен."""
+    raw = CURSOR_SEPARATOR.join(str(part) for part in parts)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_key(token):
+    """Части ключа из токена encode_key (строки) или None."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        return None
+    return raw.split(CURSOR_SEPARATOR)
+
+
+def encode_cursor(obj):
+    """Кодирует позицию записи (created, pk) в непрозрачный токен."""
+    return encode_key(obj.created.isoformat(), obj.pk)
+
+
+def decode_cursor(token):
+    """Возвращает пару (created, pk) или None, если токен испорчен."""
+    try:
+        created, pk = decode_key(token)
+        created, pk = parse_datetime(created), int(pk)
+    except (ValueError, TypeError):
+        return None
+    if created is None:
+        return None
+    return created, pk
+
+
+def elided_page_range(page, on_each_side=PAGES_ON_EACH_SIDE,
+                      on_ends=PAGES_ON_ENDS):
+    """Номера страниц вокруг текущей, первые и последние.
+
+    Пропущенные участки заменяются на ELLIPSIS, поэтому длина
+    навигации не зависит от общего числа страниц.
+    """
+    number = page.number
+    num_pages = page.paginator.num_pages
+    if num_pages <= (on_each_side + on_ends) * 2:
+        yield from page.paginator.page_range
+        return
+    if number > 1 + on_each_side + on_ends + 1:
+        yield from range(1, on_ends + 1)
+        yield ELLIPSIS
+        yield from range(number - on_each_side, number + 1)
+    else:
+        yield from range(1, number + 1)
+    if number < num_pages - on_each_side - on_ends - 1:
+        yield from range(number + 1, number + on_each_side + 1)
+        yield ELLIPSIS
+        yield from range(num_pages - on_ends + 1, num_pages + 1)
+    else:
+        yield from range(number + 1, num_pages + 1)
+
+
+class KeysetPage(Page):
+    """Страница ленты, построенная по курсору, а не по номеру.
+
+    Номер страницы неизвестен, поэтому number равен None,
+    а для навигации используются next_cursor и previous_cursor.
+    """
+
+    def __init__(self, object_list, paginator, cursor='',
+                 has_next=False, has_previous=False):
+        super().__init__(object_list, None, paginator)
+        self.cursor = cursor
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<Keyset page {self.cursor or "first"}>'
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[0])
+        return None
+
+
+def keyset_slice(queryset, cursor, limit, ordering=DEFAULT_ORDERING,
+                 newer=False):
+    """Первые limit записей queryset за курсором.
+
+    По умолчанию - записи старше курсора по убыванию ключа,
+    при newer=True - записи новее курсора по возрастанию ключа.
+    """
+    created_field, pk_field = ordering
+    if newer:
+        queryset = queryset.order_by(created_field, pk_field)
+    else:
+        queryset = queryset.order_by(f'-{created_field}', f'-{pk_field}')
+    if cursor is not None:
+        # created <= X задает диапазон по индексу, второе условие
+        # лишь отсекает уже показанные записи с тем же created
+        created, pk = cursor
+        if newer:
+            queryset = queryset.filter(
+                Q(**{f'{created_field}__gte': created}),
+                Q(**{f'{created_field}__gt': created})
+                | Q(**{f'{pk_field}__gt': pk})
+            )
+        else:
+            queryset = queryset.filter(
+                Q(**{f'{created_field}__lte': created}),
+                Q(**{f'{created_field}__lt': created})
+                | Q(**{f'{pk_field}__lt': pk})
+            )
+    return list(queryset[:limit])
+
+
+class QuerySetFeed:
+    """Лента из QuerySet для KeysetPaginator."""
+
+    def __init__(self, queryset, ordering=DEFAULT_ORDERING):
+        self.queryset = queryset
+        self.ordering = ordering
+
+    def count(self):
+        return self.queryset.count()
+
+    def __getitem__(self, index):
+        return self.queryset[index]
+
+    def rows_after(self, cursor, limit):
+        return keyset_slice(self.queryset, cursor, limit, self.ordering)
+
+    def rows_before(self, cursor, limit):
+        return keyset_slice(
+            self.queryset, cursor, limit, self.ordering, newer=True
+        )
+
+
+class CountedPaginator(Paginator):
+    """Paginator с числом записей из денормализованного счетчика.
+
+    Страница читается с одной лишней записью и сверяется со счетчиком.
+    Если они не сходятся (счетчик отстал после операций в обход
+    сигналов), число записей считается COUNT(*), а on_mismatch()
+    исправляет счетчик.
+    """
+
+    def __init__(self, object_list, per_page, count, on_mismatch=None,
+                 **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count = count
+        self.on_mismatch = on_mismatch
+
+    def _recount(self):
+        count = Paginator.count.func(self)
+        if count == self.count:
+            return False
+        self.count = count
+        self.__dict__.pop('num_pages', None)
+        if self.on_mismatch is not None:
+            self.on_mismatch()
+        return True
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # страница за концом - или счетчик отстал
+            if not self._recount():
+                raise
+            return super().validate_number(number)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count:
+            top = self.count
+        rows = list(self.object_list[bottom:top + 1])
+        if len(rows) == top - bottom + (top < self.count):
+            return self._get_page(rows[:top - bottom], number, self)
+        self._recount()
+        return super().page(number)
+
+
+class KeysetPaginator:
+    """Постраничный вывод по ключу (created, pk).
+
+    В отличие от Paginator не выполняет COUNT(*) и OFFSET:
+    каждая страница - это диапазонное чтение по индексу
+    (created, id), поэтому её стоимость не зависит от глубины.
+    В ordering можно передать другие имена полей ключа, например
+    поля связанной таблицы, если её индекс лучше подходит для ленты.
+
+    Вместо QuerySet можно передать ленту - объект с методами
+    rows_after(cursor, limit), rows_before(cursor, limit) и count().
+    Лента с другим ключом сортировки задает свой формат курсора
+    методами encode_cursor(obj) и decode_cursor(token).
+    """
+
+    def __init__(self, object_list, per_page, ordering=DEFAULT_ORDERING):
+        if isinstance(object_list, QuerySet):
+            object_list = QuerySetFeed(object_list, ordering)
+        self.object_list = object_list
+        self.per_page = int(per_page)
+
+    @cached_property
+    def count(self):
+        """Общее число записей. Вычисляется только по требованию."""
+        return self.object_list.count()
+
+    def encode_cursor(self, obj):
+        return getattr(self.object_list, 'encode_cursor', encode_cursor)(obj)
+
+    def decode_cursor(self, token):
+        return getattr(self.object_list, 'decode_cursor', decode_cursor)(token)
+
+    def get_page(self, after=None, before=None):
+        """Возвращает страницу после/перед курсором.
+
+        Испорченный курсор, как и отсутствующий, ведёт на первую страницу.
+        """
+        cursor = self.decode_cursor(before) if before else None
+        if cursor is not None:
+            page = self._page_before(cursor, f'before:{before}')
+            if page.object_list:
+                return page
+            return self._page_after(None, '')
+        cursor = self.decode_cursor(after) if after else None
+        if cursor is not None:
+            return self._page_after(cursor, f'after:{after}')
+        return self._page_after(None, '')
+
+    def _page_after(self, cursor, token):
+        rows = self.object_list.rows_after(cursor, self.per_page + 1)
+        return KeysetPage(
+            rows[:self.per_page],
+            self,
+            cursor=token,
+            has_next=len(rows) > self.per_page,
+            has_previous=cursor is not None
+        )
+
+    def _page_before(self, cursor, token):
+        rows = self.object_list.rows_before(cursor, self.per_page + 1)
+        return KeysetPage(
+            rows[:self.per_page][::-1],
+            self,
+            cursor=token,
+            has_next=True,
+            has_previous=len(rows) > self.per_page
+        )
@@ -0,0 +1,355 @@
+"""Кеш в общей памяти процессов узла.
+
+SharedMemoryCache хранит записи в файле, который все воркеры узла
+отображают в память (mmap), поэтому фрагмент, собранный одним
+воркером, читают все остальные. Файл лучше держать в /dev/shm.
+
+Файл разбит на слоты фиксированного размера SLOT_SIZE, слоты - на
+корзины по WAYS штук. Ключ живет только в своей корзине (по хешу),
+так что поиск - это просмотр WAYS слотов. Вытеснение - CLOCK внутри
+корзины: чтение ставит слоту бит обращения, запись ищет по кругу
+слот без бита, снимая биты по пути.
+
+Чтение идет без блокировок: у слота есть счетчик seq, писатель делает
+его нечетным перед записью и четным после. Читатель сверяет счетчик
+до и после чтения и при несовпадении читает заново или считает ключ
+отсутствующим. Писатели сериализуются блокировкой корзины
+(fcntl.lockf - между процессами, threading.Lock - между потоками).
+
+Очистка увеличивает эпоху файла: слоты прошлых эпох считаются
+пустыми, и файл не перезаписывается. Значение, которое не помещается
+в слот даже сжатым, не кешируется.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+MAGIC = b'YTSHM001'
+# magic, слотов, размер слота, слотов в корзине, эпоха
+FILE_HEADER = struct.Struct('<8sIIII')
+EPOCH = struct.Struct('<I')
+EPOCH_OFFSET = 20
+HANDS_OFFSET = 64
+PAGE = mmap.PAGESIZE
+
+# seq, эпоха, хеш ключа, срок (0 - бессрочно), длина ключа,
+# длина значения, флаги
+SLOT_HEADER = struct.Struct('<IIQdHIB')
+SEQ = struct.Struct('<I')
+REF_OFFSET = 32
+PAYLOAD_OFFSET = 40
+COMPRESSED = 1
+READ_RETRIES = 8
+MISSING = object()
+
+_segments = {}
+_segments_lock = threading.Lock()
+
+
+def _hash(key):
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class Segment:
+    """Отображенный в память файл кеша и его разметка."""
+
+    def __init__(self, path, slots, slot_size, ways):
+        self.pid = os.getpid()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, FILE_HEADER.size, 0)
+        try:
+            header = os.pread(self.fd, FILE_HEADER.size, 0)
+            if len(header) == FILE_HEADER.size and header[:8] == MAGIC:
+                # разметку задает тот, кто создал файл
+                _, slots, slot_size, ways, _ = FILE_HEADER.unpack(header)
+                self._layout(slots, slot_size, ways)
+            else:
+                self._layout(slots, slot_size, ways)
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, self.size)
+                os.pwrite(self.fd, FILE_HEADER.pack(
+                    MAGIC, slots, slot_size, ways, 1
+                ), 0)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, FILE_HEADER.size, 0)
+        self.map = mmap.mmap(self.fd, self.size)
+        self.lock = threading.Lock()
+
+    def _layout(self, slots, slot_size, ways):
+        self.ways = ways
+        self.buckets = max(slots // ways, 1)
+        self.slot_size = slot_size
+        self.capacity = slot_size - PAYLOAD_OFFSET
+        hands_end = HANDS_OFFSET + self.buckets
+        self.slots_offset = (hands_end + PAGE - 1) // PAGE * PAGE
+        self.size = self.slots_offset + self.buckets * ways * slot_size
+
+    def epoch(self):
+        return EPOCH.unpack_from(self.map, EPOCH_OFFSET)[0]
+
+    def bucket(self, key_hash):
+        return key_hash % self.buckets
+
+    def slots(self, bucket):
+        start = self.slots_offset + bucket * self.ways * self.slot_size
+        return range(start, start + self.ways * self.slot_size, self.slot_size)
+
+    def locked(self, offset):
+        """Блокировка байта offset: корзины или эпохи."""
+        return _Locked(self, offset)
+
+
+class _Locked:
+    def __init__(self, segment, offset):
+        self.segment = segment
+        self.offset = offset
+
+    def __enter__(self):
+        self.segment.lock.acquire()
+        fcntl.lockf(self.segment.fd, fcntl.LOCK_EX, 1, self.offset)
+
+    def __exit__(self, *exc_info):
+        fcntl.lockf(self.segment.fd, fcntl.LOCK_UN, 1, self.offset)
+        self.segment.lock.release()
+
+
+def segment(path, slots, slot_size, ways):
+    """Файл кеша path для текущего процесса."""
+    found = _segments.get(path)
+    if found is not None and found.pid == os.getpid():
+        return found
+    with _segments_lock:
+        found = _segments.get(path)
+        if found is None or found.pid != os.getpid():
+            # после fork блокировки потоков родителя недействительны
+            found = _segments[path] = Segment(path, slots, slot_size, ways)
+        return found
+
+
+class SharedMemoryCache(BaseCache):
+    """Кеш-бэкенд в файле LOCATION, общем для процессов узла.
+
+    OPTIONS: SLOTS, SLOT_SIZE, WAYS - разметка нового файла.
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.path = location
+        self.layout = (
+            options.get('SLOTS', 2048),
+            options.get('SLOT_SIZE', 64 * 1024),
+            options.get('WAYS', 8),
+        )
+
+    @property
+    def segment(self):
+        return segment(self.path, *self.layout)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        key = key.encode()
+        return key, _hash(key)
+
+    def _read(self, segment, offset, key, key_hash, epoch):
+        """Значение слота offset без блокировки; MISSING - нет ключа."""
+        data = segment.map
+        for _ in range(READ_RETRIES):
+            seq, slot_epoch, slot_hash, expires, key_size, size, flags = \
+                SLOT_HEADER.unpack_from(data, offset)
+            if seq & 1:
+                continue
+            if slot_epoch != epoch or slot_hash != key_hash:
+                return MISSING
+            start = offset + PAYLOAD_OFFSET
+            payload = data[start:start + key_size + size]
+            if SEQ.unpack_from(data, offset)[0] != seq:
+                continue
+            if payload[:key_size] != key:
+                return MISSING
+            if expires and expires <= time.time():
+                return MISSING
+            data[offset + REF_OFFSET] = 1
+            value = payload[key_size:]
+            return zlib.decompress(value) if flags & COMPRESSED else value
+        return MISSING
+
+    def _get(self, key, version):
+        segment = self.segment
+        key, key_hash = self._key(key, version)
+        epoch = segment.epoch()
+        for offset in segment.slots(segment.bucket(key_hash)):
+            value = self._read(segment, offset, key, key_hash, epoch)
+            if value is not MISSING:
+                return value
+        return MISSING
+
+    def get(self, key, default=None, version=None):
+        value = self._get(key, version)
+        return default if value is MISSING else pickle.loads(value)
+
+    def has_key(self, key, version=None):
+        return self._get(key, version) is not MISSING
+
+    def _locate(self, segment, bucket, key, key_hash, epoch):
+        """Слот живого ключа в корзине; вызывается под блокировкой."""
+        for offset in segment.slots(bucket):
+            if self._read(segment, offset, key, key_hash, epoch) \
+                    is not MISSING:
+                return offset
+        return None
+
+    def _victim(self, segment, bucket, epoch):
+        """Пустой, истекший или вытесняемый по CLOCK слот корзины."""
+        data = segment.map
+        slots = segment.slots(bucket)
+        now = time.time()
+        for offset in slots:
+            _, slot_epoch, _, expires, _, _, _ = SLOT_HEADER.unpack_from(
+                data, offset
+            )
+            if slot_epoch != epoch or (expires and expires <= now):
+                return offset
+        hand_offset = HANDS_OFFSET + bucket
+        hand = data[hand_offset] % segment.ways
+        # за два круга слот без бита найдется, если читатели
+        # не ставят биты быстрее - тогда берем слот под стрелкой
+        for _ in range(2 * segment.ways):
+            if not data[slots[hand] + REF_OFFSET]:
+                break
+            data[slots[hand] + REF_OFFSET] = 0
+            hand = (hand + 1) % segment.ways
+        data[hand_offset] = (hand + 1) % segment.ways
+        return slots[hand]
+
+    def _write(self, segment, offset, fields, payload=None):
+        data = segment.map
+        seq = SEQ.unpack_from(data, offset)[0]
+        SEQ.pack_into(data, offset, (seq | 1) & 0xFFFFFFFF)
+        if payload is not None:
+            start = offset + PAYLOAD_OFFSET
+            data[start:start + len(payload)] = payload
+        SLOT_HEADER.pack_into(data, offset, seq | 1, *fields)
+        SEQ.pack_into(data, offset, ((seq | 1) + 1) & 0xFFFFFFFF)
+
+    def _encode(self, segment, key, value):
+        """Полезная нагрузка слота и флаги; None - не помещается."""
+        value = pickle.dumps(value, self.pickle_protocol)
+        flags = 0
+        if len(key) + len(value) > segment.capacity:
+            value, flags = zlib.compress(value), COMPRESSED
+            if len(key) + len(value) > segment.capacity:
+                return None
+        return key + value, len(value), flags
+
+    def _put(self, key, value, timeout, version, replace):
+        segment = self.segment
+        key, key_hash = self._key(key, version)
+        encoded = self._encode(segment, key, value)
+        expires = self.get_backend_timeout(timeout) or 0
+        bucket = segment.bucket(key_hash)
+        with segment.locked(HANDS_OFFSET + bucket):
+            epoch = segment.epoch()
+            offset = self._locate(segment, bucket, key, key_hash, epoch)
+            if offset is not None and not replace:
+                return False
+            if encoded is None:
+                # слишком большое значение - старое тоже не отдаем
+                if offset is not None:
+                    self._delete_slot(segment, offset)
+                return False
+            if offset is None:
+                offset = self._victim(segment, bucket, epoch)
+            payload, size, flags = encoded
+            self._write(segment, offset, (
+                epoch, key_hash, expires, len(key), size, flags
+            ), payload)
+            segment.map[offset + REF_OFFSET] = 0
+            return True
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._put(key, value, timeout, version, replace=True)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._put(key, value, timeout, version, replace=False)
+
+    def _delete_slot(self, segment, offset):
+        fields = list(SLOT_HEADER.unpack_from(segment.map, offset)[1:])
+        fields[0] = 0
+        self._write(segment, offset, fields)
+
+    def _update(self, key, version, change):
+        """Меняет слот ключа под блокировкой: change(offset)."""
+        segment = self.segment
+        key, key_hash = self._key(key, version)
+        bucket = segment.bucket(key_hash)
+        with segment.locked(HANDS_OFFSET + bucket):
+            offset = self._locate(
+                segment, bucket, key, key_hash, segment.epoch()
+            )
+            if offset is None:
+                return False
+            change(segment, offset)
+            return True
+
+    def delete(self, key, version=None):
+        self._update(key, version, self._delete_slot)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout) or 0
+
+        def change(segment, offset):
+            fields = list(SLOT_HEADER.unpack_from(segment.map, offset)[1:])
+            fields[2] = expires
+            self._write(segment, offset, fields)
+
+        return self._update(key, version, change)
+
+    def incr(self, key, delta=1, version=None):
+        """Как у встроенных бэкендов: ValueError, если ключа нет или
+        значение не число. Если новое значение не помещается в слот,
+        ключ удаляется, и тоже ValueError."""
+        result = []
+
+        def change(segment, offset):
+            _, epoch, key_hash, expires, key_size, size, flags = \
+                SLOT_HEADER.unpack_from(segment.map, offset)
+            start = offset + PAYLOAD_OFFSET
+            payload = segment.map[start:start + key_size + size]
+            value = payload[key_size:]
+            if flags & COMPRESSED:
+                value = zlib.decompress(value)
+            try:
+                result.append(pickle.loads(value) + delta)
+            except TypeError:
+                raise ValueError("Value of key '%s' is not a number" % key)
+            encoded = self._encode(segment, payload[:key_size], result[0])
+            if encoded is None:
+                self._delete_slot(segment, offset)
+                raise ValueError("Value of key '%s' is too large" % key)
+            payload, size, flags = encoded
+            self._write(segment, offset, (
+                epoch, key_hash, expires, key_size, size, flags
+            ), payload)
+
+        if not self._update(key, version, change):
+            raise ValueError("Key '%s' not found" % key)
+        return result[0]
+
+    def clear(self):
+        segment = self.segment
+        with segment.locked(EPOCH_OFFSET):
+            epoch = segment.epoch() % 0xFFFFFFFF + 1
+            EPOCH.pack_into(segment.map, EPOCH_OFFSET, epoch)
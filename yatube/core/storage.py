@@ -0,0 +1,79 @@
+"""Хранилище файлов с адресацией по содержимому.
+
+Имя файла - sha256 его содержимого: posts/ab/ab12...ef.jpg. Одинаковые
+файлы хранятся один раз, и на них ссылаются несколько записей; общими
+получаются и миниатюры, имена которых sorl-thumbnail выводит из имени
+картинки. Содержимое под таким именем не меняется, поэтому его можно
+отдавать с кешированием навсегда (см. core.views.media).
+Сохранение уже известного файла обновляет время его изменения: по нему
+сборка мусора (posts.media_gc) не трогает свежие файлы.
+"""
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CONTENT_NAME_RE = re.compile(r'(^|/)([0-9a-f]{2})/\2[0-9a-f]{62}(\.\w+)?$')
+
+
+def is_content_addressed(name):
+    """Имя дал ContentAddressedStorage - содержимое неизменно."""
+    return bool(CONTENT_NAME_RE.search(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage, называющий файлы по хешу содержимого."""
+
+    def content_name(self, name, content):
+        """Имя файла по содержимому; каталог и расширение - из name.
+
+        Содержимое читается частями: загруженный файл уже лежит
+        на диске и в память целиком не попадает.
+        """
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        try:
+            return super().save(name, content, max_length=max_length)
+        except FileExistsError:
+            # такое содержимое уже сохранено - ссылаемся на него;
+            # время изменения обновляется, чтобы сборка мусора
+            # не удалила файл, пока новая ссылка не закоммичена
+            self.touch(name)
+            return name.replace('\\', '/')
+
+    def touch(self, name):
+        try:
+            os.utime(self.path(name))
+        except OSError:
+            pass
+
+    def get_available_name(self, name, max_length=None):
+        # занятое имя не заменяется другим: под ним то же содержимое
+        if self.exists(name):
+            raise FileExistsError(name)
+        return name
+
+    def _save(self, name, content):
+        try:
+            return super()._save(name, content)
+        except OSError:
+            # параллельный запрос успел сохранить тот же файл
+            if self.exists(name):
+                return name.replace('\\', '/')
+            raise
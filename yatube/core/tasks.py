@@ -0,0 +1,50 @@
+"""Фоновое выполнение задач вне цикла запрос-ответ.
+
+Задачи выполняются в пуле потоков текущего процесса и стартуют
+только после коммита транзакции, в которой были поставлены,
+чтобы фоновый поток видел уже сохраненные данные.
+При settings.TASKS_ALWAYS_EAGER задачи выполняются сразу.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.TASKS_WORKERS,
+                thread_name_prefix='yatube-task'
+            )
+    return _executor
+
+
+def _run(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception('Фоновая задача %s завершилась ошибкой', func)
+        raise
+    finally:
+        # у каждого потока свои соединения с БД - закрываем их сами
+        connections.close_all()
+
+
+def run_async(func, *args, **kwargs):
+    """Ставит func(*args, **kwargs) в очередь фоновых задач."""
+    if settings.TASKS_ALWAYS_EAGER:
+        func(*args, **kwargs)
+        return
+    transaction.on_commit(
+        lambda: get_executor().submit(_run, func, args, kwargs)
+    )
@@ -0,0 +1,24 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from core import thumbnails
+from core.cards import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def cards(objects, template_name, name='object', preset=None, **variant):
+    """Список карточек записей objects из кеша, см. core.cards.
+
+    preset - набор миниатюр поля image, которые заранее ищутся
+    для отрисовываемых карточек, как в prefetch_thumbnails.
+    """
+    prepare = None
+    if preset is not None:
+        def prepare(objects):
+            thumbnails.prefetch([obj.image for obj in objects], preset)
+    return [
+        mark_safe(card) for card in
+        render_cards(objects, template_name, name, prepare, **variant)
+    ]
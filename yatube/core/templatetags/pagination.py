@@ -0,0 +1,24 @@
+from django import template
+
+from core.paginator import ELLIPSIS, elided_page_range, encode_cursor
+
+register = template.Library()
+
+
+@register.filter
+def cursor(obj):
+    """Непрозрачный курсор записи для ссылок ?after= и ?before=."""
+    if not obj:
+        return ''
+    return encode_cursor(obj)
+
+
+@register.simple_tag
+def page_range(page):
+    """Сокращённый список номеров страниц для навигации."""
+    return list(elided_page_range(page))
+
+
+@register.filter
+def is_ellipsis(value):
+    return value == ELLIPSIS
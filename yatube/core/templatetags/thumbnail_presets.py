@@ -0,0 +1,43 @@
+from django import template
+
+from core import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def preset_thumbnail(image, preset, ready=True):
+    """Готовые варианты миниатюры картинки (ResponsiveImage) или None.
+
+    Отсутствующие варианты не создаются во время отрисовки:
+    их создание ставится в фоновые задачи, а шаблон выводит заглушку
+    или srcset из уже готовых вариантов. Пока картинка не готова
+    (ready ложно - ее еще обрабатывают), миниатюры не ищутся.
+    """
+    if not image or not ready:
+        return None
+    thumbnail = thumbnails.get_cached(image, preset)
+    if thumbnail is None or not thumbnail.complete:
+        thumbnails.schedule(image.name)
+    return thumbnail
+
+
+@register.simple_tag
+def prefetch_thumbnails(objects, preset, field='image'):
+    """Заранее ищет миниатюры картинок всех объектов страницы.
+
+    Вызывается перед циклом по page_obj; ничего не выводит.
+    """
+    thumbnails.prefetch(
+        [getattr(obj, field) for obj in objects], preset
+    )
+    return ''
+
+
+@register.simple_tag
+def preset_size(preset, width, height):
+    """Размер миниатюры набора по сохраненному размеру картинки.
+
+    Нужен, чтобы отвести место под картинку, пока миниатюры нет.
+    """
+    return thumbnails.preset_size(preset, width, height)
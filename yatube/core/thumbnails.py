@@ -0,0 +1,469 @@
+"""Миниатюры картинок, подготовленные заранее.
+
+Шаблоны не создают миниатюры сами: тег preset_thumbnail только ищет
+готовую миниатюру в хранилище ключей sorl-thumbnail и, если ее нет,
+ставит создание в фоновые задачи, а страница выводит заглушку.
+Размеры и параметры миниатюр задаются именованными наборами
+settings.THUMBNAIL_PRESETS. Когда миниатюры файла созданы,
+отправляется сигнал thumbnails_ready с именем файла (если все они
+уже были готовы, сигнала нет).
+
+Каждый набор дает несколько вариантов: ширины из settings.THUMBNAIL_SCALES
+в каждом формате settings.THUMBNAIL_FORMATS (первый формат - запасной
+для img, остальные - source в <picture>). Варианты собираются
+в ResponsiveImage с готовыми srcset. Картинка декодируется один раз
+на все варианты.
+
+Для ленты миниатюры всех постов страницы ищутся заранее одним
+запросом к кешу (prefetch, тег prefetch_thumbnails); тег
+preset_thumbnail берет найденное из картинки, не обращаясь к хранилищу.
+"""
+import logging
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.dispatch import Signal
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.helpers import toint
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.kvstores.base import add_prefix, del_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+from sorl.thumbnail.parsers import parse_geometry
+
+from .tasks import run_async
+
+logger = logging.getLogger(__name__)
+
+PENDING_PREFIX = 'thumbnails:pending:'
+# результаты warm()
+MISSING = 'missing'
+FRESH = 'fresh'
+CREATED = 'created'
+# атрибут картинки, в котором prefetch оставляет найденные миниатюры
+PREFETCHED_ATTR = '_preset_thumbnails'
+
+thumbnails_ready = Signal(providing_args=['name'])
+
+Variant = namedtuple('Variant', 'geometry options format scale')
+
+
+class KVStore(cached_db_kvstore.KVStore):
+    """Хранилище ключей sorl-thumbnail с чтением многих ключей сразу."""
+
+    def get_many(self, image_files):
+        """Словарь image_file.key -> ImageFile или None.
+
+        Один get_many к кешу и один запрос к базе для промахов кеша.
+        """
+        keys = {add_prefix(image_file.key): image_file.key
+                for image_file in image_files}
+        values = self.cache.get_many(list(keys))
+        missing = [key for key in keys if key not in values]
+        if missing:
+            found = dict(
+                KVStoreModel.objects.filter(key__in=missing).values_list(
+                    'key', 'value'
+                )
+            )
+            fetched = {
+                key: found.get(key, cached_db_kvstore.EMPTY_VALUE)
+                for key in missing
+            }
+            self.cache.set_many(fetched, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+            values.update(fetched)
+        return {
+            keys[key]: (
+                None if value == cached_db_kvstore.EMPTY_VALUE or not value
+                else deserialize_image_file(value)
+            )
+            for key, value in values.items()
+        }
+
+    def source_keys(self, after='', limit=None):
+        """Ключи картинок, у которых есть миниатюры, по порядку после after."""
+        prefix = add_prefix('', 'thumbnails')
+        raw_keys = KVStoreModel.objects.filter(
+            key__startswith=prefix, key__gt=add_prefix(after, 'thumbnails')
+        ).order_by('key').values_list('key', flat=True)
+        return [del_prefix(key) for key in raw_keys[:limit]]
+
+    def get_by_key(self, key):
+        """ImageFile по ключу или None."""
+        return self._get(key)
+
+    def thumbnail_keys(self, source_key):
+        """Ключи миниатюр картинки."""
+        return self._get(source_key, identity='thumbnails') or []
+
+    def forget_thumbnails(self, source_key, keys):
+        """Удаляет записи миниатюр keys из списка миниатюр картинки."""
+        for key in keys:
+            self._delete(key)
+        rest = set(self.thumbnail_keys(source_key)) - set(keys)
+        if rest:
+            self._set(source_key, list(rest), identity='thumbnails')
+        else:
+            self._delete(source_key, identity='thumbnails')
+
+    def forget(self, source_key):
+        """Удаляет запись картинки и список ее миниатюр (не файлы)."""
+        self._delete(source_key)
+        self._delete(source_key, identity='thumbnails')
+
+    def has_keys(self, keys):
+        """Какие из ключей картинок есть в базе (кеш не читается)."""
+        raw_keys = {add_prefix(key): key for key in keys}
+        return {
+            raw_keys[raw_key]
+            for raw_key in KVStoreModel.objects.filter(
+                key__in=list(raw_keys)
+            ).values_list('key', flat=True)
+        }
+
+
+class PresetBackend(ThumbnailBackend):
+    """Бэкенд sorl-thumbnail, умеющий искать миниатюру без создания."""
+
+    def full_options(self, source, options):
+        """Параметры с умолчаниями - так их дополняет get_thumbnail."""
+        options = dict(options)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        return options
+
+    def thumbnail_file(self, file_, geometry_string, **options):
+        """Файл миниатюры с тем же именем, что даст get_thumbnail."""
+        # ключи sorl-thumbnail зависят от класса хранилища: картинка
+        # поста (ContentAddressedStorage) и картинка по имени из
+        # generate() должны давать одни и те же миниатюры
+        source = ImageFile(file_, default.storage)
+        name = self._get_thumbnail_filename(
+            source, geometry_string, self.full_options(source, options)
+        )
+        return ImageFile(name, default.storage)
+
+    def get_cached(self, file_, geometry_string, **options):
+        """Готовая миниатюра или None; картинка не открывается."""
+        return default.kvstore.get(
+            self.thumbnail_file(file_, geometry_string, **options)
+        )
+
+    def create_thumbnails(self, source, items):
+        """Создает миниатюры items - пар (geometry, options).
+
+        get_thumbnail декодирует картинку для каждой миниатюры заново,
+        здесь она декодируется один раз. Возвращает файлы миниатюр.
+        """
+        source_image = default.engine.get_image(source)
+        thumbnails = []
+        try:
+            image_info = default.engine.get_image_info(source_image)
+            source.set_size(default.engine.get_image_size(source_image))
+            for geometry, options in items:
+                thumbnail = self.thumbnail_file(source, geometry, **options)
+                # хранилище не перезаписывает файлы, а дает новое имя
+                if thumbnail.exists():
+                    thumbnail.delete()
+                options = self.full_options(source, options)
+                options['image_info'] = image_info
+                self._create_thumbnail(
+                    source_image, geometry, options, thumbnail
+                )
+                thumbnails.append(thumbnail)
+        finally:
+            default.engine.cleanup(source_image)
+        default.kvstore.get_or_set(source)
+        for thumbnail in thumbnails:
+            default.kvstore.set(thumbnail, source)
+        return thumbnails
+
+
+backend = PresetBackend()
+
+
+class ResponsiveImage:
+    """Готовые варианты миниатюры одного набора.
+
+    url, width и height - самого крупного варианта запасного формата,
+    srcset - все ширины запасного формата, sources - пары
+    (MIME-тип, srcset) остальных форматов для <picture>.
+    """
+
+    def __init__(self, preset, found):
+        # found - список пар (Variant, ImageFile или None)
+        self.sizes = settings.THUMBNAIL_PRESETS[preset][2]
+        self.found = found
+        self.fallback = found[0][1]
+
+    @property
+    def url(self):
+        return self.fallback.url
+
+    @property
+    def width(self):
+        return self.fallback.width
+
+    @property
+    def height(self):
+        return self.fallback.height
+
+    @property
+    def complete(self):
+        return all(thumbnail for _, thumbnail in self.found)
+
+    @property
+    def srcset(self):
+        return self._srcset(settings.THUMBNAIL_FORMATS[0])
+
+    @property
+    def sources(self):
+        return [
+            (f'image/{format_.lower()}', self._srcset(format_))
+            for format_ in settings.THUMBNAIL_FORMATS[1:]
+            if self._srcset(format_)
+        ]
+
+    def _srcset(self, format_):
+        return ', '.join(
+            f'{thumbnail.url} {thumbnail.width}w'
+            for variant, thumbnail in self.found
+            if variant.format == format_ and thumbnail
+        )
+
+
+def get_preset(name):
+    """Пара (geometry, options) набора миниатюр."""
+    geometry, options, _ = settings.THUMBNAIL_PRESETS[name]
+    return geometry, dict(options)
+
+
+def scale_geometry(geometry, scale):
+    """Geometry sorl-thumbnail, уменьшенная в scale раз: 800x600, x400, 600."""
+    return 'x'.join(
+        str(round(int(side) * scale)) if side else ''
+        for side in geometry.split('x')
+    )
+
+
+def preset_size(preset, width, height):
+    """Размер основной миниатюры набора для картинки width x height.
+
+    Считается так же, как масштабирует и обрезает sorl-thumbnail,
+    но без обращения к хранилищу; None, если размер картинки неизвестен.
+    """
+    if not width or not height:
+        return None
+    geometry, options = get_preset(preset)
+    options = dict(backend.default_options, **options)
+    box = parse_geometry(geometry, width / height)
+    factors = (box[0] / width, box[1] / height)
+    factor = max(factors) if options['crop'] else min(factors)
+    if factor < 1 or options['upscale']:
+        width, height = toint(width * factor), toint(height * factor)
+    if options['crop']:
+        width, height = min(width, box[0]), min(height, box[1])
+    return width, height
+
+
+def variants(preset):
+    """Варианты набора; первый - самый крупный в запасном формате."""
+    geometry, options = get_preset(preset)
+    return [
+        Variant(
+            scale_geometry(geometry, scale), dict(options, format=format_),
+            format_, scale
+        )
+        for format_ in settings.THUMBNAIL_FORMATS
+        for scale in sorted(settings.THUMBNAIL_SCALES, reverse=True)
+    ]
+
+
+def _thumbnail_files(file_, preset):
+    return [
+        (variant, backend.thumbnail_file(
+            file_, variant.geometry, **variant.options
+        ))
+        for variant in variants(preset)
+    ]
+
+
+def _get_many(thumbnail_files):
+    get_many = getattr(default.kvstore, 'get_many', None)
+    if get_many is not None:
+        return get_many(thumbnail_files)
+    return {
+        thumbnail.key: default.kvstore.get(thumbnail)
+        for thumbnail in thumbnail_files
+    }
+
+
+def _responsive(preset, thumbnail_files, found):
+    image = ResponsiveImage(preset, [
+        (variant, found.get(thumbnail.key))
+        for variant, thumbnail in thumbnail_files
+    ])
+    return image if image.fallback else None
+
+
+def get_cached(file_, preset):
+    """Готовые миниатюры файла для набора preset (ResponsiveImage).
+
+    None, если нет основной миниатюры; если не хватает части
+    вариантов, complete у результата ложно.
+    """
+    if not file_:
+        return None
+    prefetched = getattr(file_, PREFETCHED_ATTR, {})
+    if preset in prefetched:
+        return prefetched[preset]
+    thumbnail_files = _thumbnail_files(file_, preset)
+    found = _get_many([thumbnail for _, thumbnail in thumbnail_files])
+    return _responsive(preset, thumbnail_files, found)
+
+
+def prefetch(files, preset):
+    """Ищет миниатюры набора preset для всех файлов разом.
+
+    Результат сохраняется в самих файлах (FieldFile поста), и
+    get_cached для них уже не обращается к хранилищу ключей.
+    """
+    files = [file_ for file_ in files if file_]
+    if not files or not hasattr(default.kvstore, 'get_many'):
+        return
+    per_file = [_thumbnail_files(file_, preset) for file_ in files]
+    found = _get_many([
+        thumbnail
+        for thumbnail_files in per_file
+        for _, thumbnail in thumbnail_files
+    ])
+    for file_, thumbnail_files in zip(files, per_file):
+        prefetched = file_.__dict__.setdefault(PREFETCHED_ATTR, {})
+        prefetched[preset] = _responsive(preset, thumbnail_files, found)
+
+
+def _all_variants():
+    return [
+        variant
+        for preset in settings.THUMBNAIL_PRESETS
+        for variant in variants(preset)
+    ]
+
+
+def current_thumbnails(name):
+    """Файлы миниатюр, которые текущие наборы дают для картинки name."""
+    return [
+        backend.thumbnail_file(name, variant.geometry, **variant.options)
+        for variant in _all_variants()
+    ]
+
+
+def _exists(name):
+    try:
+        return default.storage.exists(name)
+    except (SuspiciousFileOperation, OSError):
+        # путь вне хранилища или недоступный файл - миниатюр не будет
+        return False
+
+
+def generate(name):
+    """Создает миниатюры файла name для всех наборов и вариантов.
+
+    Возвращает число созданных или уже готовых миниатюр. Сигнал
+    thumbnails_ready отправляется, только если что-то создано: картинку,
+    которую уже загружали (одинаковые файлы хранятся один раз), незачем
+    заново показывать во всех постах с ней.
+    """
+    done = created = 0
+    try:
+        if not _exists(name):
+            logger.info('Картинка %s не найдена', name)
+            return done
+        source = ImageFile(name, default.storage)
+        items = [
+            (variant.geometry, variant.options) for variant in _all_variants()
+        ]
+        thumbnail_files = [
+            backend.thumbnail_file(source, geometry, **options)
+            for geometry, options in items
+        ]
+        found = _get_many(thumbnail_files)
+        missing = [
+            item for item, thumbnail in zip(items, thumbnail_files)
+            if found.get(thumbnail.key) is None
+        ]
+        if missing:
+            created = len(backend.create_thumbnails(source, missing))
+        done = len(items)
+    finally:
+        cache.delete(PENDING_PREFIX + name)
+    if created:
+        thumbnails_ready.send(sender=PresetBackend, name=name)
+    return done
+
+
+def schedule(name):
+    """Ставит создание миниатюр файла в фоновые задачи.
+
+    Повторный вызов, пока задача не выполнена, ничего не делает.
+    """
+    if not name:
+        return
+    if cache.add(PENDING_PREFIX + name, True,
+                 settings.THUMBNAIL_PENDING_TIMEOUT):
+        run_async(generate, name)
+
+
+def _is_fresh(thumbnail, source_mtime):
+    return (
+        default.kvstore.get(thumbnail) is not None
+        and thumbnail.exists()
+        and default.storage.get_modified_time(thumbnail.name) >= source_mtime
+    )
+
+
+def _forget(image_file):
+    # удаляем и запись, и файл: иначе get_thumbnail найдет старый файл
+    # и не станет создавать миниатюру заново
+    default.kvstore.delete(image_file, delete_thumbnails=False)
+    image_file.delete()
+
+
+def warm(name, force=False):
+    """Создает отсутствующие и устаревшие миниатюры файла name.
+
+    Миниатюра устарела, если она старше самой картинки (например,
+    картинку восстановили из резервной копии). При force миниатюры
+    создаются заново в любом случае. Возвращает MISSING, FRESH
+    или CREATED.
+    """
+    if not _exists(name):
+        return MISSING
+    source = ImageFile(name, default.storage)
+    source_mtime = default.storage.get_modified_time(name)
+    stale = []
+    for variant in _all_variants():
+        thumbnail = backend.thumbnail_file(
+            source, variant.geometry, **variant.options
+        )
+        if force or not _is_fresh(thumbnail, source_mtime):
+            _forget(thumbnail)
+            stale.append((variant.geometry, variant.options))
+    if not stale:
+        return FRESH
+    # размеры картинки в хранилище ключей тоже могли устареть
+    default.kvstore.delete(source, delete_thumbnails=False)
+    backend.create_thumbnails(source, stale)
+    thumbnails_ready.send(sender=PresetBackend, name=name)
+    return CREATED
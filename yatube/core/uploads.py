@@ -0,0 +1,218 @@
+"""Загрузка картинок с ограниченным расходом памяти.
+
+Загруженные файлы пишутся на диск по частям (settings.FILE_UPLOAD_HANDLERS
+без MemoryFileUploadHandler), а LimitedUploadHandler не пропускает дальше
+больше settings.UPLOAD_MAX_SIZE байт одного файла. clean_image
+проверяет число пикселей по заголовку картинки, не декодируя ее,
+а потом нормализует картинку (normalize): поворачивает по EXIF,
+уменьшает слишком большую и удаляет метаданные - не больше
+settings.UPLOAD_RESIZE_WORKERS картинок одновременно в процессе.
+Запрос не ждет свободного места: если все заняты, картинка помечается
+(deferred) и, как при settings.IMAGE_PROCESSING_ASYNC, нормализуется
+в фоне (posts.processing).
+"""
+import os
+import threading
+from io import BytesIO
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from PIL import Image, ImageOps
+
+from .images import EXIF_ORIENTATION
+
+MB = 1024 * 1024
+JPEG_QUALITY = 90
+# метаданные, которые не хранятся: в EXIF бывают координаты съемки
+STRIPPED_INFO = ('exif', 'xmp', 'XML:com.adobe.xmp')
+
+_resize_slots = None
+_resize_slots_lock = threading.Lock()
+
+
+def get_resize_slots():
+    global _resize_slots
+    with _resize_slots_lock:
+        if _resize_slots is None:
+            _resize_slots = threading.BoundedSemaphore(
+                settings.UPLOAD_RESIZE_WORKERS
+            )
+    return _resize_slots
+
+
+class ResizeBusy(Exception):
+    """Все места для нормализации в процессе заняты."""
+
+
+class RejectedUpload(UploadedFile):
+    """Файл больше UPLOAD_MAX_SIZE: содержимого нет, известен размер."""
+
+    def __init__(self, name, content_type, size, charset=None,
+                 content_type_extra=None):
+        super().__init__(
+            BytesIO(), name, content_type, size, charset, content_type_extra
+        )
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    """Первый в цепочке обработчик: обрезает слишком большие файлы.
+
+    Части файла сверх лимита не передаются следующим обработчикам
+    (остаток запроса читается, но никуда не пишется), а вместо файла
+    форма получает RejectedUpload.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.UPLOAD_MAX_SIZE:
+            return None
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.received <= settings.UPLOAD_MAX_SIZE:
+            return None
+        return RejectedUpload(
+            self.file_name, self.content_type, file_size, self.charset,
+            self.content_type_extra
+        )
+
+
+def _read_size(data):
+    # Image.open читает только заголовок, пиксели не декодируются
+    try:
+        with Image.open(data) as image:
+            return image.size
+    finally:
+        data.seek(0)
+
+
+def _needs_normalizing(image, max_side):
+    return (
+        max(image.size) > max_side
+        or any(key in image.info for key in STRIPPED_INFO)
+    )
+
+
+def normalize(source, max_side, target=None, blocking=True):
+    """Приводит картинку к виду для хранения.
+
+    Поворачивает по EXIF Orientation, уменьшает до max_side по большей
+    стороне и пережимает в том же формате без EXIF и XMP (цветовой
+    профиль сохраняется). Результат пишется в target, а без него -
+    поверх source; в обоих случаях файл остается на начале.
+    Возвращает False, если менять нечего: анимированные картинки
+    и картинки без метаданных не больше max_side не пережимаются.
+    Без blocking при занятых местах сразу вызывает ResizeBusy.
+    """
+    target = source if target is None else target
+    slots = get_resize_slots()
+    if not slots.acquire(blocking):
+        raise ResizeBusy
+    try:
+        return _normalize(source, max_side, target)
+    finally:
+        slots.release()
+
+
+def _normalize(source, max_side, target):
+    with Image.open(source) as image:
+        if (getattr(image, 'is_animated', False)
+                or not _needs_normalizing(image, max_side)):
+            source.seek(0)
+            return False
+        image_format = image.format
+        options = {'quality': JPEG_QUALITY}
+        if 'icc_profile' in image.info:
+            options['icc_profile'] = image.info['icc_profile']
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        if max(image.size) > max_side or orientation != 1:
+            # JPEG сразу декодируется уменьшенным в 2-8 раз
+            image.draft(image.mode, (max_side, max_side))
+            result = ImageOps.exif_transpose(image)
+            result.thumbnail((max_side, max_side), Image.LANCZOS)
+        else:
+            # только метаданные: JPEG пережимается с прежними таблицами
+            # квантования, без потери качества
+            image.load()
+            result = image
+            if image_format == 'JPEG':
+                options['quality'] = 'keep'
+        if image_format == 'JPEG' and result.mode not in ('RGB', 'L'):
+            result = result.convert('RGB')
+            options['quality'] = JPEG_QUALITY
+        # исходные пиксели уже прочитаны, файл можно перезаписать
+        target.seek(0)
+        target.truncate()
+        result.save(target, format=image_format, **options)
+    target.seek(0)
+    return True
+
+
+def split_rejected(files):
+    """Отделяет RejectedUpload от остальных файлов формы.
+
+    ImageField назвал бы обрезанный при приеме файл битой картинкой,
+    поэтому форма проверяет его сама: см. clean_image.
+    """
+    rejected = {
+        name: upload for name, upload in files.items()
+        if isinstance(upload, RejectedUpload)
+    }
+    if not rejected:
+        return files, rejected
+    files = files.copy()
+    for name in rejected:
+        del files[name]
+    return files, rejected
+
+
+def deferred(upload):
+    """Нормализацию картинки отложили до фоновой задачи."""
+    return getattr(upload, 'normalize_later', False)
+
+
+def clean_image(upload, process=True):
+    """Проверяет загруженную картинку и при process нормализует ее.
+
+    Число пикселей берется из заголовка, картинка не декодируется.
+    Без process или без свободного места (deferred) нормализацию
+    (normalize) делают позже, в фоне. Уже сохраненный файл
+    (не UploadedFile) возвращается как есть.
+    """
+    if isinstance(upload, RejectedUpload):
+        raise ValidationError(
+            'Файл больше %(limit)d МБ', code='too_large',
+            params={'limit': settings.UPLOAD_MAX_SIZE // MB}
+        )
+    if not isinstance(upload, UploadedFile):
+        return upload
+    try:
+        width, height = _read_size(upload)
+        if width * height > settings.UPLOAD_MAX_PIXELS:
+            raise ValidationError(
+                'Картинка больше %(limit)d мегапикселей',
+                code='too_many_pixels',
+                params={'limit': settings.UPLOAD_MAX_PIXELS // 10 ** 6}
+            )
+        if process and normalize(
+            upload, settings.UPLOAD_MAX_SIDE, blocking=False
+        ):
+            upload.size = upload.seek(0, os.SEEK_END)
+            upload.seek(0)
+        return upload
+    except ResizeBusy:
+        upload.normalize_later = True
+        return upload
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # заголовок и verify в ImageField прошли, а данные битые
+        raise ValidationError(
+            forms.ImageField.default_error_messages['invalid_image'],
+            code='invalid_image'
+        )
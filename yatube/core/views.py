@@ -1,4 +1,11 @@
 from django.shortcuts import render
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+
+from .storage import is_content_addressed
+
+# год - дольше браузеры все равно не хранят
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
 
 
 def page_not_found(request, exception):
@@ -11,3 +18,16 @@ def csrf_failure(request, reason=''):
 
 def internal_server_error(request):
     return render(request, 'core/500internal.html')
+
+
+def media(request, path, document_root=None, show_indexes=False):
+    """Раздача загруженных файлов при DEBUG.
+
+    Файлы с именем по содержимому кешируются браузером навсегда.
+    """
+    response = serve(request, path, document_root, show_indexes)
+    if response.status_code == 200 and is_content_addressed(path):
+        patch_cache_control(
+            response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True
+        )
+    return response
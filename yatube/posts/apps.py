@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        from . import holes, search, signals  # noqa: F401
+        # миграции, пересоздающие posts_post, удаляют триггеры поиска
+        post_migrate.connect(
+            search.ensure_triggers, sender=self,
+            dispatch_uid='posts.search.ensure_triggers'
+        )
@@ -0,0 +1,104 @@
+"""Денормализованные счетчики постов, комментариев и подписок.
+
+Счетчики меняются обработчиками сигналов в той же транзакции, что
+и сама запись (см. core.models.AtomicSaveModel). Операции в обход
+моделей - bulk_create, update, удаление через SQL - счетчики
+не меняют, после них нужна команда reconcile_counters.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Comment, Follow, Group, Post, User, UserCounters
+
+
+def _change(queryset, **deltas):
+    queryset.update(**{
+        field: Greatest(F(field) + delta, 0)
+        for field, delta in deltas.items()
+    })
+
+
+def change_user(user_id, **deltas):
+    # строки еще нет - ее создаст user_counters() при первом чтении
+    _change(UserCounters.objects.filter(user_id=user_id), **deltas)
+
+
+def change_group(group_id, delta):
+    if group_id is not None:
+        _change(Group.objects.filter(pk=group_id), posts_count=delta)
+
+
+def change_post(post_id, delta):
+    _change(Post.objects.filter(pk=post_id), comments_count=delta)
+
+
+def user_counters(user):
+    """Счетчики пользователя; при отсутствии строки она считается."""
+    try:
+        return user.counters
+    except UserCounters.DoesNotExist:
+        return reconcile_user(user.pk)
+
+
+def reconcile_user(user_id):
+    counters, _ = UserCounters.objects.update_or_create(
+        user_id=user_id,
+        defaults={
+            'posts_count': Post.objects.filter(author_id=user_id).count(),
+            'followers_count': Follow.objects.filter(
+                author_id=user_id
+            ).count(),
+            'following_count': Follow.objects.filter(
+                user_id=user_id
+            ).count(),
+        }
+    )
+    return counters
+
+
+def reconcile_group(group_id):
+    Group.objects.filter(pk=group_id).update(
+        posts_count=Post.objects.filter(group_id=group_id).count()
+    )
+
+
+def _count(queryset, field, outer='pk'):
+    """Подзапрос: число строк queryset, где field совпадает с outer."""
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef(outer)}).order_by().values(
+                field
+            ).annotate(total=Count('pk')).values('total'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+def reconcile():
+    """Пересчитывает все счетчики по таблицам.
+
+    Возвращает словарь: таблица -> число пересчитанных строк.
+    """
+    UserCounters.objects.bulk_create(
+        [
+            UserCounters(user_id=user_id)
+            for user_id in User.objects.filter(
+                counters__isnull=True
+            ).values_list('pk', flat=True)
+        ],
+        ignore_conflicts=True
+    )
+    return {
+        'groups': Group.objects.update(
+            posts_count=_count(Post.objects.all(), 'group')
+        ),
+        'posts': Post.objects.update(
+            comments_count=_count(Comment.objects.all(), 'post')
+        ),
+        'users': UserCounters.objects.update(
+            posts_count=_count(Post.objects.all(), 'author', 'user_id'),
+            followers_count=_count(Follow.objects.all(), 'author', 'user_id'),
+            following_count=_count(Follow.objects.all(), 'user', 'user_id'),
+        ),
+    }
@@ -1,5 +1,8 @@
+from django.conf import settings
 from django.forms import ModelForm, Textarea
 
+from core import uploads
+
 from .models import Post, Comment
 
 
@@ -8,6 +11,16 @@ class PostForm(ModelForm):
         model = Post
         fields = ('text', 'group', 'image')
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.files, self.rejected = uploads.split_rejected(self.files)
+
+    def clean_image(self):
+        return uploads.clean_image(
+            self.rejected.get('image', self.cleaned_data['image']),
+            process=not settings.IMAGE_PROCESSING_ASYNC
+        )
+
 
 class CommentForm(ModelForm):
     class Meta:
@@ -0,0 +1,43 @@
+"""Личные куски страниц (core.holes): все, что зависит от пользователя."""
+from core.holes import hole
+
+from .forms import CommentForm
+from .models import Follow
+
+
+@hole('header_new_post', 'includes/header_new_post.html')
+def header_new_post(request):
+    return {}
+
+
+@hole('header_auth', 'includes/header_auth.html')
+def header_auth(request):
+    return {}
+
+
+@hole('feed_switcher', 'posts/includes/switcher.html')
+def feed_switcher(request):
+    return {}
+
+
+@hole('follow_button', 'posts/includes/follow_button.html')
+def follow_button(request, author_id, username):
+    user = request.user
+    show = user.is_authenticated and user.pk != author_id
+    return {
+        'show': show,
+        'username': username,
+        'following': show and Follow.objects.filter(
+            user=user, author_id=author_id
+        ).exists(),
+    }
+
+
+@hole('edit_link', 'posts/includes/edit_link.html')
+def edit_link(request, post_id, author_id):
+    return {'post_id': post_id, 'editable': request.user.pk == author_id}
+
+
+@hole('comment_form', 'posts/includes/comment_form.html')
+def comment_form(request, post_id):
+    return {'post_id': post_id, 'form': CommentForm()}
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import images, invalidation
+from posts.models import Post
+from posts.signals import post_scopes
+
+FIELDS = ('image_width', 'image_height', 'image_color', 'updated')
+
+
+class Command(BaseCommand):
+    help = (
+        'Записывает в посты размеры и средний цвет картинок, '
+        'загруженных до появления этих полей'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=200,
+            help='Сколько постов читать и сохранять за раз'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересчитать сведения и для постов, где они уже есть'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('Неверный размер пачки')
+        posts = Post.objects.exclude(image='')
+        if not options['force']:
+            posts = posts.filter(image_width__isnull=True)
+        updated = unreadable = 0
+        for batch in self.batches(posts, options['batch_size']):
+            for post in batch:
+                info = images.describe(post.image)
+                if info == images.EMPTY:
+                    unreadable += 1
+                (post.image_width, post.image_height,
+                 post.image_color) = info
+                post.updated = timezone.now()
+            Post.objects.bulk_update(batch, FIELDS)
+            # карточки в кеше собраны без размеров и цвета
+            invalidation.bump(*{
+                name for post in batch for name in post_scopes(post)
+            })
+            updated += len(batch)
+            self.stdout.write(f'Обработано постов: {updated}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: обновлено {updated - unreadable}, '
+            f'не прочитано {unreadable}'
+        ))
+
+    def batches(self, posts, size):
+        last_pk = 0
+        while True:
+            batch = list(
+                posts.filter(pk__gt=last_pk).order_by('pk').only(
+                    'pk', 'image', 'author', 'group'
+                )[:size]
+            )
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1].pk
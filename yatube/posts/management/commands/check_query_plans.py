@@ -0,0 +1,92 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+
+from core.explain import PlanChecker
+from core.paginator import encode_cursor
+from posts import views
+from posts.models import Follow, Post
+
+# запросы, которым полный проход разрешен явно
+ALLOWED_SCANS = (
+    # число всех постов для номеров страниц главной: отдельного счетчика
+    # нет, а проход идет по покрывающему индексу
+    'SELECT COUNT(*) AS "__count" FROM "posts_post"',
+)
+
+DUMMY_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет запросы лент на текущей базе и проверяет их планы '
+        '(EXPLAIN QUERY PLAN): без полных проходов по таблицам '
+        'и сортировок во временном B-дереве'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-plans',
+            action='store_true',
+            help='Выводить планы всех запросов'
+        )
+
+    def requests(self):
+        """Пары (имя, view, kwargs, user) по последнему посту в базе."""
+        post = Post.objects.select_related('author', 'group').first()
+        if post is None:
+            raise CommandError('В базе нет постов для проверки')
+        reader = Follow.objects.filter(author_id=post.author_id).first()
+        pages = [
+            ('index', views.index, {}, None),
+            ('profile', views.profile, {'username': post.author.username},
+             None),
+            ('post_detail', views.post_detail, {'post_id': post.pk}, None),
+            ('post_comments', views.post_comments, {'post_id': post.pk},
+             None),
+        ]
+        if post.group is not None:
+            pages.append(
+                ('group_list', views.group_posts, {'slug': post.group.slug},
+                 None)
+            )
+        if reader is not None:
+            pages.append(
+                ('follow_index', views.follow_index, {}, reader.user)
+            )
+        return pages, encode_cursor(post)
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        pages, cursor = self.requests()
+        failed = 0
+        # кеш отключен, иначе запросы из закешированных фрагментов
+        # не выполнятся и не попадут в проверку
+        with override_settings(CACHES=DUMMY_CACHES):
+            for name, view, kwargs, user in pages:
+                url = reverse(f'posts:{name}', kwargs=kwargs)
+                for query_string in ('', f'?after={cursor}'):
+                    request = factory.get(url + query_string)
+                    request.user = user or AnonymousUser()
+                    with PlanChecker(allowed=ALLOWED_SCANS) as checker:
+                        view(request, **kwargs)
+                    failed += len(checker.problems)
+                    self.report(url + query_string, checker, options)
+        if failed:
+            raise CommandError(f'Запросов без подходящего индекса: {failed}')
+        self.stdout.write(self.style.SUCCESS('Все запросы используют индексы'))
+
+    def report(self, url, checker, options):
+        self.stdout.write(f'{url}: запросов {len(checker.plans)}')
+        if options['verbose_plans']:
+            for sql, plan in checker.plans:
+                self.stdout.write(f'  {sql}')
+                for line in plan:
+                    self.stdout.write(f'    {line}')
+        for sql, problems in checker.problems:
+            self.stderr.write(f'  {sql}')
+            for line in problems:
+                self.stderr.write(self.style.ERROR(f'    {line}'))
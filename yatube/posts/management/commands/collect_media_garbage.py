@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+
+from posts import media_gc
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет картинки без постов, их миниатюры и записи '
+        'sorl-thumbnail, устаревшие миниатюры и файлы миниатюр '
+        'без записей'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько файлов или записей проверять за раз'
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0.1,
+            help='Пауза между пачками в секундах - чтобы не нагружать диск'
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=24 * 60 * 60,
+            help='Не трогать файлы моложе стольких секунд'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['sleep'] < 0:
+            raise CommandError('Неверный размер пачки или пауза')
+        collector = media_gc.Collector(
+            batch_size=options['batch_size'],
+            min_age=options['min_age'],
+            sleep=options['sleep'],
+            dry_run=options['dry_run'],
+            progress=self.report
+        )
+        stats = collector.run()
+        verb = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb}: картинок {stats[media_gc.SOURCES]}, '
+            f'записей картинок {stats[media_gc.RECORDS]}, '
+            f'устаревших миниатюр {stats[media_gc.STALE]}, '
+            f'миниатюр без записей {stats[media_gc.THUMBNAILS]}; '
+            f'объем {filesizeformat(collector.freed)}'
+        ))
+
+    def report(self, collector, stage):
+        self.stdout.write(
+            f'{stage}: найдено {collector.stats[stage]}, '
+            f'всего {filesizeformat(collector.freed)}'
+        )
@@ -0,0 +1,69 @@
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import invalidation, thumbnails
+from core.storage import is_content_addressed
+from posts.models import Post
+from posts.signals import post_scopes
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит картинки постов, загруженные до хранилища '
+        'по содержимому, под имена-хеши; одинаковые файлы '
+        'остаются в одном экземпляре'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=200,
+            help='Сколько разных имен файлов читать за раз'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('Неверный размер пачки')
+        storage = Post._meta.get_field('image').storage
+        moved = merged = missing = 0
+        for names in self.batches(options['batch_size']):
+            for name in names:
+                if not self.exists(storage, name):
+                    missing += 1
+                    continue
+                with storage.open(name) as content:
+                    new_name = storage.save(name, content)
+                posts = Post.objects.filter(image=name)
+                merged += Post.objects.filter(image=new_name).exists()
+                scopes = {
+                    scope for post in posts.only('author', 'group')
+                    for scope in post_scopes(post)
+                }
+                posts.update(image=new_name, updated=timezone.now())
+                invalidation.bump(*scopes)
+                thumbnails.schedule(new_name)
+                moved += 1
+        # старые файлы и их миниатюры остаются до сборки мусора
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено файлов: {moved}, совпали с уже сохраненными: '
+            f'{merged}, не найдено: {missing}'
+        ))
+
+    def exists(self, storage, name):
+        try:
+            return storage.exists(name)
+        except SuspiciousFileOperation:
+            # путь вне MEDIA_ROOT
+            return False
+
+    def batches(self, size):
+        names = Post.objects.exclude(image='').order_by('image').values_list(
+            'image', flat=True
+        ).distinct()
+        last = ''
+        while True:
+            batch = list(names.filter(image__gt=last)[:size])
+            if not batch:
+                return
+            yield [name for name in batch if not is_content_addressed(name)]
+            last = batch[-1]
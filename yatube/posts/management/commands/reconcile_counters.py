@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики постов, комментариев и подписок'
+
+    def handle(self, *args, **options):
+        for table, total in counters.reconcile().items():
+            self.stdout.write(f'{table}: пересчитано строк {total}')
+        self.stdout.write(self.style.SUCCESS('Счетчики сверены'))
@@ -0,0 +1,146 @@
+import multiprocessing
+import os
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import thumbnails
+from posts.models import Post
+
+DEFAULT_CHECKPOINT = os.path.join(settings.BASE_DIR, '.warm_thumbnails')
+ERROR = 'error'
+
+
+def _warm(args):
+    # ошибка одной картинки не должна останавливать весь пул
+    name, force = args
+    try:
+        return name, thumbnails.warm(name, force), None
+    except Exception as error:
+        return name, ERROR, repr(error)
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает миниатюры всех картинок постов в пуле процессов: '
+        'отсутствующие и устаревшие, с возможностью продолжить '
+        'прерванный запуск'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count(),
+            help='Число процессов; 0 - без пула, в текущем процессе'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=200,
+            help='Сколько постов читать и отмечать в контрольной точке за раз'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Создать миниатюры заново, даже если они актуальны'
+        )
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Продолжить с поста после контрольной точки'
+        )
+        parser.add_argument(
+            '--checkpoint', default=DEFAULT_CHECKPOINT,
+            help='Файл контрольной точки - pk последнего обработанного поста'
+        )
+
+    def handle(self, *args, **options):
+        if options['processes'] < 0 or options['batch_size'] < 1:
+            raise CommandError('Неверное число процессов или размер пачки')
+        last_pk = self.read_checkpoint(options) if options['resume'] else 0
+        posts = Post.objects.exclude(image='').filter(pk__gt=last_pk)
+        total = posts.count()
+        results = Counter()
+        processed = 0
+        started = time.monotonic()
+        pool = self.make_pool(options['processes'])
+        try:
+            for batch in self.batches(posts, options['batch_size']):
+                names = list(dict.fromkeys(name for _, name in batch))
+                for name, status, error in pool.map(
+                    _warm, [(name, options['force']) for name in names]
+                ):
+                    results[status] += 1
+                    if error:
+                        self.stderr.write(f'{name}: {error}')
+                self.write_checkpoint(options, batch[-1][0])
+                processed += len(batch)
+                self.report(results, processed, total, started)
+        finally:
+            pool.close()
+            pool.join()
+        if os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+        self.stdout.write(self.style.SUCCESS(
+            'Готово: ' + ', '.join(
+                f'{status} {count}' for status, count in sorted(
+                    results.items()
+                )
+            )
+        ))
+
+    def make_pool(self, processes):
+        if not processes:
+            return InlinePool()
+        # дочерние процессы откроют свои соединения с базой
+        connections.close_all()
+        return multiprocessing.Pool(processes)
+
+    def batches(self, posts, size):
+        last_pk = 0
+        while True:
+            batch = list(
+                posts.filter(pk__gt=last_pk).order_by('pk').values_list(
+                    'pk', 'image'
+                )[:size]
+            )
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1][0]
+
+    def read_checkpoint(self, options):
+        try:
+            with open(options['checkpoint']) as checkpoint:
+                return int(checkpoint.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        except ValueError:
+            raise CommandError(
+                f'Испорчена контрольная точка {options["checkpoint"]}'
+            )
+
+    def write_checkpoint(self, options, pk):
+        with open(options['checkpoint'], 'w') as checkpoint:
+            checkpoint.write(str(pk))
+
+    def report(self, results, processed, total, started):
+        elapsed = time.monotonic() - started
+        rate = processed / elapsed if elapsed else 0
+        self.stdout.write(
+            f'Постов {processed} из {total}, '
+            f'создано {results[thumbnails.CREATED]}, '
+            f'актуальны {results[thumbnails.FRESH]}, '
+            f'{rate:.1f} постов/с'
+        )
+
+
+class InlinePool:
+    """Заменяет пул при --processes 0: map в текущем процессе."""
+
+    def map(self, func, iterable):
+        return [func(item) for item in iterable]
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
@@ -0,0 +1,223 @@
+"""Сборка мусора в медиа постов.
+
+Картинки, на которые больше не ссылается ни один пост (картинку
+заменили или пост удалили), остаются на диске вместе с миниатюрами
+и записями sorl-thumbnail. Collector проходит их в три прохода,
+каждый - пачками по batch_size с паузой sleep между пачками:
+
+1. файлы в каталоге картинок постов без поста - удаляются вместе
+   с миниатюрами и записями о них;
+2. записи о миниатюрах в хранилище ключей: для картинок без поста
+   удаляются все, для остальных - миниатюры, которых не дают текущие
+   наборы (устаревшие после смены THUMBNAIL_PRESETS и форматов);
+3. файлы миниатюр без записи в хранилище ключей.
+
+Файлы моложе min_age не трогаются: картинку могли уже сохранить,
+а пост с ней - еще не закоммитить. Перед удалением картинка
+проверяется еще раз: за время прохода на уже существующий файл
+могли сослаться заново (хранилище при этом обновляет его время).
+"""
+import os
+import time
+from collections import Counter
+
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+
+from core import thumbnails
+
+from .models import Post
+
+SOURCES = 'sources'
+RECORDS = 'records'
+STALE = 'stale'
+THUMBNAILS = 'thumbnails'
+
+
+def _files(storage, directory):
+    """(имя, stat) файлов каталога хранилища, по порядку имен."""
+    root = storage.path(directory)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            name = os.path.relpath(path, storage.location)
+            yield name.replace(os.sep, '/'), os.stat(path)
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _referenced(names):
+    return set(
+        Post.objects.filter(image__in=names).values_list('image', flat=True)
+    )
+
+
+class Collector:
+    """Находит и (если не dry_run) удаляет мусор в медиа постов.
+
+    stats - число найденных объектов по видам (SOURCES, RECORDS,
+    STALE, THUMBNAILS), freed - их размер в байтах.
+    """
+
+    def __init__(self, batch_size=500, min_age=24 * 60 * 60, sleep=0,
+                 dry_run=False, progress=None):
+        self.batch_size = batch_size
+        self.min_age = min_age
+        self.sleep = sleep
+        self.dry_run = dry_run
+        self.progress = progress or (lambda collector, stage: None)
+        self.storage = Post._meta.get_field('image').storage
+        self.stats = Counter()
+        self.freed = 0
+        self.forgotten = set()
+
+    def run(self):
+        self.collect_sources()
+        self.collect_records()
+        self.collect_thumbnails()
+        return self.stats
+
+    def _batch_done(self, stage):
+        self.progress(self, stage)
+        if self.sleep:
+            time.sleep(self.sleep)
+
+    def _old_enough(self, stat):
+        return stat.st_mtime < time.time() - self.min_age
+
+    def _still_garbage(self, name):
+        # время проверяется раньше базы: новая ссылка сначала
+        # обновляет время файла, а потом коммитится
+        try:
+            stat = os.stat(self.storage.path(name))
+        except OSError:
+            return False
+        return self._old_enough(stat) and not Post.objects.filter(
+            image=name
+        ).exists()
+
+    def _size(self, storage, name):
+        try:
+            return storage.size(name)
+        except OSError:
+            return 0
+
+    def _delete_thumbnail(self, image_file):
+        self.freed += self._size(default.storage, image_file.name)
+        if not self.dry_run:
+            image_file.delete()
+
+    def _delete_source_records(self, source_key):
+        # при dry_run записи остаются, и проход 2 не должен
+        # посчитать их второй раз
+        if source_key in self.forgotten:
+            return
+        self.forgotten.add(source_key)
+        kvstore = default.kvstore
+        keys = kvstore.thumbnail_keys(source_key)
+        if not keys and kvstore.get_by_key(source_key) is None:
+            return
+        for key in keys:
+            thumbnail = kvstore.get_by_key(key)
+            if thumbnail is not None:
+                self._delete_thumbnail(thumbnail)
+        self.stats[RECORDS] += 1
+        if not self.dry_run:
+            kvstore.forget_thumbnails(source_key, keys)
+            kvstore.forget(source_key)
+
+    def collect_sources(self):
+        """Проход 1: картинки без поста."""
+        directory = Post._meta.get_field('image').upload_to
+        if not self.storage.exists(directory):
+            return
+        files = (
+            (name, stat) for name, stat in _files(self.storage, directory)
+            if self._old_enough(stat)
+        )
+        for chunk in _chunks(files, self.batch_size):
+            referenced = _referenced([name for name, _ in chunk])
+            for name, stat in chunk:
+                if name in referenced or not self._still_garbage(name):
+                    continue
+                self.stats[SOURCES] += 1
+                self.freed += stat.st_size
+                self._delete_source_records(
+                    ImageFile(name, default.storage).key
+                )
+                if not self.dry_run:
+                    self.storage.delete(name)
+            self._batch_done(SOURCES)
+
+    def collect_records(self):
+        """Проход 2: записи sorl-thumbnail без поста и устаревшие."""
+        kvstore = default.kvstore
+        last = ''
+        while True:
+            keys = kvstore.source_keys(last, self.batch_size)
+            if not keys:
+                return
+            last = keys[-1]
+            sources = {key: kvstore.get_by_key(key) for key in keys}
+            referenced = _referenced([
+                source.name for source in sources.values() if source
+            ])
+            for key, source in sources.items():
+                if source is None or source.name not in referenced:
+                    self._delete_source_records(key)
+                else:
+                    self._collect_stale(key, source.name)
+            self._batch_done(RECORDS)
+
+    def _collect_stale(self, source_key, name):
+        current = {
+            thumbnail.key for thumbnail in thumbnails.current_thumbnails(name)
+        }
+        stale = [
+            key for key in default.kvstore.thumbnail_keys(source_key)
+            if key not in current
+        ]
+        if not stale:
+            return
+        for key in stale:
+            thumbnail = default.kvstore.get_by_key(key)
+            if thumbnail is not None:
+                self._delete_thumbnail(thumbnail)
+        self.stats[STALE] += len(stale)
+        if not self.dry_run:
+            default.kvstore.forget_thumbnails(source_key, stale)
+
+    def collect_thumbnails(self):
+        """Проход 3: файлы миниатюр без записи в хранилище ключей."""
+        directory = sorl_settings.THUMBNAIL_PREFIX
+        if not default.storage.exists(directory):
+            return
+        files = (
+            (name, stat) for name, stat in _files(default.storage, directory)
+            if self._old_enough(stat)
+        )
+        for chunk in _chunks(files, self.batch_size):
+            keys = {
+                ImageFile(name, default.storage).key: (name, stat)
+                for name, stat in chunk
+            }
+            known = default.kvstore.has_keys(keys)
+            for key, (name, stat) in keys.items():
+                if key in known:
+                    continue
+                self.stats[THUMBNAILS] += 1
+                self.freed += stat.st_size
+                if not self.dry_run:
+                    default.storage.delete(name)
+            self._batch_done(THUMBNAILS)
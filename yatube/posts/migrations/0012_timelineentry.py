@@ -0,0 +1,80 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:27
+
+from itertools import islice
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_timelines(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Follow = apps.get_model('posts', 'Follow')
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+
+    # посты популярных авторов берутся при чтении ленты
+    pulled = [
+        author_id
+        for author_id, total in Follow.objects.order_by().values_list(
+            'author'
+        ).annotate(models.Count('pk'))
+        if total >= settings.TIMELINE_PULL_THRESHOLD
+    ]
+    follows = Follow.objects.exclude(author_id__in=pulled).values_list(
+        'user_id', 'author_id'
+    )
+    entries = (
+        TimelineEntry(
+            user_id=user_id, post_id=post_id, author_id=author_id,
+            created=created
+        )
+        for user_id, author_id in list(follows)
+        for post_id, created in list(
+            Post.objects.filter(author_id=author_id).values_list(
+                'pk', 'created'
+            )
+        )
+    )
+    batch = list(islice(entries, settings.TIMELINE_BATCH_SIZE))
+    while batch:
+        TimelineEntry.objects.bulk_create(batch)
+        batch = list(islice(entries, settings.TIMELINE_BATCH_SIZE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0011_post_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(verbose_name='Дата создания поста')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор поста')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='posts.Post', verbose_name='Пост')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='Читатель')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи ленты',
+                'ordering': ('-created', '-post'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', 'created', 'post'], name='timeline_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', 'author'], name='timeline_user_author_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='timeline_entry_unique'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+from django.db import migrations
+
+# Внешний индекс FTS5 по заголовку и тексту постов и триггеры,
+# которые держат его в согласии с posts_post. Схема зафиксирована
+# здесь; после миграций триггеры восстанавливает posts.search.
+CREATE_INDEX = '''
+CREATE VIRTUAL TABLE posts_post_fts USING fts5(
+    title, text,
+    content='posts_post', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+)
+'''
+CREATE_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS posts_post_fts_insert
+    AFTER INSERT ON posts_post BEGIN
+        INSERT INTO posts_post_fts(rowid, title, text)
+        VALUES (new.id, new.title, new.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS posts_post_fts_delete
+    AFTER DELETE ON posts_post BEGIN
+        INSERT INTO posts_post_fts(posts_post_fts, rowid, title, text)
+        VALUES ('delete', old.id, old.title, old.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS posts_post_fts_update
+    AFTER UPDATE OF title, text ON posts_post BEGIN
+        INSERT INTO posts_post_fts(posts_post_fts, rowid, title, text)
+        VALUES ('delete', old.id, old.title, old.text);
+        INSERT INTO posts_post_fts(rowid, title, text)
+        VALUES (new.id, new.title, new.text);
+    END
+    ''',
+)
+FILL_INDEX = "INSERT INTO posts_post_fts(posts_post_fts) VALUES ('rebuild')"
+DROP = (
+    'DROP TRIGGER IF EXISTS posts_post_fts_insert',
+    'DROP TRIGGER IF EXISTS posts_post_fts_delete',
+    'DROP TRIGGER IF EXISTS posts_post_fts_update',
+    'DROP TABLE IF EXISTS posts_post_fts',
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            [CREATE_INDEX, *CREATE_TRIGGERS, FILL_INDEX],
+            list(DROP)
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.16 on 2026-10-18 18:02
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_post_image_info'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, help_text='добавьте каринку и ваш пост станет ярче', storage=core.storage.ContentAddressedStorage(), upload_to='posts/', verbose_name='Картинка к посту'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_post_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_status',
+            field=models.CharField(choices=[('ready', 'Готова'), ('processing', 'Обрабатывается')], default='ready', editable=False, max_length=10, verbose_name='Состояние картинки'),
+        ),
+    ]
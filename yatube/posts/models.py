@@ -1,7 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.db import models
 
-from core.models import CreatedModel
+from core.models import AtomicSaveModel, CreatedModel, UpdatedModel
+from core.storage import ContentAddressedStorage
 
 User = get_user_model()
 
@@ -22,6 +23,11 @@ class Group(models.Model):
         help_text=('Укажите описание группы - набор тем и вопросов, '
                    'которые будут обсуждаться в группе')
     )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число постов'
+    )
 
     class Meta:
         verbose_name = 'Группа'
@@ -31,8 +37,14 @@ class Group(models.Model):
         return self.title
 
 
-class Post(CreatedModel):
+class Post(CreatedModel, UpdatedModel, AtomicSaveModel):
     LETTERS_LIMIT = 15
+    IMAGE_READY = 'ready'
+    IMAGE_PROCESSING = 'processing'
+    IMAGE_STATUSES = (
+        (IMAGE_READY, 'Готова'),
+        (IMAGE_PROCESSING, 'Обрабатывается'),
+    )
 
     text = models.TextField(
         verbose_name='Текст статьи',
@@ -66,21 +78,71 @@ class Post(CreatedModel):
     )
     image = models.ImageField(
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True,
+        db_index=True,
         verbose_name='Картинка к посту',
         help_text='добавьте каринку и ваш пост станет ярче'
     )
+    image_width = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name='Ширина картинки'
+    )
+    image_height = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        editable=False,
+        verbose_name='Высота картинки'
+    )
+    image_color = models.CharField(
+        max_length=7,
+        blank=True,
+        editable=False,
+        verbose_name='Средний цвет картинки'
+    )
+    image_status = models.CharField(
+        max_length=10,
+        choices=IMAGE_STATUSES,
+        default=IMAGE_READY,
+        editable=False,
+        verbose_name='Состояние картинки'
+    )
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число комментариев'
+    )
 
     class Meta:
-        ordering = ('-created',)
+        ordering = ('-created', '-pk')
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        indexes = (
+            models.Index(
+                fields=('created', 'id'),
+                name='post_created_id_idx'
+            ),
+            models.Index(
+                fields=('author', 'created', 'id'),
+                name='post_author_created_idx'
+            ),
+            models.Index(
+                fields=('group', 'created', 'id'),
+                name='post_group_created_idx'
+            ),
+        )
 
     def __str__(self):
         return self.text[:self.LETTERS_LIMIT]
 
+    @property
+    def image_ready(self):
+        return self.image_status == self.IMAGE_READY
 
-class Comment(CreatedModel):
+
+class Comment(CreatedModel, AtomicSaveModel):
     post = models.ForeignKey(
         Post,
         on_delete=models.CASCADE,
@@ -104,12 +166,18 @@ class Comment(CreatedModel):
         ordering = ('-created',)
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        indexes = (
+            models.Index(
+                fields=('post', 'created'),
+                name='comment_post_created_idx'
+            ),
+        )
 
     def __str__(self):
         return self.text
 
 
-class Follow(models.Model):
+class Follow(AtomicSaveModel):
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -138,3 +206,90 @@ class Follow(models.Model):
                 name='follow_user_author_constraint'
             )
         )
+        indexes = (
+            models.Index(
+                fields=('author', 'user'),
+                name='follow_author_user_idx'
+            ),
+        )
+
+
+class UserCounters(models.Model):
+    """Счетчики пользователя: посты, подписчики и подписки."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name='Пользователь',
+        related_name='counters'
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число постов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        db_index=True,
+        verbose_name='Число подписчиков'
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число подписок'
+    )
+
+    class Meta:
+        verbose_name = 'Счетчики пользователя'
+        verbose_name_plural = 'Счетчики пользователей'
+
+    def __str__(self):
+        return f'{self.user}'
+
+
+class TimelineEntry(models.Model):
+    """Материализованная лента подписок.
+
+    На каждый пост автора заводится запись у каждого его подписчика,
+    поэтому лента читается одним диапазоном по индексу (user, created).
+    created и author копируются из поста, чтобы не обращаться к нему
+    при сортировке и при очистке ленты после отписки.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Читатель',
+        related_name='timeline'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        verbose_name='Пост',
+        related_name='timeline_entries'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Автор поста',
+        related_name='+'
+    )
+    created = models.DateTimeField(verbose_name='Дата создания поста')
+
+    class Meta:
+        ordering = ('-created', '-post_id')
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'post'),
+                name='timeline_entry_unique'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('user', 'created', 'post'),
+                name='timeline_user_created_idx'
+            ),
+            models.Index(
+                fields=('user', 'author'),
+                name='timeline_user_author_idx'
+            ),
+        )
@@ -0,0 +1,77 @@
+"""Фоновая обработка картинок постов.
+
+При settings.IMAGE_PROCESSING_ASYNC (или когда запросу не хватило
+места для нормализации, см. core.uploads) пост с новой картинкой
+сохраняется сразу, с image_status=IMAGE_PROCESSING: картинка только
+проверена по заголовку. Нормализация (core.uploads.normalize),
+размеры и цвет и миниатюры делаются в фоновой задаче process_image,
+а до ее конца шаблоны выводят заглушку.
+"""
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+from PIL import Image
+
+from core import images, invalidation, thumbnails
+from core.uploads import normalize
+
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+
+def _normalized_name(post):
+    # нормализованная картинка сохраняется как новая загрузка
+    field = Post._meta.get_field('image')
+    source = post.image
+    with source.storage.open(source.name) as original, \
+            tempfile.TemporaryFile() as normalized:
+        if not normalize(original, settings.UPLOAD_MAX_SIDE, normalized):
+            return source.name
+        return source.storage.save(
+            field.generate_filename(post, os.path.basename(source.name)),
+            File(normalized)
+        )
+
+
+def process_image(post_id):
+    """Обрабатывает картинку поста post_id, если она еще не готова.
+
+    Если картинку не удалось прочитать, пост остается без нее.
+    Если за время обработки картинку поста сменили, результат
+    отбрасывается - новую картинку обработает своя задача.
+    """
+    # signals импортирует этот модуль
+    from .signals import post_scopes
+
+    post = Post.objects.filter(
+        pk=post_id, image_status=Post.IMAGE_PROCESSING
+    ).first()
+    if post is None:
+        return
+    name = post.image.name
+    try:
+        post.image.name = _normalized_name(post)
+        info = images.describe(post.image)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.exception('Не удалось обработать картинку %s', name)
+        post.image.name, info = '', images.EMPTY
+    updated = Post.objects.filter(
+        pk=post_id, image=name, image_status=Post.IMAGE_PROCESSING
+    ).update(
+        image=post.image.name,
+        image_width=info.width,
+        image_height=info.height,
+        image_color=info.color,
+        image_status=Post.IMAGE_READY,
+        updated=timezone.now()
+    )
+    if not updated:
+        return
+    if post.image:
+        thumbnails.generate(post.image.name)
+    invalidation.bump(*post_scopes(post))
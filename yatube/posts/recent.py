@@ -0,0 +1,130 @@
+"""Кеш последних постов каждого автора.
+
+Для автора хранится список ключей (created, pk) его новейших постов
+по убыванию, не длиннее settings.RECENT_POSTS_LIMIT. Если список
+короче лимита, в нем все посты автора. В ключ списка входит версия
+области автора (core.invalidation): создание, правка и удаление поста
+ее меняют, и список заново читается из базы. Правка списка на месте
+(чтение, изменение, запись) теряла бы посты при одновременной записи,
+а список, собранный по еще старым данным, останется под старой версией.
+"""
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.invalidation import cache_versions, scope
+
+from .models import Post
+
+
+def _cache_keys(author_ids):
+    versions = cache_versions(
+        [scope('author', author_id) for author_id in author_ids]
+    )
+    return {
+        f'recent_posts:{author_id}:{version}': author_id
+        for author_id, version in zip(author_ids, versions)
+    }
+
+
+def _load(author_id):
+    return list(
+        Post.objects.filter(author_id=author_id).order_by(
+            '-created', '-pk'
+        ).values_list('created', 'pk')[:settings.RECENT_POSTS_LIMIT]
+    )
+
+
+def recent_keys(author_ids):
+    """Словарь author_id -> список ключей новейших постов автора."""
+    cache_keys = _cache_keys(author_ids)
+    result = {
+        cache_keys[key]: value
+        for key, value in cache.get_many(cache_keys).items()
+    }
+    missing = {}
+    for key, author_id in cache_keys.items():
+        if author_id not in result:
+            result[author_id] = missing[key] = _load(author_id)
+    if missing:
+        cache.set_many(missing, settings.RECENT_POSTS_CACHE_TIME)
+    return result
+
+
+def is_complete(keys):
+    """True, если в списке ключей все посты автора."""
+    return len(keys) < settings.RECENT_POSTS_LIMIT
+
+
+class RecentFeed:
+    """Лента, собранная из кешей последних постов авторов.
+
+    Списки ключей авторов сливаются (k-way merge), выбранные посты
+    читаются одним запросом по pk. Страницы за горизонтом кешей,
+    где у автора могли остаться не попавшие в кеш посты,
+    отдает лента fallback. Поддерживает тот же протокол, что FollowFeed.
+    """
+
+    path = 'merge'
+
+    def __init__(self, author_ids, fallback):
+        self.keys = recent_keys(list(author_ids))
+        self.fallback = fallback
+        self.horizon = max(
+            (
+                keys[-1] for keys in self.keys.values()
+                if keys and not is_complete(keys)
+            ),
+            default=None
+        )
+
+    def count(self):
+        return self.fallback.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        keys = self._keys_after(None, stop)
+        if keys is None:
+            return self.fallback[index]
+        return self._fetch(keys[start:stop])
+
+    def rows_after(self, cursor, limit):
+        keys = self._keys_after(cursor, limit)
+        if keys is None:
+            return self.fallback.rows_after(cursor, limit)
+        return self._fetch(keys)
+
+    def rows_before(self, cursor, limit):
+        if self.horizon is not None and cursor < self.horizon:
+            return self.fallback.rows_before(cursor, limit)
+        keys = heapq.merge(*(
+            [key for key in reversed(keys) if key > cursor]
+            for keys in self.keys.values()
+        ))
+        return self._fetch(list(islice(keys, limit)))
+
+    def _keys_after(self, cursor, limit):
+        """Ключи старше курсора или None, если они за горизонтом."""
+        keys = heapq.merge(
+            *(
+                [key for key in keys if cursor is None or key < cursor]
+                for keys in self.keys.values()
+            ),
+            reverse=True
+        )
+        keys = list(islice(keys, limit))
+        if self.horizon is None:
+            return keys
+        if len(keys) == limit and keys[-1] >= self.horizon:
+            return keys
+        return None
+
+    def _fetch(self, keys):
+        posts = Post.objects.select_related('author', 'group').in_bulk(
+            [pk for _, pk in keys]
+        )
+        return [posts[pk] for _, pk in keys if pk in posts]
@@ -0,0 +1,210 @@
+"""Полнотекстовый поиск по постам на SQLite FTS5.
+
+posts_post_fts - внешний индекс (content=posts_post) по заголовку
+и тексту поста. Его синхронизируют триггеры на posts_post, поэтому
+индекс обновляется и при bulk_create, update и удалении через SQL.
+Когда миграция пересоздает таблицу posts_post (так SQLite меняет
+схему), триггеры пропадают вместе со старой таблицей - ensure_triggers
+создает их заново после каждой миграции.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from core.paginator import decode_key, encode_key
+
+from .models import Post
+
+FTS_TABLE = 'posts_post_fts'
+TRIGGERS = (
+    f'''
+    CREATE TRIGGER IF NOT EXISTS posts_post_fts_insert
+    AFTER INSERT ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, text)
+        VALUES (new.id, new.title, new.text);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS posts_post_fts_delete
+    AFTER DELETE ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, text)
+        VALUES ('delete', old.id, old.title, old.text);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS posts_post_fts_update
+    AFTER UPDATE OF title, text ON posts_post BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, text)
+        VALUES ('delete', old.id, old.title, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, title, text)
+        VALUES (new.id, new.title, new.text);
+    END
+    ''',
+)
+# заголовок весит вдвое больше текста
+WEIGHTS = (2.0, 1.0)
+SNIPPET_TOKENS = 16
+# управляющие символы не встречаются в тексте и не экранируются,
+# поэтому фрагмент можно сначала экранировать, а потом подсветить
+MARK_START = '\x02'
+MARK_END = '\x03'
+WORD_RE = re.compile(r'\w+')
+# newer -> (ORDER BY, условие за курсором); newer=True - к более
+# релевантным в обратном порядке, как у ?before=
+KEYSET_ORDERS = {
+    False: ('score ASC, id DESC', 'score > %s OR (score = %s AND id < %s)'),
+    True: ('score DESC, id ASC', 'score < %s OR (score = %s AND id > %s)'),
+}
+
+
+def match_expression(query):
+    """Запрос пользователя в синтаксисе MATCH или None.
+
+    Операторы FTS5 из запроса не принимаются: каждое слово ищется
+    как префикс, все слова должны встретиться в посте.
+    """
+    words = WORD_RE.findall(query)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _fts_available(connection):
+    return (
+        connection.vendor == 'sqlite'
+        and FTS_TABLE in connection.introspection.table_names()
+    )
+
+
+def ensure_triggers(using=DEFAULT_DB_ALIAS, **kwargs):
+    """Создает пропавшие триггеры синхронизации индекса."""
+    connection = connections[using]
+    if not _fts_available(connection):
+        return
+    with connection.cursor() as cursor:
+        for sql in TRIGGERS:
+            cursor.execute(sql)
+
+
+def rebuild(using=DEFAULT_DB_ALIAS):
+    """Перестраивает индекс по таблице постов, возвращает число постов."""
+    ensure_triggers(using)
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+        )
+    return Post.objects.using(using).count()
+
+
+def filter_posts(queryset, query):
+    """Посты queryset, найденные по запросу - для поиска в админке."""
+    expression = match_expression(query)
+    if expression is None:
+        return queryset.none()
+    # pk__in=RawSQL(...) оборачивает подзапрос во вторые скобки,
+    # и SQLite читает его как скалярный - берет только первую строку
+    return queryset.extra(
+        where=[
+            f'{Post._meta.db_table}.id IN (SELECT rowid FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s)'
+        ],
+        params=[expression]
+    )
+
+
+def highlight(snippet):
+    """Экранирует фрагмент и выделяет найденные слова тегом mark."""
+    return mark_safe(
+        escape(snippet)
+        .replace(MARK_START, '<mark>')
+        .replace(MARK_END, '</mark>')
+    )
+
+
+class SearchFeed:
+    """Результаты поиска для KeysetPaginator.
+
+    Порядок - по релевантности bm25 (меньше - лучше), при равной
+    релевантности новые посты выше. Курсор - пара (score, pk).
+    """
+
+    def __init__(self, query):
+        self.expression = match_expression(query)
+
+    def count(self):
+        if self.expression is None:
+            return 0
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s',
+                (self.expression,)
+            )
+            return cursor.fetchone()[0]
+
+    def encode_cursor(self, post):
+        return encode_key(repr(post.score), post.pk)
+
+    def decode_cursor(self, token):
+        try:
+            score, pk = decode_key(token)
+            return float(score), int(pk)
+        except (ValueError, TypeError):
+            return None
+
+    def rows_after(self, cursor, limit):
+        return self._rows(cursor, limit, newer=False)
+
+    def rows_before(self, cursor, limit):
+        return self._rows(cursor, limit, newer=True)
+
+    def _rows(self, cursor, limit, newer):
+        if self.expression is None:
+            return []
+        scores = self._scores(cursor, limit, newer)
+        posts = Post.objects.select_related('author', 'group').in_bulk(
+            [pk for pk, _ in scores]
+        )
+        snippets = self._snippets(list(posts))
+        rows = []
+        for pk, score in scores:
+            post = posts.get(pk)
+            if post is not None:
+                post.score = score
+                post.snippet = highlight(snippets.get(pk, ''))
+                rows.append(post)
+        return rows
+
+    def _scores(self, cursor, limit, newer):
+        order, condition = KEYSET_ORDERS[newer]
+        params = [*WEIGHTS, self.expression]
+        where = ''
+        if cursor is not None:
+            score, pk = cursor
+            where = f'WHERE {condition}'
+            params += [score, score, pk]
+        with connections[DEFAULT_DB_ALIAS].cursor() as db_cursor:
+            db_cursor.execute(
+                f'SELECT id, score FROM ('
+                f'SELECT rowid AS id, bm25({FTS_TABLE}, %s, %s) AS score '
+                f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+                f') {where} ORDER BY {order} LIMIT %s',
+                params + [limit]
+            )
+            return db_cursor.fetchall()
+
+    def _snippets(self, pks):
+        # фрагменты строятся только для постов страницы
+        if not pks:
+            return {}
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, snippet({FTS_TABLE}, -1, %s, %s, %s, %s) '
+                f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'AND rowid IN ({", ".join(["%s"] * len(pks))})',
+                [MARK_START, MARK_END, '…', SNIPPET_TOKENS,
+                 self.expression, *pks]
+            )
+            return dict(cursor.fetchall())
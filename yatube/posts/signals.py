@@ -0,0 +1,226 @@
+import threading
+
+from django.conf import settings
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core import images, invalidation, thumbnails, uploads
+from core.invalidation import scope
+from core.tasks import run_async
+
+from . import counters, processing, timeline
+from .models import Comment, Follow, Group, Post, User, UserCounters
+
+
+@receiver(pre_save, sender=Post)
+def remember_old_state(sender, instance, **kwargs):
+    # при смене группы пост должен пропасть и со страницы старой группы,
+    # при смене картинки - нужны новые миниатюры
+    instance._old_group_id = instance._old_image = None
+    if instance.pk is not None:
+        instance._old_group_id, instance._old_image = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group_id', 'image').first() or (None, None)
+
+
+@receiver(pre_save, sender=Post)
+def describe_image(sender, instance, raw, **kwargs):
+    # размеры и цвет считаются один раз, пока загруженный файл под рукой;
+    # при фоновой обработке их посчитает process_image
+    if raw or instance.image.name == instance._old_image:
+        return
+    instance.image_status = Post.IMAGE_READY
+    info = images.EMPTY
+    if not instance.image._committed and (
+        settings.IMAGE_PROCESSING_ASYNC
+        or uploads.deferred(instance.image.file)
+    ):
+        instance.image_status = Post.IMAGE_PROCESSING
+    elif instance.image:
+        info = images.describe(instance.image)
+    (instance.image_width, instance.image_height,
+     instance.image_color) = info
+
+
+def post_scopes(post):
+    yield scope('pages')
+    yield scope('posts')
+    yield scope('author', post.author_id)
+    yield scope('post', post.pk)
+    for group_id in {post.group_id, getattr(post, '_old_group_id', None)}:
+        if group_id is not None:
+            yield scope('group', group_id)
+
+
+# посты, которые удаляются в этом потоке прямо сейчас; их комментарии
+# удаляются каскадом, и счетчик и области поста уходят вместе с ним
+_deleting_posts = threading.local()
+
+
+def _deleting(post_id):
+    return post_id in getattr(_deleting_posts, 'ids', ())
+
+
+def comment_scopes(comment):
+    if _deleting(comment.post_id):
+        return
+    yield scope('pages')
+    yield scope('post', comment.post_id)
+
+
+def group_scopes(group):
+    # название и адрес группы выводятся в карточках постов
+    yield scope('pages')
+    yield scope('posts')
+    yield scope('group', group.pk)
+
+
+def follow_scopes(follow):
+    # число подписчиков выводится на странице автора
+    yield scope('pages')
+    yield scope('follower', follow.user_id)
+
+
+invalidation.register(Post, post_scopes)
+invalidation.register(Comment, comment_scopes)
+invalidation.register(Group, group_scopes)
+invalidation.register(Follow, follow_scopes)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, **kwargs):
+    if created:
+        run_async(timeline.fan_out_post, instance.pk)
+
+
+@receiver(pre_delete, sender=Post)
+def start_post_delete(sender, instance, **kwargs):
+    if not hasattr(_deleting_posts, 'ids'):
+        _deleting_posts.ids = set()
+    _deleting_posts.ids.add(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def finish_post_delete(sender, instance, **kwargs):
+    _deleting_posts.ids.discard(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def prepare_thumbnails(sender, instance, raw, **kwargs):
+    if raw or not instance.image or (
+        instance.image.name == instance._old_image
+    ):
+        return
+    if instance.image_ready:
+        thumbnails.schedule(instance.image.name)
+    else:
+        run_async(processing.process_image, instance.pk)
+
+
+@receiver(thumbnails.thumbnails_ready)
+def show_thumbnails(sender, name, **kwargs):
+    # карточки и фрагменты с заглушкой вместо миниатюры больше не нужны
+    # одну картинку могут делить тысячи постов: области собираются
+    # вместе и сбрасываются одним вызовом
+    posts = Post.objects.filter(image=name)
+    if not posts.update(updated=timezone.now()):
+        return
+    scopes = set()
+    for post in posts.only('pk', 'author_id', 'group_id'):
+        scopes.update(post_scopes(post))
+    invalidation.bump(*scopes)
+
+
+@receiver(post_save, sender=Group)
+def touch_group_posts(sender, instance, created, raw, **kwargs):
+    # название и адрес группы выводятся в карточках постов
+    if not created and not raw:
+        Post.objects.filter(group=instance).update(updated=timezone.now())
+
+
+@receiver(pre_delete, sender=Group)
+def touch_orphaned_posts(sender, instance, **kwargs):
+    # SET_NULL обнуляет группу постов запросом UPDATE без updated
+    Post.objects.filter(group=instance).update(updated=timezone.now())
+
+
+@receiver(post_save, sender=User)
+def touch_author_posts(sender, instance, created, raw, update_fields,
+                       **kwargs):
+    # имя автора выводится в карточках постов; вход в систему
+    # сохраняет только last_login
+    if created or raw or update_fields and not set(update_fields) & {
+        'username', 'first_name', 'last_name'
+    }:
+        return
+    posts = Post.objects.filter(author=instance)
+    if posts.update(updated=timezone.now()):
+        invalidation.bump(
+            scope('pages'), scope('posts'), scope('author', instance.pk),
+            *(scope('group', group_id) for group_id in posts.exclude(
+                group=None
+            ).values_list('group_id', flat=True).distinct())
+        )
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        run_async(timeline.backfill, instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def clean_timeline(sender, instance, **kwargs):
+    run_async(timeline.clean, instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def count_post(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user(instance.author_id, posts_count=1)
+        counters.change_group(instance.group_id, 1)
+    elif instance._old_group_id != instance.group_id:
+        counters.change_group(instance._old_group_id, -1)
+        counters.change_group(instance.group_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, **kwargs):
+    counters.change_user(instance.author_id, posts_count=-1)
+    counters.change_group(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.change_post(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    if not _deleting(instance.post_id):
+        counters.change_post(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user(instance.author_id, followers_count=1)
+        counters.change_user(instance.user_id, following_count=1)
+        timeline.followers_changed(instance.author_id, 1)
+
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    counters.change_user(instance.author_id, followers_count=-1)
+    counters.change_user(instance.user_id, following_count=-1)
+    timeline.followers_changed(instance.author_id, -1)
+
+
+@receiver(post_save, sender=User)
+def create_counters(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        UserCounters.objects.get_or_create(user=instance)
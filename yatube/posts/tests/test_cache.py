@@ -0,0 +1,276 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.cache import cache, caches
+from django.test import SimpleTestCase
+
+from core import coherence, metrics
+from core.cache import LOCK_PREFIX, LRU, MISSING, Entry, TieredCache
+from core.shmcache import SharedMemoryCache
+
+FRAGMENT = 'template.cache.index_page.1'
+
+
+def worker(**options):
+    """Кеш отдельного воркера над общим кешем 'shared'."""
+    return TieredCache('shared', {'OPTIONS': options})
+
+
+class TieredCacheTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.shared = caches['shared']
+
+    def test_local_copy(self):
+        """Проверяем, что значение читается из памяти процесса,
+        а изменение полученного объекта не меняет закешированный"""
+        first = worker()
+        first.set('key', ['value'])
+        self.shared.delete('key')
+        value = first.get('key')
+        self.assertEqual(value, ['value'])
+        value.append('changed')
+        self.assertEqual(first.get('key'), ['value'])
+        first.delete('key')
+        self.assertIsNone(worker().get('key'))
+
+    def test_local_copy_expires(self):
+        """Проверяем, что локальная копия живет не дольше LOCAL_TIMEOUT"""
+        first = worker(LOCAL_TIMEOUT=0.05)
+        first.set('key', 'old')
+        self.shared.set('key', 'new')
+        self.assertEqual(first.get('key'), 'old')
+        time.sleep(0.1)
+        self.assertEqual(first.get('key'), 'new')
+
+    def test_lru_bounded(self):
+        """Проверяем, что LRU вытесняет давно не читанные записи"""
+        lru = LRU(2)
+        lru.set('a', 1, 60)
+        lru.set('b', 2, 60)
+        lru.get('a')
+        lru.set('c', 3, 60)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIs(lru.get('b'), MISSING)
+        self.assertEqual(lru.get('c'), 3)
+
+    def test_stale_while_revalidate(self):
+        """Проверяем, что устаревший фрагмент пересчитывает один
+        воркер, а остальные до записи получают старое значение"""
+        self.shared.set(FRAGMENT, Entry('old', time.time() - 1), 60)
+        first, second = worker(), worker()
+        self.assertIsNone(first.get(FRAGMENT))
+        self.assertEqual(second.get(FRAGMENT), 'old')
+        self.assertEqual(second.get_many([FRAGMENT]), {})
+        first.set(FRAGMENT, 'new', 60)
+        self.assertEqual(second.get(FRAGMENT), 'new')
+        self.assertIsInstance(self.shared.get(FRAGMENT), Entry)
+
+    def test_miss_not_blocked(self):
+        """Проверяем, что промах не ждет блокировку, оставленную
+        упавшим воркером"""
+        self.shared.add(LOCK_PREFIX + FRAGMENT, True, 60)
+        started = time.monotonic()
+        self.assertEqual(worker().get(FRAGMENT, 'default'), 'default')
+        self.assertLess(time.monotonic() - started, 0.1)
+
+    def test_get_or_set_single_flight(self):
+        """Проверяем, что get_or_set считает значение один раз"""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return 'value'
+
+        for _ in range(3):
+            self.assertEqual(worker().get_or_set('key', compute, 60), 'value')
+        self.assertEqual(len(calls), 1)
+
+    def test_plain_keys(self):
+        """Проверяем, что обычные ключи не блокируются и не хранятся
+        дольше срока, а счетчики работают через общий кеш"""
+        first, second = worker(), worker()
+        self.assertIsNone(first.get('plain'))
+        self.assertIsNone(second.get('plain'))
+        first.set('plain', 'value', 60)
+        self.assertEqual(self.shared.get('plain'), 'value')
+        self.assertTrue(first.add('counter', 1, None))
+        second.get('counter')
+        first.incr('counter', 2)
+        self.assertEqual(first.get('counter'), 3)
+        self.assertEqual(first.get_many(['plain', 'counter', 'none']), {
+            'plain': 'value', 'counter': 3
+        })
+
+
+class CoherenceTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def setUp(self):
+        self.path = os.path.join(self.directory, self.id())
+        self.worker = worker(COHERENCE_FILE=self.path, LOCAL_TIMEOUT=60)
+        self.worker.clear()
+        self.shared = caches['shared']
+        # журнал другого процесса узла
+        self.other = coherence.Journal(self.path, 4096)
+
+    def test_changed_key_dropped(self):
+        """Проверяем, что ключ, измененный другим процессом, сразу
+        перечитывается из общего кеша, а остальные - нет"""
+        self.worker.set('key', 'old')
+        self.worker.set('other', 'old')
+        self.shared.set('key', 'new')
+        self.shared.set('other', 'new')
+        self.assertEqual(self.worker.get('key'), 'old')
+        self.other.publish([self.worker.make_key('key')])
+        self.assertEqual(self.worker.get('key'), 'new')
+        self.assertEqual(self.worker.get('other'), 'old')
+
+    def test_own_changes_kept(self):
+        """Проверяем, что свои записи не выбрасывают локальную копию,
+        а чужие журнал видит"""
+        self.other.changes()
+        self.worker.set('key', 'value')
+        self.shared.delete('key')
+        self.assertEqual(self.worker.get('key'), 'value')
+        self.assertEqual(
+            self.other.changes(),
+            {coherence.key_hash(self.worker.make_key('key'))}
+        )
+
+    def test_metrics_not_published(self):
+        """Проверяем, что счетчики не копируются в LRU и не пишутся
+        в журнал"""
+        self.other.changes()
+        metrics.incr('test.counter')
+        self.worker.incr(metrics.PREFIX + 'test.counter')
+        self.assertEqual(self.other.changes(), ())
+        self.shared.incr(metrics.PREFIX + 'test.counter')
+        self.assertEqual(self.worker.get(metrics.PREFIX + 'test.counter'), 3)
+        self.shared.incr(metrics.PREFIX + 'test.counter')
+        self.assertEqual(self.worker.get(metrics.PREFIX + 'test.counter'), 4)
+
+    def test_clear_and_lag(self):
+        """Проверяем, что очистка и отставание больше кольца очищают
+        локальный кеш целиком"""
+        self.worker.set('key', 'old')
+        self.shared.set('key', 'new')
+        self.other.publish_clear()
+        self.assertEqual(self.worker.get('key'), 'new')
+        path = os.path.join(self.directory, 'small')
+        writer, reader = coherence.Journal(path, 2), coherence.Journal(path, 2)
+        writer.publish(['a', 'b'])
+        self.assertEqual(len(reader.changes()), 2)
+        writer.publish(['a', 'b', 'c'])
+        self.assertIsNone(reader.changes())
+        self.assertEqual(reader.changes(), ())
+
+
+class SharedMemoryCacheTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def make_cache(self, **options):
+        options.setdefault('SLOTS', 64)
+        options.setdefault('SLOT_SIZE', 1024)
+        return SharedMemoryCache(
+            os.path.join(self.directory, self.id()), {'OPTIONS': options}
+        )
+
+    def test_operations(self):
+        """Проверяем set, get, add, incr, delete и clear"""
+        shm = self.make_cache()
+        shm.set('key', {'value': [1, 2]})
+        self.assertEqual(shm.get('key'), {'value': [1, 2]})
+        self.assertFalse(shm.add('key', 'other'))
+        self.assertTrue(shm.add('counter', 1))
+        self.assertEqual(shm.incr('counter', 5), 6)
+        self.assertEqual(shm.decr('counter'), 5)
+        with self.assertRaises(ValueError):
+            shm.incr('none')
+        self.assertEqual(shm.get_many(['key', 'counter', 'none']), {
+            'key': {'value': [1, 2]}, 'counter': 5
+        })
+        shm.delete('key')
+        self.assertIsNone(shm.get('key'))
+        shm.clear()
+        self.assertFalse(shm.has_key('counter'))
+        shm.set('key', 'after clear')
+        self.assertEqual(shm.get('key'), 'after clear')
+
+    def test_incr_errors(self):
+        """Проверяем, что incr значения None и значения, которое после
+        увеличения не помещается в слот, вызывает ValueError"""
+        shm = self.make_cache()
+        shm.set('none', None)
+        with self.assertRaises(ValueError):
+            shm.incr('none')
+        self.assertTrue(shm.has_key('none'))
+        shm.set('counter', 1)
+        with self.assertRaises(ValueError):
+            shm.incr('counter', int.from_bytes(os.urandom(2048), 'big'))
+        self.assertFalse(shm.has_key('counter'))
+
+    def test_expiry(self):
+        """Проверяем срок хранения и touch"""
+        shm = self.make_cache()
+        shm.set('expired', 'value', 0)
+        self.assertIsNone(shm.get('expired'))
+        shm.set('key', 'value', 0.05)
+        self.assertTrue(shm.touch('key', None))
+        time.sleep(0.1)
+        self.assertEqual(shm.get('key'), 'value')
+
+    def test_clock_eviction(self):
+        """Проверяем, что из полной корзины вытесняется ключ, который
+        не читали"""
+        shm = self.make_cache(SLOTS=4, WAYS=4)
+        for number in range(4):
+            shm.set(number, number)
+        for number in (0, 1, 3):
+            shm.get(number)
+        shm.set('new', 'value')
+        self.assertIsNone(shm.get(2))
+        self.assertEqual(
+            [shm.get(number) for number in (0, 1, 3, 'new')],
+            [0, 1, 3, 'value']
+        )
+
+    def test_large_values(self):
+        """Проверяем, что большое значение сжимается, а не влезающее
+        и сжатым не кешируется"""
+        shm = self.make_cache()
+        shm.set('page', 'абв' * 1000)
+        self.assertEqual(shm.get('page'), 'абв' * 1000)
+        shm.set('page', os.urandom(4096))
+        self.assertIsNone(shm.get('page'))
+
+    def test_shared_between_processes(self):
+        """Проверяем, что записанное другим процессом видно сразу"""
+        shm = self.make_cache()
+        shm.set('key', 'parent')
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.make_cache().set('key', 'child')
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(shm.get('key'), 'child')
@@ -0,0 +1,92 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.test.signals import template_rendered
+from django.urls import reverse
+
+from core.cards import render_cards
+from posts.models import Group, Post
+
+User = get_user_model()
+
+CARD = 'posts/includes/post.html'
+
+
+class PostCardsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+        Post.objects.bulk_create([
+            Post(author=cls.user, text=f'Пост {number}', group=cls.group)
+            for number in range(3)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.rendered = []
+        template_rendered.connect(self.count_card)
+        self.addCleanup(template_rendered.disconnect, self.count_card)
+
+    def count_card(self, sender, template, **kwargs):
+        if template.name == CARD:
+            self.rendered.append(kwargs['context']['post'].pk)
+
+    def cards(self, **variant):
+        posts = Post.objects.select_related('author', 'group')
+        return render_cards(posts, CARD, 'post', **variant)
+
+    def test_cards_cached(self):
+        """Проверяем, что карточки отрисовываются один раз
+        и отдаются по порядку"""
+        first = self.cards()
+        self.assertEqual(len(self.rendered), 3)
+        self.assertEqual(self.cards(), first)
+        self.assertEqual(len(self.rendered), 3)
+        self.assertIn('Пост 2', first[0])
+        self.assertIn('Пост 0', first[2])
+
+    def test_variant(self):
+        """Проверяем, что вариант шаблона кешируется отдельно"""
+        group_link = reverse('posts:group_list', args=[self.group.slug])
+        self.assertIn(group_link, self.cards()[0])
+        self.assertNotIn(group_link, self.cards(group_posts_page=True)[0])
+
+    def test_changes_rerender_card(self):
+        """Проверяем, что правка поста, группы и автора и удаление
+        группы обновляют только затронутые карточки"""
+        self.cards()
+        post = Post.objects.filter(text='Пост 1').get()
+        post.text = 'Исправленный пост'
+        post.save()
+        self.rendered.clear()
+        self.assertIn('Исправленный пост', self.cards()[1])
+        self.assertEqual(self.rendered, [post.pk])
+        self.group.title = 'Новое название'
+        self.group.save()
+        self.assertIn('Новое название', self.cards()[0])
+        self.group.delete()
+        self.assertNotIn('Новое название', self.cards()[0])
+        self.user.first_name = 'Лев'
+        self.user.last_name = 'Толстой'
+        self.user.save()
+        self.assertIn('Лев Толстой', self.cards()[2])
+
+    def test_login_keeps_cards(self):
+        """Проверяем, что вход автора в систему не сбрасывает карточки"""
+        self.cards()
+        self.rendered.clear()
+        Client().force_login(self.user)
+        self.cards()
+        self.assertEqual(self.rendered, [])
+
+    def test_feed_renders_new_card_only(self):
+        """Проверяем, что после нового поста лента отрисовывает
+        только его карточку"""
+        url = reverse('posts:index')
+        self.guest_client.get(url)
+        self.rendered.clear()
+        post = Post.objects.create(author=self.user, text='Новый пост')
+        self.assertContains(self.guest_client.get(url), 'Новый пост')
+        self.assertEqual(self.rendered, [post.pk])
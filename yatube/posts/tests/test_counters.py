@@ -0,0 +1,131 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.counters import user_counters
+from posts.models import Comment, Follow, Group, Post, UserCounters
+
+User = get_user_model()
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.new_group = Group.objects.create(
+            title='Новая тестовая группа',
+            slug='new-test-slug',
+            description='Новое тестовое описание',
+        )
+
+    def counters(self, user):
+        return UserCounters.objects.get(user=user)
+
+    def test_post_counters(self):
+        """Проверяем счетчики постов автора и группы"""
+        post = Post.objects.create(
+            author=self.author, text='Текст', group=self.group
+        )
+        self.assertEqual(self.counters(self.author).posts_count, 1)
+        self.assertEqual(
+            Group.objects.get(pk=self.group.pk).posts_count, 1
+        )
+        post.group = self.new_group
+        post.save()
+        self.assertEqual(
+            Group.objects.get(pk=self.group.pk).posts_count, 0
+        )
+        self.assertEqual(
+            Group.objects.get(pk=self.new_group.pk).posts_count, 1
+        )
+        post.delete()
+        self.assertEqual(self.counters(self.author).posts_count, 0)
+        self.assertEqual(
+            Group.objects.get(pk=self.new_group.pk).posts_count, 0
+        )
+
+    def test_comment_counter(self):
+        """Проверяем счетчик комментариев поста"""
+        post = Post.objects.create(author=self.author, text='Текст')
+        comment = Comment.objects.create(
+            author=self.reader, post=post, text='Комментарий'
+        )
+        self.assertEqual(Post.objects.get(pk=post.pk).comments_count, 1)
+        comment.delete()
+        self.assertEqual(Post.objects.get(pk=post.pk).comments_count, 0)
+
+    def test_post_delete_skips_comment_counter(self):
+        """Проверяем, что удаление поста не пересчитывает счетчик
+        по каждому удаляемому с ним комментарию"""
+        def delete_post(comments):
+            post = Post.objects.create(author=self.author, text='Текст')
+            Comment.objects.bulk_create(
+                Comment(author=self.reader, post=post, text='Комментарий')
+                for _ in range(comments)
+            )
+            with CaptureQueriesContext(connection) as queries:
+                post.delete()
+            return len(queries)
+
+        self.assertEqual(delete_post(10), delete_post(1))
+        self.assertFalse(Comment.objects.exists())
+
+    def test_follow_counters(self):
+        """Проверяем счетчики подписчиков и подписок"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.counters(self.author).followers_count, 1)
+        self.assertEqual(self.counters(self.reader).following_count, 1)
+        Follow.objects.filter(user=self.reader).delete()
+        self.assertEqual(self.counters(self.author).followers_count, 0)
+        self.assertEqual(self.counters(self.reader).following_count, 0)
+
+    def test_missing_counters_are_computed(self):
+        """Проверяем, что отсутствующие счетчики считаются при чтении"""
+        Post.objects.create(author=self.author, text='Текст')
+        UserCounters.objects.filter(user=self.author).delete()
+        author = User.objects.get(pk=self.author.pk)
+        self.assertEqual(user_counters(author).posts_count, 1)
+
+    @override_settings(POSTS_ON_PAGE=2)
+    def test_drifted_counters_fixed_by_pages(self):
+        """Проверяем, что страницы с отставшими после bulk_create
+        счетчиками выводят все посты и исправляют счетчики"""
+        cache.clear()
+        Post.objects.bulk_create([
+            Post(author=self.author, text=f'Пост {i}', group=self.group)
+            for i in range(3)
+        ])
+        urls = (
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:group_list', args=[self.group.slug]),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                page = self.client.get(url + '?page=2').context['page_obj']
+                self.assertEqual((page.number, len(page)), (2, 1))
+        self.assertEqual(self.counters(self.author).posts_count, 3)
+        self.assertEqual(Group.objects.get(pk=self.group.pk).posts_count, 3)
+
+    def test_reconcile_command(self):
+        """Проверяем, что команда reconcile_counters исправляет счетчики"""
+        Post.objects.bulk_create(
+            Post(author=self.author, text=f'Текст {i}', group=self.group)
+            for i in range(3)
+        )
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(self.counters(self.author).posts_count, 3)
+        self.assertEqual(
+            Group.objects.get(pk=self.group.pk).posts_count, 3
+        )
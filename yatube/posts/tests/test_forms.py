@@ -1,12 +1,16 @@
 import shutil
 import tempfile
+from io import BytesIO
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
+from core import uploads
+from posts import processing
 from posts.models import Post, Group, Comment
 
 User = get_user_model()
@@ -120,10 +124,11 @@ class PostCreateFormTests(TestCase):
         post = Post.objects.first()
         self.match_model_fields(post, data)
 
-        # Отдельно проверяем, что записалась картинка
-        self.assertEqual(
-            post.image,
-            f'posts/{uploaded_img.name}',
+        # Отдельно проверяем, что записалась картинка - под хешем
+        # содержимого с исходным расширением
+        self.assertRegex(
+            post.image.name,
+            r'^posts/[0-9a-f]{2}/[0-9a-f]{64}\.gif$',
             'Ожидалось, что картинка запишется в базу'
         )
 
@@ -204,3 +209,102 @@ class PostCreateFormTests(TestCase):
             f'Ожидалось что комментариев будет {EXPECTED_COMMENTS_COUNT}, '
             f'а получили {comments_count}'
         )
+
+
+def make_image(size, image_format='PNG', orientation=None):
+    buffer = BytesIO()
+    options = {}
+    if orientation is not None:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        exif[0x010F] = 'Камера'
+        options['exif'] = exif.tobytes()
+    Image.new('RGB', size, 'teal').save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class UploadLimitsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='uploader')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def upload(self, content, name='image.png'):
+        return self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Пост с большой картинкой',
+                'image': SimpleUploadedFile(name, content, 'image/png'),
+            }
+        )
+
+    @override_settings(UPLOAD_MAX_SIZE=1024)
+    def test_oversized_file_rejected(self):
+        """Проверяем, что слишком большой файл отклоняется
+        еще при приеме"""
+        content = make_image((10, 10)) + b'\0' * 4096
+        response = self.upload(content)
+        self.assertFormError(
+            response, 'form', 'image', 'Файл больше 0 МБ'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(UPLOAD_MAX_PIXELS=10 ** 4)
+    def test_too_many_pixels_rejected(self):
+        """Проверяем, что картинка с большим числом пикселей
+        отклоняется по заголовку"""
+        response = self.upload(make_image((200, 100)))
+        self.assertEqual(
+            response.context['form'].errors['image'][0],
+            'Картинка больше 0 мегапикселей'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(UPLOAD_MAX_SIDE=100)
+    def test_large_image_downscaled(self):
+        """Проверяем, что картинка с длинной стороной уменьшается
+        и пережимается в том же формате"""
+        self.upload(make_image((300, 150), 'JPEG'), name='image.jpg')
+        post = Post.objects.get()
+        self.assertEqual((post.image_width, post.image_height), (100, 50))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (100, 50))
+
+    def test_exif_stripped_and_applied(self):
+        """Проверяем, что картинка поворачивается по EXIF, а сами
+        метаданные не сохраняются"""
+        self.upload(make_image((30, 20), 'JPEG', 6), name='image.jpg')
+        post = Post.objects.get()
+        self.assertEqual((post.image_width, post.image_height), (20, 30))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (20, 30))
+            self.assertNotIn('exif', image.info)
+
+    @override_settings(TASKS_ALWAYS_EAGER=False)
+    def test_busy_resize_deferred(self):
+        """Проверяем, что без свободного места запрос не ждет,
+        а картинку нормализует фоновая задача"""
+        slots = uploads.get_resize_slots()
+        for _ in range(settings.UPLOAD_RESIZE_WORKERS):
+            slots.acquire()
+        try:
+            self.upload(make_image((30, 20), 'JPEG', 6), name='image.jpg')
+        finally:
+            for _ in range(settings.UPLOAD_RESIZE_WORKERS):
+                slots.release()
+        post = Post.objects.get()
+        self.assertFalse(post.image_ready)
+        processing.process_image(post.pk)
+        post.refresh_from_db()
+        self.assertTrue(post.image_ready)
+        self.assertEqual((post.image_width, post.image_height), (20, 30))
@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from core import thumbnails
+from posts.media_gc import Collector
+from posts.models import Post
+
+User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+TEST_IMAGE = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+def image(number):
+    return SimpleUploadedFile(
+        f'image{number}.gif',
+        TEST_IMAGE.replace(b'\xFF\xFF\xFF', bytes((255, 255, number))),
+        'image/gif'
+    )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaGarbageCollectorTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        self.kept = Post.objects.create(
+            author=self.user, text='Остается', image=image(1)
+        )
+        self.edited = Post.objects.create(
+            author=self.user, text='Сменил картинку', image=image(2)
+        )
+        self.replaced_name = self.edited.image.name
+        self.edited.image = image(3)
+        self.edited.save()
+        deleted = Post.objects.create(
+            author=self.user, text='Удален', image=image(4)
+        )
+        self.deleted_name = deleted.image.name
+        Post.objects.filter(pk=deleted.pk).delete()
+        # миниатюра, которую не дает ни один набор
+        self.stale = thumbnails.backend.get_thumbnail(
+            ImageFile(self.kept.image.name, default.storage), '10x10'
+        )
+        self.stray = default.storage.save(
+            'cache/00/00/stray.jpg', ContentFile(b'stray')
+        )
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command(
+            'collect_media_garbage', '--min-age=0', '--sleep=0',
+            '--batch-size=2', *args, stdout=out
+        )
+        return out.getvalue()
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(TEMP_MEDIA_ROOT, name))
+
+    def test_dry_run_deletes_nothing(self):
+        """Проверяем, что при --dry-run мусор находится, но остается"""
+        output = self.collect('--dry-run')
+        self.assertIn(
+            'Будет удалено: картинок 2, записей картинок 2, '
+            'устаревших миниатюр 1, миниатюр без записей 1',
+            output
+        )
+        self.assertTrue(self.exists(self.replaced_name))
+        self.assertTrue(self.exists(self.stale.name))
+        self.assertTrue(self.exists(self.stray))
+
+    def test_orphans_removed_and_used_media_kept(self):
+        """Проверяем, что удаляются картинки без постов с миниатюрами,
+        устаревшие миниатюры и файлы без записей, а нужное остается"""
+        orphan_thumbnails = [
+            thumbnail.name
+            for thumbnail in thumbnails.current_thumbnails(self.deleted_name)
+        ]
+        self.assertTrue(all(map(self.exists, orphan_thumbnails)))
+        output = self.collect()
+        self.assertIn('Удалено: картинок 2,', output)
+        for name in (self.replaced_name, self.deleted_name, self.stale.name,
+                     self.stray, *orphan_thumbnails):
+            with self.subTest(name=name):
+                self.assertFalse(self.exists(name))
+        cache.clear()
+        for post in (self.kept, self.edited):
+            self.assertTrue(self.exists(post.image.name))
+            image_ = thumbnails.get_cached(post.image, 'post_card')
+            self.assertTrue(image_.complete)
+            self.assertTrue(self.exists(image_.fallback.name))
+        self.assertIn(
+            'Удалено: картинок 0, записей картинок 0, '
+            'устаревших миниатюр 0, миниатюр без записей 0',
+            self.collect()
+        )
+
+    def test_file_reused_during_collection_kept(self):
+        """Проверяем, что картинка, на которую сослались заново во время
+        прохода, не удаляется"""
+        test = self
+        garbage = {self.replaced_name: 2, self.deleted_name: 4}
+        first, second = sorted(garbage)
+        for name in garbage:
+            os.utime(os.path.join(TEMP_MEDIA_ROOT, name), (0, 0))
+
+        class RacingCollector(Collector):
+            def _delete_source_records(self, source_key):
+                if not self.forgotten:
+                    # параллельный запрос загружает ту же картинку
+                    test.reused = Post.objects.create(
+                        author=test.user, text='Снова',
+                        image=image(garbage[second])
+                    )
+                super()._delete_source_records(source_key)
+
+        RacingCollector(min_age=60).collect_sources()
+        self.assertEqual(self.reused.image.name, second)
+        self.assertTrue(self.exists(second))
+        self.assertFalse(self.exists(first))
+
+    def test_fresh_files_kept(self):
+        """Проверяем, что свежие файлы не трогаются"""
+        out = StringIO()
+        call_command('collect_media_garbage', '--sleep=0', stdout=out)
+        self.assertIn('картинок 0,', out.getvalue())
+        self.assertTrue(self.exists(self.replaced_name))
@@ -0,0 +1,158 @@
+from http import HTTPStatus
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, RequestFactory, TestCase
+from django.urls import reverse
+
+from core import holes, pagecache
+from posts.models import Comment, Group, Post
+
+User = get_user_model()
+
+
+class AnonymousPageCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+        cls.post = Post.objects.create(
+            author=cls.user, text='Первый пост', group=cls.group
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_repeat_page_from_cache(self):
+        """Проверяем, что повторная анонимная страница отдается из кеша
+        без запросов к базе и с валидаторами"""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.user.username]),
+            reverse('posts:post_detail', args=[self.post.pk]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                first = self.guest_client.get(url)
+                with self.assertNumQueries(0):
+                    second = self.guest_client.get(url)
+                self.assertEqual(second.content, first.content)
+                self.assertEqual(second['ETag'], first['ETag'])
+                self.assertIn('Last-Modified', second)
+                self.assertIn('Cookie', second['Vary'])
+
+    def test_not_modified(self):
+        """Проверяем, что клиент с актуальными валидаторами получает 304"""
+        url = reverse('posts:index')
+        response = self.guest_client.get(url)
+        with self.assertNumQueries(0):
+            by_etag = self.guest_client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag']
+            )
+            by_date = self.guest_client.get(
+                url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+            )
+        self.assertEqual(by_etag.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(by_date.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(by_etag['ETag'], response['ETag'])
+
+    def test_changes_reset_pages(self):
+        """Проверяем, что новый пост и комментарий меняют страницы"""
+        index = reverse('posts:index')
+        detail = reverse('posts:post_detail', args=[self.post.pk])
+        old_index = self.guest_client.get(index)
+        old_detail = self.guest_client.get(detail)
+        Post.objects.create(author=self.user, text='Второй пост')
+        response = self.guest_client.get(
+            index, HTTP_IF_NONE_MATCH=old_index['ETag']
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'Второй пост')
+        Comment.objects.create(
+            author=self.user, post=self.post, text='Новый комментарий'
+        )
+        response = self.guest_client.get(detail)
+        self.assertNotEqual(response['ETag'], old_detail['ETag'])
+        self.assertContains(response, 'Новый комментарий')
+
+    def test_stale_page_while_rebuilding(self):
+        """Проверяем, что, пока страницу пересобирает другой воркер,
+        отдается прежняя, а потом - новая"""
+        url = reverse('posts:index')
+        old = self.guest_client.get(url)
+        Post.objects.create(author=self.user, text='Второй пост')
+        lock = pagecache.LOCK_PREFIX + pagecache._cache_key(
+            RequestFactory().get(url)
+        )
+        cache.add(lock, True)
+        with self.assertNumQueries(0):
+            stale = self.guest_client.get(url)
+        self.assertEqual(stale.content, old.content)
+        self.assertEqual(stale['ETag'], old['ETag'])
+        cache.delete(lock)
+        self.assertContains(self.guest_client.get(url), 'Второй пост')
+
+    def test_authorized_page_shared(self):
+        """Проверяем, что пользователь получает общую страницу из кеша
+        с личными кусками, а аноним - без них"""
+        url = reverse('posts:index')
+        self.guest_client.get(url)
+        with self.assertNumQueries(2):
+            # сессия и пользователь
+            response = self.authorized_client.get(url)
+        self.assertNotIn('ETag', response)
+        self.assertContains(response, 'Новая запись')
+        self.assertContains(response, 'Избранные авторы')
+        self.assertContains(response, f'<strong>{self.user.username}</strong>')
+        response = self.guest_client.get(url)
+        self.assertNotContains(response, 'Новая запись')
+        self.assertNotContains(response, '<!--hole')
+
+    def test_personal_holes(self):
+        """Проверяем кнопку подписки, ссылку правки и форму комментария
+        на общих страницах"""
+        reader = User.objects.create_user(username='reader')
+        reader_client = Client()
+        reader_client.force_login(reader)
+        profile = reverse('posts:profile', args=[self.user.username])
+        edit = reverse('posts:post_edit', args=[self.post.pk])
+        follow = reverse('posts:profile_follow', args=[self.user.username])
+        response = self.authorized_client.get(profile)
+        self.assertContains(response, edit)
+        self.assertNotContains(response, follow)
+        response = reader_client.get(profile)
+        self.assertNotContains(response, edit)
+        self.assertContains(response, follow)
+        self.assertNotContains(self.guest_client.get(profile), follow)
+        detail = reverse('posts:post_detail', args=[self.post.pk])
+        comment = reverse('posts:add_comment', args=[self.post.pk])
+        self.assertNotContains(self.guest_client.get(detail), comment)
+        response = reader_client.get(detail)
+        self.assertContains(response, comment)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+    def test_marker_escaped(self):
+        """Проверяем, что параметр не может закрыть или подделать метку"""
+        marker = holes.marker('edit_link', {
+            'post_id': '--><!--hole header_auth {}-->', 'author_id': 1
+        })
+        self.assertEqual(len(holes.MARKER_RE.findall(marker)), 1)
+        self.assertEqual(marker.count('<'), 1)
+
+    def test_missing_page_not_cached(self):
+        """Проверяем, что ответ 404 не кешируется"""
+        url = reverse('posts:post_detail', args=[self.post.pk + 1])
+        self.assertEqual(
+            self.guest_client.get(url).status_code, HTTPStatus.NOT_FOUND
+        )
+        # без сигналов: версия страниц не меняется
+        Post.objects.bulk_create([Post(
+            pk=self.post.pk + 1, author=self.user, text='Новый пост'
+        )])
+        self.assertContains(self.guest_client.get(url), 'Новый пост')
@@ -0,0 +1,91 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from core.explain import PlanChecker
+from core.paginator import encode_cursor
+from posts.management.commands.check_query_plans import ALLOWED_SCANS
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+@override_settings(TIMELINE_PULL_THRESHOLD=2)
+class QueryPlansTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader')
+        cls.fan = User.objects.create_user(username='fan')
+        cls.author = User.objects.create_user(username='author')
+        cls.star = User.objects.create_user(username='star')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        Follow.objects.create(user=cls.reader, author=cls.star)
+        Follow.objects.create(user=cls.fan, author=cls.star)
+        for i in range(3):
+            for author in (cls.author, cls.star):
+                cls.post = Post.objects.create(
+                    author=author, text=f'Пост {i}', group=cls.group
+                )
+        Comment.objects.create(
+            author=cls.reader, post=cls.post, text='Комментарий'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_feed_queries_use_indexes(self):
+        """Проверяем, что запросы лент не проходят таблицы целиком
+        и не сортируют во временном B-дереве"""
+        cursor = f'?after={encode_cursor(self.post)}'
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'test-slug'}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+            reverse('posts:post_comments', kwargs={'post_id': self.post.pk}),
+            reverse('posts:follow_index'),
+        )
+        for url in urls:
+            for query_string in ('', cursor):
+                with self.subTest(url=url + query_string):
+                    cache.clear()
+                    with PlanChecker(allowed=ALLOWED_SCANS) as checker:
+                        self.client.get(url + query_string)
+                    self.assertTrue(checker.plans)
+                    self.assertEqual(checker.problems, [])
+
+    def test_checker_reports_full_scan(self):
+        """Проверяем, что запрос без индекса попадает в проблемы"""
+        with PlanChecker() as checker:
+            list(Post.objects.filter(text='Пост 0'))
+        self.assertEqual(len(checker.problems), 1)
+
+    def test_checker_reports_bounded_scans(self):
+        """Проверяем, что LIMIT с фильтром не по индексу и COUNT(*)
+        по всей таблице тоже попадают в проблемы, а проход по индексу
+        в порядке ORDER BY - нет"""
+        with PlanChecker() as checker:
+            list(Post.objects.filter(text='Пост 0')[:10])
+            Post.objects.count()
+        self.assertEqual(len(checker.problems), 2)
+        with PlanChecker() as checker:
+            list(Post.objects.all()[:10])
+        self.assertTrue(checker.plans)
+        self.assertEqual(checker.problems, [])
+
+    def test_check_query_plans_command(self):
+        """Проверяем, что команда check_query_plans проходит"""
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('Все запросы используют индексы', out.getvalue())
@@ -0,0 +1,101 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from core.paginator import encode_cursor
+from posts import recent
+from posts.models import Follow, Post
+
+User = get_user_model()
+
+
+@override_settings(RECENT_POSTS_LIMIT=3, RECENT_POSTS_FEEDS=True)
+class RecentPostsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader')
+        cls.first = User.objects.create_user(username='first')
+        cls.second = User.objects.create_user(username='second')
+        Follow.objects.create(user=cls.reader, author=cls.first)
+        Follow.objects.create(user=cls.reader, author=cls.second)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.reader)
+        self.posts = [
+            Post.objects.create(author=author, text=f'Пост {i}')
+            for i, author in enumerate((self.first, self.second) * 3)
+        ]
+
+    def keys(self, author):
+        return recent.recent_keys([author.pk])[author.pk]
+
+    def test_ring_keeps_newest_posts(self):
+        """Проверяем, что в кеше остаются только новейшие посты"""
+        self.keys(self.first)
+        post = Post.objects.create(author=self.first, text='Новый пост')
+        self.assertEqual(
+            [pk for _, pk in self.keys(self.first)],
+            [post.pk, self.posts[4].pk, self.posts[2].pk]
+        )
+
+    def test_deleted_post_leaves_ring(self):
+        """Проверяем, что удаленный пост пропадает из кеша"""
+        self.keys(self.first)
+        Post.objects.filter(pk=self.posts[4].pk).delete()
+        self.assertEqual(
+            [pk for _, pk in self.keys(self.first)],
+            [self.posts[2].pk, self.posts[0].pk]
+        )
+
+    def test_late_ring_write_ignored(self):
+        """Проверяем, что список, собранный до нового поста и записанный
+        после него, не прячет этот пост"""
+        cache_keys = recent._cache_keys([self.first.pk])
+        stale = recent._load(self.first.pk)
+        post = Post.objects.create(author=self.first, text='Новый пост')
+        cache.set_many(dict.fromkeys(cache_keys, stale))
+        self.assertEqual(self.keys(self.first)[0], (post.created, post.pk))
+
+    @override_settings(POSTS_ON_PAGE=2)
+    def test_follow_index_merges_author_rings(self):
+        """Проверяем, что лента подписок собирается из кешей авторов
+        и за горизонтом кешей продолжается из базы"""
+        url = reverse('posts:follow_index')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Feed-Path'], 'merge')
+        seen = list(response.context['page_obj'])
+        cursor = encode_cursor(seen[-1])
+        while cursor:
+            page = self.client.get(url + f'?after={cursor}').context[
+                'page_obj'
+            ]
+            seen += list(page)
+            cursor = page.next_cursor
+        self.assertEqual(seen, self.posts[::-1])
+        for number in (1, 2, 3):
+            page = self.client.get(url + f'?page={number}').context[
+                'page_obj'
+            ]
+            self.assertEqual(
+                list(page), self.posts[::-1][(number - 1) * 2:number * 2]
+            )
+
+    def test_first_page_served_without_fallback(self):
+        """Проверяем, что страница в пределах кеша не обращается
+        к запасной ленте"""
+        feed = recent.RecentFeed([self.first.pk], fallback=None)
+        self.assertEqual(feed[0:2], [self.posts[4], self.posts[2]])
+
+    @override_settings(POSTS_ON_PAGE=2)
+    def test_profile_reads_ring(self):
+        """Проверяем, что профиль отдает посты автора из кеша"""
+        response = self.client.get(
+            reverse('posts:profile', kwargs={'username': 'first'})
+        )
+        self.assertEqual(
+            list(response.context['page_obj']),
+            [self.posts[4], self.posts[2]]
+        )
@@ -0,0 +1,114 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts import search
+from posts.models import Post
+
+User = get_user_model()
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass'
+        )
+        cls.in_text = Post.objects.create(
+            author=cls.author, text='Мой кот любит спать на солнце'
+        )
+        cls.in_title = Post.objects.create(
+            author=cls.author, title='Коты', text='Про котов и кошек'
+        )
+        cls.other = Post.objects.create(
+            author=cls.author, text='Собака лает, караван идет'
+        )
+
+    def setUp(self):
+        self.client = Client()
+
+    def found(self, query):
+        response = self.client.get(reverse('posts:search'), {'q': query})
+        return list(response.context['page_obj'])
+
+    def test_search_ranks_title_matches_higher(self):
+        """Проверяем, что совпадение в заголовке выше, чем в тексте"""
+        self.assertEqual(self.found('кот'), [self.in_title, self.in_text])
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        """Проверяем, что фрагмент экранирован и подсвечен"""
+        Post.objects.create(author=self.author, text='<b>енот</b> пришел')
+        response = self.client.get(reverse('posts:search'), {'q': 'енот'})
+        self.assertContains(response, '&lt;b&gt;<mark>енот</mark>&lt;/b&gt;')
+
+    def test_index_follows_changes(self):
+        """Проверяем, что индекс следует за изменениями постов,
+        в том числе в обход моделей"""
+        Post.objects.filter(pk=self.other.pk).update(text='Ворона')
+        self.assertEqual(self.found('собака'), [])
+        self.assertEqual(self.found('ворона'), [self.other])
+        Post.objects.filter(pk=self.other.pk).delete()
+        self.assertEqual(self.found('ворона'), [])
+        Post.objects.bulk_create([Post(author=self.author, text='Сорока')])
+        self.assertEqual(len(self.found('сорока')), 1)
+
+    def test_query_operators_are_ignored(self):
+        """Проверяем, что синтаксис FTS5 в запросе не ломает поиск"""
+        response = self.client.get(
+            reverse('posts:search'), {'q': 'кот" OR NEAR(*'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            search.match_expression('кот" OR NEAR(*'),
+            '"кот"* "OR"* "NEAR"*'
+        )
+        self.assertIsNone(
+            self.client.get(reverse('posts:search')).context['page_obj']
+        )
+
+    @override_settings(POSTS_ON_PAGE=1)
+    def test_search_keyset_pages(self):
+        """Проверяем переход по курсорам в результатах поиска"""
+        url = reverse('posts:search')
+        page = self.client.get(url, {'q': 'кот'}).context['page_obj']
+        self.assertEqual(list(page), [self.in_title])
+        page = self.client.get(
+            url, {'q': 'кот', 'after': page.next_cursor}
+        ).context['page_obj']
+        self.assertEqual(list(page), [self.in_text])
+        self.assertFalse(page.has_next())
+        page = self.client.get(
+            url, {'q': 'кот', 'before': page.previous_cursor}
+        ).context['page_obj']
+        self.assertEqual(list(page), [self.in_title])
+
+    def test_admin_search_uses_index(self):
+        """Проверяем поиск постов в админке"""
+        self.client.force_login(self.admin)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'кот'}
+        )
+        self.assertEqual(
+            set(response.context['cl'].result_list),
+            {self.in_title, self.in_text}
+        )
+
+    def test_rebuild_command_restores_index(self):
+        """Проверяем, что команда rebuild_search_index восстанавливает
+        индекс и пропавшие триггеры"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {search.FTS_TABLE}({search.FTS_TABLE}) "
+                f"VALUES ('delete-all')"
+            )
+            cursor.execute('DROP TRIGGER posts_post_fts_insert')
+        self.assertEqual(self.found('собака'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.found('собака'), [self.other])
+        post = Post.objects.create(author=self.author, text='Синица')
+        self.assertEqual(self.found('синица'), [post])
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+
+from core.storage import is_content_addressed
+from core.views import media
+from posts.models import Post
+
+User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+TEST_IMAGE = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ContentAddressedStorageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def create_post(self, name='image.gif', content=TEST_IMAGE):
+        return Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(name, content, 'image/gif')
+        )
+
+    def test_same_content_stored_once(self):
+        """Проверяем, что одинаковые картинки хранятся одним файлом,
+        а разные - разными"""
+        first = self.create_post('cat.GIF')
+        second = self.create_post('copy.gif')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(is_content_addressed(first.image.name))
+        self.assertTrue(first.image.name.endswith('.gif'))
+        directory = os.path.dirname(first.image.path)
+        self.assertEqual(len(os.listdir(directory)), 1)
+        other = self.create_post(content=TEST_IMAGE.replace(b'\xFF', b'\xFE'))
+        self.assertNotEqual(other.image.name, first.image.name)
+
+    def test_content_addressed_media_cached_forever(self):
+        """Проверяем, что файлы с именем-хешем отдаются с кешированием
+        навсегда, а остальные - без него"""
+        post = self.create_post()
+        FileSystemStorage().save('posts/plain.gif', ContentFile(TEST_IMAGE))
+        request = RequestFactory().get('/media/')
+        response = media(request, post.image.name, TEMP_MEDIA_ROOT)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        response = media(request, 'posts/plain.gif', TEMP_MEDIA_ROOT)
+        self.assertFalse(response.has_header('Cache-Control'))
+
+    def test_dedupe_command_moves_legacy_images(self):
+        """Проверяем, что команда переносит старые картинки под
+        имена-хеши и сводит одинаковые к одному файлу"""
+        legacy = FileSystemStorage()
+        names = [
+            legacy.save(f'posts/old{i}.gif', ContentFile(TEST_IMAGE))
+            for i in range(2)
+        ]
+        posts = [
+            Post.objects.create(author=self.user, text='Старый', image=name)
+            for name in names + ['posts/missing.gif']
+        ]
+        out = StringIO()
+        call_command('dedupe_post_images', '--batch-size=1', stdout=out)
+        self.assertIn(
+            'Перенесено файлов: 2, совпали с уже сохраненными: 1, '
+            'не найдено: 1',
+            out.getvalue()
+        )
+        for post in posts:
+            post.refresh_from_db()
+        self.assertEqual(posts[0].image.name, posts[1].image.name)
+        self.assertTrue(is_content_addressed(posts[0].image.name))
+        self.assertEqual(posts[2].image.name, 'posts/missing.gif')
@@ -0,0 +1,377 @@
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+
+from core import thumbnails
+from posts import processing
+from posts.models import Post
+from posts.tests.test_forms import make_image
+
+User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+TEST_IMAGE = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+PLACEHOLDER = 'img/placeholder.svg'
+
+
+def image_content(number):
+    # одинаковые картинки хранятся одним файлом - меняем цвет в палитре
+    return TEST_IMAGE.replace(b'\xFF\xFF\xFF', bytes((255, 255, number)))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def create_post(self):
+        return Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(
+                name='image.gif', content=TEST_IMAGE,
+                content_type='image/gif'
+            )
+        )
+
+    def test_thumbnails_created_on_save(self):
+        """Проверяем, что миниатюры всех наборов создаются при сохранении
+        поста, и страницы выводят их без заглушки"""
+        post = self.create_post()
+        for preset in settings.THUMBNAIL_PRESETS:
+            with self.subTest(preset=preset):
+                self.assertIsNotNone(thumbnails.get_cached(post.image, preset))
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertNotContains(response, PLACEHOLDER)
+                self.assertContains(response, 'cache/')
+
+    def test_responsive_variants(self):
+        """Проверяем, что создаются все ширины в JPEG и WebP, а страница
+        выводит их в srcset и <picture>"""
+        post = self.create_post()
+        image = thumbnails.get_cached(post.image, 'post_card')
+        self.assertTrue(image.complete)
+        self.assertEqual((image.width, image.height), (800, 600))
+        self.assertEqual(len(image.srcset.split(', ')), 2)
+        self.assertIn('400w', image.srcset)
+        (mime_type, webp_srcset), = image.sources
+        self.assertEqual(mime_type, 'image/webp')
+        self.assertIn('.webp 800w', webp_srcset)
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, f'srcset="{image.srcset}"')
+        self.assertContains(
+            response, f'<source type="image/webp" srcset="{webp_srcset}"'
+        )
+
+    def test_scale_geometry(self):
+        """Проверяем уменьшение geometry sorl-thumbnail"""
+        cases = (('800x600', '400x300'), ('x400', 'x200'), ('600', '300'))
+        for geometry, expected in cases:
+            with self.subTest(geometry=geometry):
+                self.assertEqual(
+                    thumbnails.scale_geometry(geometry, 0.5), expected
+                )
+
+    @override_settings(TASKS_ALWAYS_EAGER=False)
+    def test_placeholder_until_thumbnails_ready(self):
+        """Проверяем, что до создания миниатюр выводится заглушка,
+        а после - миниатюра"""
+        post = self.create_post()
+        self.assertIsNone(thumbnails.get_cached(post.image, 'post_card'))
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, PLACEHOLDER)
+        thumbnails.generate(post.image.name)
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotContains(response, PLACEHOLDER)
+
+    @override_settings(TASKS_ALWAYS_EAGER=False)
+    def test_generation_scheduled_once(self):
+        """Проверяем, что повторные запросы не ставят задачу снова"""
+        post = self.create_post()
+        key = thumbnails.PENDING_PREFIX + post.image.name
+        self.assertTrue(cache.get(key))
+        self.assertFalse(
+            cache.add(key, True, settings.THUMBNAIL_PENDING_TIMEOUT)
+        )
+        thumbnails.generate(post.image.name)
+        self.assertIsNone(cache.get(key))
+
+    @override_settings(TASKS_ALWAYS_EAGER=False)
+    def test_repost_keeps_other_posts(self):
+        """Проверяем, что повторная загрузка картинки с готовыми
+        миниатюрами не трогает посты, где она уже есть"""
+        first = self.create_post()
+        thumbnails.generate(first.image.name)
+        first.refresh_from_db()
+        second = self.create_post()
+        self.assertEqual(second.image.name, first.image.name)
+        thumbnails.generate(second.image.name)
+        self.assertEqual(
+            Post.objects.get(pk=first.pk).updated, first.updated
+        )
+
+    def test_missing_image_is_skipped(self):
+        """Проверяем, что отсутствующая картинка не ломает создание"""
+        self.assertEqual(thumbnails.generate('posts/missing.gif'), 0)
+
+    def test_feed_page_reads_thumbnails_in_one_query(self):
+        """Проверяем, что миниатюры всех постов страницы читаются
+        из хранилища ключей одним запросом"""
+        posts = [self.create_post() for _ in range(3)]
+        # сбрасываем кеш - хранилище ключей sorl читает из базы
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:index'))
+        kvstore_queries = [
+            query for query in queries.captured_queries
+            if 'thumbnail_kvstore' in query['sql']
+        ]
+        self.assertEqual(len(kvstore_queries), 1)
+        self.assertNotContains(response, PLACEHOLDER)
+        for post in posts:
+            self.assertContains(
+                response,
+                thumbnails.get_cached(post.image, 'post_card').url
+            )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, TASKS_ALWAYS_EAGER=False)
+class WarmThumbnailsCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.checkpoint = tempfile.mktemp(dir=TEMP_MEDIA_ROOT)
+        self.posts = [
+            Post.objects.create(
+                author=self.user,
+                text=f'Пост {i}',
+                image=SimpleUploadedFile(
+                    name=f'image{i}.gif', content=image_content(i),
+                    content_type='image/gif'
+                )
+            )
+            for i in range(3)
+        ]
+
+    def warm(self, *args):
+        out = StringIO()
+        # тестовая база в памяти не видна дочерним процессам
+        call_command(
+            'warm_thumbnails', '--processes=0', '--batch-size=2',
+            f'--checkpoint={self.checkpoint}', *args, stdout=out
+        )
+        return out.getvalue()
+
+    def test_creates_missing_and_skips_fresh(self):
+        """Проверяем, что команда создает недостающие миниатюры,
+        а при повторном запуске пропускает актуальные"""
+        output = self.warm()
+        self.assertIn('created 3', output)
+        for post in self.posts:
+            for preset in settings.THUMBNAIL_PRESETS:
+                self.assertIsNotNone(thumbnails.get_cached(post.image, preset))
+        self.assertIn('fresh 3', self.warm())
+        self.assertIn('created 3', self.warm('--force'))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_restored_image_is_stale(self):
+        """Проверяем, что миниатюры картинки новее их самих создаются
+        заново"""
+        self.warm()
+        path = self.posts[0].image.path
+        os.utime(path, (time.time() + 60, time.time() + 60))
+        output = self.warm()
+        self.assertIn('created 1', output)
+        self.assertIn('fresh 2', output)
+
+    def test_resume_from_checkpoint(self):
+        """Проверяем, что --resume продолжает после контрольной точки"""
+        with open(self.checkpoint, 'w') as checkpoint:
+            checkpoint.write(str(self.posts[1].pk))
+        output = self.warm('--resume')
+        self.assertIn('Постов 1 из 1', output)
+        self.assertIsNone(
+            thumbnails.get_cached(self.posts[0].image, 'post_card')
+        )
+        self.assertIsNotNone(
+            thumbnails.get_cached(self.posts[2].image, 'post_card')
+        )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, TASKS_ALWAYS_EAGER=False)
+class ImageInfoTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.post = Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(
+                name='image.gif', content=TEST_IMAGE,
+                content_type='image/gif'
+            )
+        )
+
+    def test_image_info_saved_with_post(self):
+        """Проверяем, что размеры и цвет картинки сохраняются с постом
+        и сбрасываются вместе с картинкой"""
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertRegex(post.image_color, r'^#[0-9a-f]{6}$')
+        post.image = None
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(
+            (post.image_width, post.image_height, post.image_color),
+            (None, None, '')
+        )
+
+    def test_placeholder_reserves_thumbnail_size(self):
+        """Проверяем, что заглушка получает размер будущей миниатюры"""
+        cases = (
+            (reverse('posts:index'), 'width="800" height="600"'),
+            (reverse('posts:profile', kwargs={'username': 'author'}),
+             'width="600" height="300"'),
+            (reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+             'width="800" height="400"'),
+        )
+        for url, size in cases:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertContains(response, PLACEHOLDER)
+                self.assertContains(response, size)
+                self.assertContains(response, self.post.image_color)
+
+    def test_backfill_command(self):
+        """Проверяем, что команда заполняет сведения о старых картинках
+        и пропускает отсутствующие файлы"""
+        missing = Post.objects.create(
+            author=self.user, text='Без файла', image='posts/missing.gif'
+        )
+        Post.objects.update(image_width=None, image_height=None)
+        out = StringIO()
+        call_command('backfill_image_info', '--batch-size=1', stdout=out)
+        self.assertIn('обновлено 1, не прочитано 1', out.getvalue())
+        self.post.refresh_from_db()
+        missing.refresh_from_db()
+        self.assertEqual(self.post.image_width, 2)
+        self.assertIsNone(missing.image_width)
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT, TASKS_ALWAYS_EAGER=False,
+    IMAGE_PROCESSING_ASYNC=True
+)
+class ImageProcessingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def upload(self, content):
+        self.client.post(reverse('posts:post_create'), data={
+            'text': 'Пост с картинкой',
+            'image': SimpleUploadedFile('image.jpg', content, 'image/jpeg'),
+        })
+        return Post.objects.get()
+
+    def test_post_saved_before_processing(self):
+        """Проверяем, что пост сохраняется сразу, а до конца обработки
+        выводится заглушка и миниатюры не создаются"""
+        post = self.upload(make_image((30, 20), 'JPEG', 6))
+        self.assertFalse(post.image_ready)
+        self.assertIsNone(post.image_width)
+        self.assertIsNone(
+            cache.get(thumbnails.PENDING_PREFIX + post.image.name)
+        )
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, PLACEHOLDER)
+
+    def test_processing_normalizes_image(self):
+        """Проверяем, что фоновая обработка поворачивает картинку,
+        убирает EXIF, создает миниатюры и убирает заглушку"""
+        post = self.upload(make_image((30, 20), 'JPEG', 6))
+        original = post.image.name
+        processing.process_image(post.pk)
+        post.refresh_from_db()
+        self.assertTrue(post.image_ready)
+        self.assertNotEqual(post.image.name, original)
+        self.assertEqual((post.image_width, post.image_height), (20, 30))
+        with Image.open(post.image.path) as image:
+            self.assertNotIn('exif', image.info)
+        self.assertTrue(thumbnails.get_cached(post.image, 'post_card'))
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotContains(response, PLACEHOLDER)
+
+    def test_unreadable_image_dropped(self):
+        """Проверяем, что пост с нечитаемой картинкой остается без нее"""
+        post = self.upload(make_image((30, 20), 'JPEG'))
+        with open(post.image.path, 'wb') as image:
+            image.write(b'not an image')
+        with self.assertLogs('posts.processing', 'ERROR'):
+            processing.process_image(post.pk)
+        post.refresh_from_db()
+        self.assertTrue(post.image_ready)
+        self.assertFalse(post.image)
@@ -0,0 +1,204 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.paginator import encode_cursor
+from posts import timeline
+from posts.models import Follow, Post, TimelineEntry
+from posts.timeline import timeline_posts
+
+User = get_user_model()
+
+
+class TimelineTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='author')
+        cls.old_post = Post.objects.create(
+            author=cls.author,
+            text='Пост до подписки'
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_follow_backfills_timeline(self):
+        """Проверяем, что после подписки в ленте есть старые посты"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(
+            list(timeline_posts(self.reader)),
+            [self.old_post]
+        )
+
+    def test_new_post_fans_out_to_followers(self):
+        """Проверяем, что новый пост попадает в ленты подписчиков"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertEqual(
+            list(timeline_posts(self.reader)),
+            [post, self.old_post]
+        )
+        self.assertFalse(timeline_posts(self.author).exists())
+
+    def test_unfollow_cleans_timeline(self):
+        """Проверяем, что после отписки лента очищается"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.filter(user=self.reader, author=self.author).delete()
+        self.assertFalse(timeline_posts(self.reader).exists())
+
+    @override_settings(TASKS_ALWAYS_EAGER=False)
+    def test_tasks_out_of_order(self):
+        """Проверяем, что задачи подписки и отписки, выполненные
+        не по порядку, оставляют ленту по текущей подписке"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.filter(user=self.reader, author=self.author).delete()
+        timeline.backfill(self.reader.pk, self.author.pk)
+        self.assertFalse(timeline_posts(self.reader).exists())
+        Follow.objects.create(user=self.reader, author=self.author)
+        timeline.backfill(self.reader.pk, self.author.pk)
+        timeline.clean(self.reader.pk, self.author.pk)
+        self.assertEqual(
+            list(timeline_posts(self.reader)),
+            [self.old_post]
+        )
+
+    def test_deleted_post_leaves_timeline(self):
+        """Проверяем, что удаленный пост пропадает из ленты"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.filter(pk=self.old_post.pk).delete()
+        self.assertFalse(timeline_posts(self.reader).exists())
+
+    def test_rebuild_command_restores_timeline(self):
+        """Проверяем, что команда rebuild_timelines восстанавливает ленту"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertEqual(
+            list(timeline_posts(self.reader)),
+            [self.old_post]
+        )
+
+    @override_settings(TASKS_ALWAYS_EAGER=False)
+    def test_follow_page_refreshed_by_tasks(self):
+        """Проверяем, что страница подписок, собранная до фоновой
+        задачи, обновляется, когда задача запишет ленту"""
+        client = Client()
+        client.force_login(self.reader)
+        url = reverse('posts:follow_index')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertNotContains(client.get(url), self.old_post.text)
+        timeline.backfill(self.reader.pk, self.author.pk)
+        self.assertContains(client.get(url), self.old_post.text)
+        post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertNotContains(client.get(url), post.text)
+        timeline.fan_out_post(post.pk)
+        self.assertContains(client.get(url), post.text)
+        Follow.objects.filter(user=self.reader, author=self.author).delete()
+        timeline.clean(self.reader.pk, self.author.pk)
+        self.assertNotContains(client.get(url), post.text)
+
+
+@override_settings(TIMELINE_PULL_THRESHOLD=2)
+class HybridTimelineTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader')
+        cls.fan = User.objects.create_user(username='fan')
+        cls.star = User.objects.create_user(username='star')
+        cls.author = User.objects.create_user(username='author')
+        Follow.objects.create(user=cls.reader, author=cls.star)
+        Follow.objects.create(user=cls.fan, author=cls.star)
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.reader)
+        self.posts = [
+            Post.objects.create(author=author, text=f'Пост {i}')
+            for i, author in enumerate(
+                (self.author, self.star, self.author, self.star)
+            )
+        ]
+
+    def test_popular_author_posts_are_not_fanned_out(self):
+        """Проверяем, что посты популярного автора не раскладываются"""
+        self.assertFalse(
+            TimelineEntry.objects.filter(author=self.star).exists()
+        )
+
+    def test_follow_index_merges_pulled_posts(self):
+        """Проверяем, что посты популярного автора подмешиваются
+        в ленту при чтении в правильном порядке"""
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(response['X-Feed-Path'], 'hybrid')
+        self.assertEqual(
+            list(response.context['page_obj']),
+            self.posts[::-1]
+        )
+
+    @override_settings(POSTS_ON_PAGE=1)
+    def test_follow_index_cursor_pages(self):
+        """Проверяем переход по курсорам в смешанной ленте"""
+        url = reverse('posts:follow_index')
+        page = self.client.get(url).context['page_obj']
+        seen = list(page)
+        cursor = encode_cursor(seen[-1])
+        while cursor:
+            page = self.client.get(url + f'?after={cursor}').context[
+                'page_obj'
+            ]
+            seen += list(page)
+            cursor = page.next_cursor
+        self.assertEqual(seen, self.posts[::-1])
+        page = self.client.get(
+            url + f'?before={encode_cursor(seen[-1])}'
+        ).context['page_obj']
+        self.assertEqual(list(page), [seen[-2]])
+
+    def test_numbered_page_reads_own_posts(self):
+        """Проверяем, что срез смешанной ленты выбирает из базы
+        только посты самой страницы"""
+        feed = timeline.FollowFeed(self.reader, [self.star.pk])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(feed[2:3], [self.posts[1]])
+        self.assertIn(
+            f'IN ({self.posts[1].pk})', queries.captured_queries[-1]['sql']
+        )
+
+    def test_author_crosses_threshold(self):
+        """Проверяем, что автор, переставший быть популярным, попадает
+        в ленты, а снова ставший популярным не считается дважды"""
+        url = reverse('posts:follow_index')
+        Follow.objects.filter(user=self.fan, author=self.star).delete()
+        self.assertEqual(
+            list(timeline_posts(self.reader)), self.posts[::-1]
+        )
+        response = self.client.get(url)
+        self.assertEqual(response['X-Feed-Path'], 'push')
+        self.assertEqual(list(response.context['page_obj']), self.posts[::-1])
+        Follow.objects.create(user=self.fan, author=self.star)
+        self.assertFalse(
+            TimelineEntry.objects.filter(author=self.star).exists()
+        )
+        response = self.client.get(url + '?page=1')
+        self.assertEqual(response['X-Feed-Path'], 'hybrid')
+        self.assertEqual(
+            response.context['page_obj'].paginator.count, len(self.posts)
+        )
+
+    def test_follow_index_push_path(self):
+        """Проверяем, что без популярных авторов лента читается
+        только из материализованной таблицы"""
+        self.client.force_login(self.fan)
+        Follow.objects.filter(author=self.star).delete()
+        cache.clear()
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(response['X-Feed-Path'], 'push')
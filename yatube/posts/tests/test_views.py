@@ -24,6 +24,7 @@ from django.test import Client, TestCase, override_settings
 from django.core.cache import cache
 from django.urls import reverse
 
+from core.paginator import ELLIPSIS, KeysetPage, encode_cursor
 from posts.forms import PostForm
 from posts.models import Post, Group, Comment, Follow
 
@@ -222,8 +223,8 @@ class PostPagesTest(TestCase):
         # Обращаемся к главной странице. Данные попадают в кеш
         response_before = self.client.get(reverse('posts:index'))
 
-        # Удаляем пост из базы
-        post.delete()
+        # Меняем пост в обход сигналов моделей
+        Post.objects.filter(pk=post.pk).update(text='Измененный текст')
 
         # Получаем данные с главной страницы и проверяем,
         # что контент страницы не изменился
@@ -236,15 +237,47 @@ class PostPagesTest(TestCase):
             )
         )
 
-        # принудительно очищаем кеш
-        cache.clear()
+        # Удаляем пост из базы - это сбрасывает версию кеша ленты
+        post.delete()
 
-        # проверяем, что теперь удаленного поста нет на странице
-        self.assertNotIn(
-            post,
-            self.client.get(reverse('posts:index')).context.get('page_obj')
+        # проверяем, что удаленного поста сразу нет на странице
+        self.assertNotContains(
+            self.client.get(reverse('posts:index')),
+            'Текст поста для кеша'
         )
 
+    def test_cache_invalidated_by_scope(self):
+        """Проверяем, что изменения сбрасывают только свои фрагменты"""
+        group_url = reverse('posts:group_list', kwargs={'slug': 'test-slug'})
+        detail_url = reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.id}
+        )
+        self.client.get(group_url)
+        self.client.get(detail_url)
+        Post.objects.create(
+            author=self.user_to_follow,
+            text='Пост в другой группе',
+            group=self.new_group
+        )
+        Post.objects.filter(pk=self.post.pk).update(text='Измененный текст')
+        Comment.objects.filter(pk=self.comment.pk).update(
+            text='Измененный комментарий'
+        )
+        # фрагменты группы и поста не сброшены новым постом в другой группе
+        self.assertNotContains(self.client.get(group_url), 'Измененный')
+        self.assertNotContains(
+            self.client.get(detail_url), 'Измененный комментарий'
+        )
+        # новый комментарий сбрасывает страницу поста
+        Comment.objects.create(
+            author=self.user,
+            text='Новый комментарий',
+            post=self.post
+        )
+        response = self.client.get(detail_url)
+        self.assertContains(response, 'Новый комментарий')
+        self.assertContains(response, 'Измененный комментарий')
+
     def test_authorised_user_can_follow(self):
         """Проверяем, что авторизованный пользователь может
         подписываться на других пользователей"""
@@ -420,3 +453,154 @@ class PaginatorViewsTest(TestCase):
                         f'а получено {len(response.context["page_obj"])}'
                     )
                 )
+
+
+class KeysetPaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='test_user')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        ADDITIONAL_POSTS = 5
+        Post.objects.bulk_create(
+            [
+                Post(
+                    author=cls.user,
+                    text=f'Текст тестового поста {i}',
+                    group=cls.group
+                ) for i in range(settings.POSTS_ON_PAGE + ADDITIONAL_POSTS)
+            ]
+        )
+        cls.views_names = [
+            ('posts:index', None),
+            ('posts:group_list', {'slug': cls.group.slug}),
+            ('posts:profile', {'username': cls.user.username})
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages_by_cursor_cover_whole_feed(self):
+        """Проверяем, что переход по курсорам ?after= выдает
+        все посты ленты по одному разу и в правильном порядке"""
+        expected = list(Post.objects.values_list('pk', flat=True))
+        for view_name, kwargs in self.views_names:
+            with self.subTest(view_name=view_name):
+                url = reverse(view_name, kwargs=kwargs)
+                page = self.client.get(url).context['page_obj']
+                seen = [post.pk for post in page]
+                cursor = encode_cursor(page[len(page) - 1])
+                while cursor:
+                    page = self.client.get(
+                        url + f'?after={cursor}'
+                    ).context['page_obj']
+                    self.assertIsInstance(page, KeysetPage)
+                    seen += [post.pk for post in page]
+                    cursor = page.next_cursor
+                self.assertEqual(seen, expected)
+
+    def test_before_cursor_returns_previous_page(self):
+        """Проверяем, что ?before= возвращает предыдущую страницу"""
+        url = reverse('posts:index')
+        first_page = self.client.get(url).context['page_obj']
+        second_page = self.client.get(
+            url + f'?after={encode_cursor(first_page[len(first_page) - 1])}'
+        ).context['page_obj']
+        previous_page = self.client.get(
+            url + f'?before={second_page.previous_cursor}'
+        ).context['page_obj']
+        self.assertEqual(list(previous_page), list(first_page))
+        self.assertFalse(previous_page.has_previous())
+        self.assertTrue(previous_page.has_next())
+
+    def test_broken_cursor_returns_first_page(self):
+        """Проверяем, что испорченный курсор ведет на первую страницу"""
+        response = self.client.get(
+            reverse('posts:index') + '?after=broken'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(response.context['page_obj']),
+            list(Post.objects.all()[:settings.POSTS_ON_PAGE])
+        )
+
+    @override_settings(POSTS_ON_PAGE=1)
+    def test_paginator_renders_bounded_page_range(self):
+        """Проверяем, что навигация выводит только окно номеров
+        страниц, а не все страницы ленты"""
+        response = self.client.get(reverse('posts:index') + '?page=8')
+        links = [
+            f'href="?page={number}"' for number in range(1, 16)
+        ]
+        content = response.content.decode()
+        rendered = [link for link in links if link in content]
+        self.assertEqual(
+            rendered,
+            [
+                'href="?page=1"',
+                'href="?page=6"',
+                'href="?page=7"',
+                'href="?page=9"',
+                'href="?page=10"',
+                'href="?page=15"',
+            ]
+        )
+        self.assertContains(response, ELLIPSIS, count=2)
+
+
+@override_settings(COMMENTS_ON_PAGE=2)
+class CommentsPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='commentator')
+        cls.post = Post.objects.create(author=cls.user, text='Тестовый пост')
+        cls.comments = [
+            Comment.objects.create(
+                author=cls.user, post=cls.post, text=f'Комментарий {i}'
+            )
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_post_detail_shows_first_comments(self):
+        """Проверяем, что на странице поста только первая порция
+        комментариев и ссылка на следующую"""
+        response = self.guest_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        comments = response.context['comments']
+        self.assertEqual(list(comments), self.comments[:-3:-1])
+        self.assertContains(
+            response,
+            reverse('posts:post_comments', kwargs={'post_id': self.post.pk})
+            + f'?after={encode_cursor(comments[-1])}'
+        )
+
+    def test_load_more_returns_next_comments(self):
+        """Проверяем, что фрагмент отдает следующие порции до конца"""
+        url = reverse('posts:post_comments', kwargs={'post_id': self.post.pk})
+        seen = []
+        cursor = ''
+        while cursor is not None:
+            response = self.guest_client.get(f'{url}?after={cursor}')
+            self.assertTemplateUsed(
+                response, 'posts/includes/comment_list.html'
+            )
+            seen += list(response.context['comments'])
+            cursor = response.context['comments'].next_cursor
+        self.assertEqual(seen, self.comments[::-1])
+        self.assertNotContains(response, 'data-load-comments')
+
+    def test_load_more_for_missing_post(self):
+        """Проверяем, что фрагмент несуществующего поста - 404"""
+        response = self.guest_client.get(
+            reverse('posts:post_comments', kwargs={'post_id': 0})
+        )
+        self.assertEqual(response.status_code, 404)
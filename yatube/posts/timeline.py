@@ -0,0 +1,312 @@
+"""Лента подписок.
+
+Обычные авторы раскладываются по лентам подписчиков при записи
+(fan-out on write): новый пост попадает в ленты всех подписчиков
+автора, подписка дозаполняет ленту постами автора, отписка их убирает.
+Все эти операции идемпотентны и выполняются фоновыми задачами.
+Фрагменты ленты сбрасываются, когда задача уже записала ленту:
+страница, собранная между коммитом и задачей, иначе осталась бы
+в кеше без новых постов.
+
+Авторы, у которых подписчиков не меньше
+settings.TIMELINE_PULL_THRESHOLD, не раскладываются: их посты берутся
+при чтении из кеша последних постов автора и сливаются с
+материализованной лентой по ключу (created, pk). Когда автор
+пересекает порог, его записи в лентах удаляются или, наоборот,
+дозаполняются (followers_changed).
+"""
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core import invalidation, metrics
+from core.invalidation import scope
+from core.paginator import keyset_slice
+from core.tasks import run_async
+
+from . import recent
+from .models import Follow, Post, TimelineEntry, UserCounters
+
+ENTRY_ORDERING = ('created', 'post_id')
+PULLED_AUTHORS_CACHE_KEY = 'timeline:pulled_authors'
+
+FEED_READS = {
+    path: metrics.counter(f'feed.follow.{path}')
+    for path in ('push', 'hybrid', 'merge')
+}
+
+
+def pulled_authors():
+    """Авторы, посты которых подтягиваются при чтении ленты."""
+    authors = cache.get(PULLED_AUTHORS_CACHE_KEY)
+    if authors is None:
+        authors = frozenset(
+            UserCounters.objects.filter(
+                followers_count__gte=settings.TIMELINE_PULL_THRESHOLD
+            ).values_list('user_id', flat=True)
+        )
+        cache.set(
+            PULLED_AUTHORS_CACHE_KEY,
+            authors,
+            settings.TIMELINE_PULL_AUTHORS_CACHE_TIME
+        )
+    return authors
+
+
+def timeline_posts(user):
+    """Посты материализованной ленты подписок пользователя."""
+    return Post.objects.filter(timeline_entries__user=user)
+
+
+def follow_feed(user):
+    """Лента подписок пользователя для постраничного вывода.
+
+    При settings.RECENT_POSTS_FEEDS первые страницы собираются
+    из кешей последних постов всех авторов, на которых подписан
+    пользователь, а материализованная лента служит запасной.
+    """
+    pulled = pulled_authors()
+    if pulled:
+        pulled = list(
+            Follow.objects.filter(
+                user=user, author_id__in=pulled
+            ).values_list('author_id', flat=True)
+        )
+    feed = FollowFeed(user, pulled)
+    if settings.RECENT_POSTS_FEEDS:
+        feed = recent.RecentFeed(
+            user.follower.values_list('author_id', flat=True), feed
+        )
+    metrics.incr(FEED_READS[feed.path])
+    return feed
+
+
+class FollowFeed:
+    """Материализованная лента, слитая с постами популярных авторов.
+
+    Ключи (created, pk) читаются по индексу ленты и из кешей авторов,
+    сливаются, а сами посты выбираются одним запросом по pk.
+    Поддерживает протокол лент KeysetPaginator, а также count()
+    и срезы, поэтому подходит и для обычного Paginator.
+    """
+
+    def __init__(self, user, pulled_author_ids=()):
+        self.entries = TimelineEntry.objects.filter(user=user).values_list(
+            *ENTRY_ORDERING
+        )
+        self.pulled_author_ids = pulled_author_ids
+        self.recent = recent.recent_keys(pulled_author_ids)
+
+    @property
+    def path(self):
+        return 'hybrid' if self.pulled_author_ids else 'push'
+
+    def count(self):
+        # записи автора, еще не убранные после перехода к подтягиванию,
+        # не должны считаться дважды
+        return self.entries.exclude(
+            author_id__in=self.pulled_author_ids
+        ).count() + Post.objects.filter(
+            author_id__in=self.pulled_author_ids
+        ).count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        # ключи дешевы, а посты выбираются только для самой страницы
+        start, stop = index.start or 0, index.stop
+        return self._posts(self._keys(None, stop, newer=False)[start:stop])
+
+    def rows_after(self, cursor, limit):
+        return self._rows(cursor, limit, newer=False)
+
+    def rows_before(self, cursor, limit):
+        return self._rows(cursor, limit, newer=True)
+
+    def _rows(self, cursor, limit, newer):
+        return self._posts(self._keys(cursor, limit, newer))
+
+    def _keys(self, cursor, limit, newer):
+        sources = [
+            keyset_slice(self.entries, cursor, limit, ENTRY_ORDERING, newer)
+        ]
+        sources += [
+            self._author_keys(author_id, cursor, limit, newer)
+            for author_id in self.pulled_author_ids
+        ]
+        keys = heapq.merge(*sources, reverse=not newer)
+        return list(islice(_unique(keys), limit))
+
+    def _posts(self, keys):
+        posts = Post.objects.select_related('author', 'group').in_bulk(
+            [pk for _, pk in keys]
+        )
+        return [posts[pk] for _, pk in keys if pk in posts]
+
+    def _author_keys(self, author_id, cursor, limit, newer):
+        cached = self.recent[author_id]
+        complete = recent.is_complete(cached)
+        if newer:
+            keys = [key for key in reversed(cached)
+                    if cursor is None or key > cursor][:limit]
+            if complete or (cached and cursor >= cached[-1]):
+                return keys
+        else:
+            keys = [key for key in cached
+                    if cursor is None or key < cursor][:limit]
+            if complete or len(keys) == limit:
+                return keys
+        # курсор ушел глубже кеша - читаем посты автора из базы
+        return keyset_slice(
+            Post.objects.filter(author_id=author_id).values_list(
+                'created', 'pk'
+            ),
+            cursor, limit, newer=newer
+        )
+
+
+def _unique(keys):
+    # один пост может прийти и из ленты, и из кеша автора,
+    # если автор стал популярным уже после раскладки
+    previous = None
+    for key in keys:
+        if key != previous:
+            yield key
+        previous = key
+
+
+def _timelines_changed(user_ids):
+    invalidation.bump(*{scope('follower', user_id) for user_id in user_ids})
+
+
+def _insert(entries):
+    # bulk_create материализует весь список, поэтому режем на пачки сами
+    entries = iter(entries)
+    batch = list(islice(entries, settings.TIMELINE_BATCH_SIZE))
+    while batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+        _timelines_changed(entry.user_id for entry in batch)
+        batch = list(islice(entries, settings.TIMELINE_BATCH_SIZE))
+
+
+def fan_out_post(post_id):
+    """Добавляет пост в ленты всех подписчиков его автора."""
+    post = Post.objects.filter(pk=post_id).values(
+        'pk', 'author_id', 'created'
+    ).first()
+    if post is None or post['author_id'] in pulled_authors():
+        return
+    followers = Follow.objects.filter(
+        author_id=post['author_id']
+    ).values_list('user_id', flat=True).iterator()
+    _insert(
+        TimelineEntry(
+            user_id=user_id,
+            post_id=post['pk'],
+            author_id=post['author_id'],
+            created=post['created']
+        ) for user_id in followers
+    )
+
+
+def _following(user_id, author_id):
+    return Follow.objects.filter(user_id=user_id, author_id=author_id).exists()
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту пользователя все посты автора.
+
+    Задачи подписки и отписки могут выполниться в любом порядке,
+    поэтому лента дозаполняется, только если подписка еще есть.
+    """
+    if author_id in pulled_authors() or not _following(user_id, author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        'pk', 'created'
+    ).iterator()
+    _insert(
+        TimelineEntry(
+            user_id=user_id,
+            post_id=post_id,
+            author_id=author_id,
+            created=created
+        ) for post_id, created in posts
+    )
+
+
+def clean(user_id, author_id):
+    """Убирает из ленты пользователя посты автора,
+    если пользователь на него не подписан заново."""
+    if _following(user_id, author_id):
+        return
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+    _timelines_changed([user_id])
+
+
+def followers_changed(author_id, delta):
+    """Меняет режим автора, если число его подписчиков пересекло
+    порог settings.TIMELINE_PULL_THRESHOLD.
+
+    Вызывается после изменения счетчика подписчиков на delta.
+    """
+    count = UserCounters.objects.filter(user_id=author_id).values_list(
+        'followers_count', flat=True
+    ).first()
+    threshold = settings.TIMELINE_PULL_THRESHOLD
+    if delta > 0 and count == threshold:
+        run_async(start_pulling, author_id)
+    elif delta < 0 and count == threshold - 1:
+        run_async(stop_pulling, author_id)
+
+
+def start_pulling(author_id):
+    """Убирает посты ставшего популярным автора из лент."""
+    cache.delete(PULLED_AUTHORS_CACHE_KEY)
+    # за время ожидания задачи автор мог снова потерять подписчиков
+    if author_id not in pulled_authors():
+        return
+    entries = TimelineEntry.objects.filter(author_id=author_id)
+    user_ids = set(entries.values_list('user_id', flat=True))
+    entries.delete()
+    _timelines_changed(user_ids)
+
+
+def stop_pulling(author_id):
+    """Раскладывает посты автора, переставшего быть популярным,
+    по лентам подписчиков: его посты, опубликованные в режиме
+    подтягивания, ни в одну ленту не попали."""
+    cache.delete(PULLED_AUTHORS_CACHE_KEY)
+    if author_id in pulled_authors():
+        return
+    followers = Follow.objects.filter(author_id=author_id).values_list(
+        'user_id', flat=True
+    )
+    for user_id in followers.iterator():
+        backfill(user_id, author_id)
+
+
+def rebuild(user_id=None):
+    """Пересобирает ленты по таблице подписок.
+
+    Без user_id пересобираются ленты всех пользователей.
+    Возвращает число обработанных подписок.
+    """
+    entries = TimelineEntry.objects.all()
+    follows = Follow.objects.all()
+    if user_id is not None:
+        entries = entries.filter(user_id=user_id)
+        follows = follows.filter(user_id=user_id)
+    entries.delete()
+    if user_id is not None:
+        _timelines_changed([user_id])
+    else:
+        invalidation.bump(scope('posts'))
+    count = 0
+    for follower_id, author_id in follows.values_list(
+        'user_id', 'author_id'
+    ).iterator():
+        backfill(follower_id, author_id)
+        count += 1
+    return count
@@ -3,70 +3,153 @@ from django.shortcuts import get_object_or_404, redirect, render
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 
+from core.invalidation import cache_version, scope
+from core.pagecache import cache_shared_page
+from core.paginator import CountedPaginator, KeysetPaginator, QuerySetFeed
+
+from .counters import reconcile_group, reconcile_user, user_counters
 from .forms import PostForm, CommentForm
 from .models import Group, Post, User, Follow
+from .recent import RecentFeed
+from .search import SearchFeed
+from .timeline import follow_feed
+
+
+def get_page_posts(request, posts, count=None, on_mismatch=None):
+    """Страница ленты: по курсору ?after=/?before= или по номеру ?page=.
+
+    count - заранее известное число постов (из счетчиков),
+    чтобы Paginator не выполнял COUNT(*); если страница с ним
+    не сойдется, вызывается on_mismatch().
+    """
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    if after or before:
+        paginator = KeysetPaginator(posts, settings.POSTS_ON_PAGE)
+        return paginator.get_page(after=after, before=before)
+    if count is None:
+        paginator = Paginator(posts, settings.POSTS_ON_PAGE)
+    else:
+        paginator = CountedPaginator(
+            posts, settings.POSTS_ON_PAGE, count, on_mismatch
+        )
+    return paginator.get_page(request.GET.get('page'))
 
 
-def get_page_posts(page_number, posts):
-    paginator = Paginator(posts, settings.POSTS_ON_PAGE)
-    return paginator.get_page(page_number)
+def get_comments_page(post, after=None):
+    """Порция комментариев поста, новые сверху, по курсору ?after=."""
+    paginator = KeysetPaginator(
+        post.comments.select_related('author'), settings.COMMENTS_ON_PAGE
+    )
+    return paginator.get_page(after=after)
 
 
+@cache_shared_page(scope('pages'))
 def index(request):
     posts = Post.objects.select_related(
         'author',
         'group')
     context = {
-        'page_obj': get_page_posts(request.GET.get('page'), posts),
-        'cache_time': settings.CACHE_TIME
+        'page_obj': get_page_posts(request, posts),
+        'cache_time': settings.CACHE_TIME,
+        'cache_version': cache_version(scope('posts'))
     }
     return render(request, 'posts/index.html', context)
 
 
+@cache_shared_page(scope('pages'))
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     posts = group.posts.select_related('author')
     context = {
         'group': group,
-        'page_obj': get_page_posts(request.GET.get('page'), posts),
-        'group_posts_page': True
+        'page_obj': get_page_posts(
+            request, posts, group.posts_count,
+            lambda: reconcile_group(group.pk)
+        ),
+        'group_posts_page': True,
+        'cache_time': settings.CACHE_TIME,
+        'cache_version': cache_version(scope('group', group.pk))
     }
     return render(request, 'posts/group_list.html', context)
 
 
+@cache_shared_page(scope('pages'))
 def profile(request, username):
     author = get_object_or_404(
-        User,
+        User.objects.select_related('counters'),
         username=username
     )
+    counters = user_counters(author)
     author_posts = author.posts.select_related('group')
+    if settings.RECENT_POSTS_FEEDS:
+        author_posts = RecentFeed([author.pk], QuerySetFeed(author_posts))
+
+    def recount():
+        reconcile_user(author.pk)
+        counters.refresh_from_db()
+
     context = {
-        'page_obj': get_page_posts(request.GET.get('page'), author_posts),
+        'page_obj': get_page_posts(
+            request, author_posts, counters.posts_count, recount
+        ),
         'author': author,
-        'editable': author == request.user,
-        'following': (
-            request.user.is_authenticated
-            and author.following.filter(user=request.user).exists()
-        )
+        'counters': counters,
+        'cache_time': settings.CACHE_TIME,
+        'cache_version': cache_version(scope('author', author.pk))
     }
     return render(request, 'posts/profile.html', context)
 
 
+@cache_shared_page(scope('pages'))
 def post_detail(request, post_id):
     post = get_object_or_404(
-        Post.objects.select_related('author', 'group'),
+        Post.objects.select_related('author__counters', 'group'),
         pk=post_id
     )
-    comments = post.comments.select_related('author')
     context = {
         'post': post,
-        'posts_count': post.author.posts.count(),
-        'form': CommentForm(),
-        'comments': comments
+        'posts_count': user_counters(post.author).posts_count,
+        'comments': get_comments_page(post),
+        'cache_time': settings.CACHE_TIME,
+        'cache_version': cache_version(
+            scope('post', post.pk), scope('author', post.author_id)
+        )
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    if query:
+        paginator = KeysetPaginator(SearchFeed(query), settings.POSTS_ON_PAGE)
+        page_obj = paginator.get_page(
+            after=request.GET.get('after'),
+            before=request.GET.get('before')
+        )
+    context = {
+        'query': query,
+        'page_obj': page_obj
+    }
+    return render(request, 'posts/search.html', context)
+
+
+def post_comments(request, post_id):
+    """Фрагмент со следующей порцией комментариев для кнопки
+    «Показать еще»."""
+    post = get_object_or_404(Post.objects.only('author'), pk=post_id)
+    context = {
+        'post': post,
+        'comments': get_comments_page(post, request.GET.get('after')),
+        'cache_time': settings.CACHE_TIME,
+        'cache_version': cache_version(
+            scope('post', post.pk), scope('author', post.author_id)
+        )
+    }
+    return render(request, 'posts/includes/comment_list.html', context)
+
+
 @login_required
 def post_create(request):
     post_form = PostForm(
@@ -115,11 +198,17 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(
-        author__following__user=request.user
-    ).select_related('author', 'group')
-    context = {'page_obj': get_page_posts(request.GET.get('page'), posts)}
-    return render(request, 'posts/follow.html', context)
+    feed = follow_feed(request.user)
+    context = {
+        'page_obj': get_page_posts(request, feed),
+        'cache_time': settings.CACHE_TIME,
+        'cache_version': cache_version(
+            scope('posts'), scope('follower', request.user.pk)
+        )
+    }
+    response = render(request, 'posts/follow.html', context)
+    response['X-Feed-Path'] = feed.path
+    return response
 
 
 @login_required
@@ -0,0 +1,24 @@
+// Подгрузка следующей порции комментариев без перезагрузки страницы.
+// Ответ posts:post_comments - готовый HTML порции вместе со ссылкой
+// на следующую, он заменяет нажатую ссылку.
+document.addEventListener('click', function (event) {
+  var link = event.target.closest('[data-load-comments]');
+  if (!link) {
+    return;
+  }
+  event.preventDefault();
+  link.classList.add('disabled');
+  fetch(link.href, {credentials: 'same-origin'})
+    .then(function (response) {
+      if (!response.ok) {
+        throw new Error(response.status);
+      }
+      return response.text();
+    })
+    .then(function (html) {
+      link.parentElement.outerHTML = html;
+    })
+    .catch(function () {
+      link.classList.remove('disabled');
+    });
+});
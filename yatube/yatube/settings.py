@@ -57,6 +57,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # после CsrfViewMiddleware: куски страниц выставляют CSRF-куку
+    'core.holes.HoleMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -145,16 +147,116 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 # Yatube application settings
 POSTS_ON_PAGE = 10
+# Комментарии под постом подгружаются порциями по курсору
+COMMENTS_ON_PAGE = 20
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Загрузки пишутся на диск по частям, а не собираются в памяти;
+# файлы больше UPLOAD_MAX_SIZE обрезаются при приеме (core.uploads)
+FILE_UPLOAD_HANDLERS = (
+    'core.uploads.LimitedUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+)
+UPLOAD_MAX_SIZE = 10 * 1024 * 1024
+# Картинки больше стольких пикселей не принимаются, не декодируясь
+UPLOAD_MAX_PIXELS = 40 * 10 ** 6
+# Картинки с большей стороной длиннее этой уменьшаются при загрузке
+UPLOAD_MAX_SIDE = 2560
+# Сколько картинок процесс уменьшает одновременно
+UPLOAD_RESIZE_WORKERS = 2
+# Сохранять пост сразу, а нормализацию картинки и миниатюры делать
+# в фоне (posts.processing); до конца обработки выводится заглушка
+IMAGE_PROCESSING_ASYNC = False
+
+# Миниатюры создаются заранее, в фоне (core.thumbnails):
+# имя набора -> (geometry, параметры sorl-thumbnail, sizes для srcset)
+THUMBNAIL_PRESETS = {
+    'post_card': (
+        '800x600', {'crop': 'center', 'upscale': True},
+        '(min-width: 768px) 40vw, 100vw'
+    ),
+    'post_detail': (
+        'x400', {'crop': 'center', 'upscale': True},
+        '(min-width: 992px) 50vw, 100vw'
+    ),
+    'post_profile': (
+        '600x400', {'upscale': True},
+        '(min-width: 768px) 600px, 100vw'
+    ),
+}
+# Доли размера набора - ширины вариантов для srcset
+THUMBNAIL_SCALES = (0.5, 1)
+# Форматы вариантов; первый - запасной для img, остальные - для <picture>
+THUMBNAIL_FORMATS = ('JPEG', 'WEBP')
+# Хранилище ключей sorl-thumbnail с чтением миниатюр страницы разом
+THUMBNAIL_KVSTORE = 'core.thumbnails.KVStore'
+# Сколько секунд считать создание миниатюр уже запланированным
+THUMBNAIL_PENDING_TIMEOUT = 300
+
+# Кеш двухуровневый (core.cache.TieredCache): LRU в памяти процесса
+# поверх общего кеша 'shared'. В режиме разработки процесс один, и общий
+# уровень - LocMemCache. В боевом режиме воркеров несколько: общий
+# уровень - кеш в общей памяти узла (core.shmcache, или memcached, если
+# он есть), а об измененных ключах воркеры узнают из журнала
+# COHERENCE_FILE (core.coherence) и сразу выбрасывают свои локальные
+# копии. Сравнить бэкенды: python manage.py benchmark_cache.
+SHARED_CACHE_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else BASE_DIR
 CACHES = {
     'default': {
+        'BACKEND': 'core.cache.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 60,
+            # сколько отдавать устаревший фрагмент, пока его пересчитывают
+            'STALE_TIME': 60,
+            'LOCK_TIMEOUT': 30,
+            'COHERENCE_FILE': None if DEBUG else os.path.join(
+                BASE_DIR, 'cache_journal'
+            ),
+        },
+    },
+    'shared': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    } if DEBUG else {
+        'BACKEND': 'core.shmcache.SharedMemoryCache',
+        'LOCATION': os.path.join(SHARED_CACHE_DIR, 'yatube_cache'),
+        # значения больше слота сжимаются, а не влезшие - не кешируются
+        'OPTIONS': {'SLOTS': 4096, 'SLOT_SIZE': 64 * 1024, 'WAYS': 8},
+    },
 }
 
-CACHE_TIME = 20
+# Фрагменты шаблонов хранятся бессрочно: в их ключ входит версия
+# области кеша, которую сбрасывают сигналы моделей (core.invalidation)
+CACHE_TIME = None
+
+# Кеш целых страниц (core.pagecache) и сколько секунд браузер и CDN
+# могут не перепроверять анонимную страницу
+PAGE_CACHE_ENABLED = True
+PAGE_CACHE_MAX_AGE = 0
+# Сколько секунд один воркер может пересобирать страницу, пока
+# остальные отдают прежнюю
+PAGE_CACHE_LOCK_TIMEOUT = 30
+
+# Фоновые задачи (core.tasks). В режиме разработки выполняются
+# сразу в запросе, в боевом режиме - в пуле потоков после коммита.
+TASKS_ALWAYS_EAGER = DEBUG
+TASKS_WORKERS = 2
+
+# Сколько записей ленты подписок вставлять за один запрос
+TIMELINE_BATCH_SIZE = 500
+
+# Посты авторов, у которых подписчиков не меньше порога, не раскладываются
+# по лентам подписчиков, а подтягиваются при чтении ленты
+TIMELINE_PULL_THRESHOLD = 10000
+TIMELINE_PULL_AUTHORS_CACHE_TIME = 60 * 10
+
+# Кеш ключей последних постов каждого автора
+RECENT_POSTS_LIMIT = 200
+RECENT_POSTS_CACHE_TIME = 60 * 60
+# Собирать первые страницы ленты подписок и профиля из этого кеша
+RECENT_POSTS_FEEDS = False
@@ -18,6 +18,8 @@ from django.urls import include, path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from core.views import media
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -34,5 +36,6 @@ handler500 = 'core.views.internal_server_error'
 if settings.DEBUG:
     urlpatterns += static(
         settings.MEDIA_URL,
+        view=media,
         document_root=settings.MEDIA_ROOT
     )